@@ -0,0 +1,75 @@
+"""
+Import time benchmark for the dbops modules.
+Author Stuart Ianna
+
+Each module is imported in a fresh interpreter and the time taken by the import statement is
+measured. The run fails if a module imports one of the heavy dependencies it should only load
+on first use, or if the median import time is above the budget.
+
+Usage:
+
+    python3 benchmarks/import_time.py --output benchmarks/import_time.json --budget 0.1
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules short lived collectors import, and the dependencies they must not load until used.
+MODULES = ('dbops', 'dbops.sqhelper', 'dbops.influxhelper', 'dbops.outbox', 'dbops.timeconverter',
+           'dbops.arraycolumn')
+HEAVY = ('pandas', 'numpy', 'influxdb', 'dateutil', 'pyrfc3339', 'requests')
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module, repeat):
+    """ Import a module in repeat fresh interpreters
+
+    Returns:
+    result (dict): The median import time in seconds and the heavy dependencies loaded.
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY)], cwd=ROOT,
+                                check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        runs.append(json.loads(output))
+    return {'seconds': statistics.median(run['seconds'] for run in runs), 'loaded': runs[0]['loaded']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the import time of the dbops modules.')
+    parser.add_argument('--repeat', type=int, default=5, help='The number of interpreters each module is timed in.')
+    parser.add_argument('--budget', type=float, default=0.1, help='The maximum median import time in seconds.')
+    parser.add_argument('--output', help='The JSON file to write results to.')
+    args = parser.parse_args(argv)
+
+    results = {module: measure(module, args.repeat) for module in MODULES}
+    failures = []
+    for module, result in results.items():
+        print("{:<24} {:>8.1f} ms  loaded {}".format(module, result['seconds'] * 1000, result['loaded'] or 'nothing'))
+        if len(result['loaded']) > 0:
+            failures.append("{} imports {} at load".format(module, ', '.join(result['loaded'])))
+        if result['seconds'] > args.budget:
+            failures.append("{} took {:.1f} ms, budget {:.1f} ms".format(
+                module, result['seconds'] * 1000, args.budget * 1000))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    for failure in failures:
+        print("REGRESSION " + failure)
+    return 1 if len(failures) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""
+Benchmarks for the SQHelper and InfluxHelper hot paths.
+Author Stuart Ianna
+
+Each case is run for every row count, column width, input type and PRAGMA setting given, and
+reports the throughput (rows per second) and latency percentiles of each call. InfluxHelper is
+benchmarked against a local FakeInfluxServer, so no influxDB service is needed.
+
+Results are written as JSON. If a baseline file is given, each case is compared with it and the
+run fails if throughput drops, or p95 latency rises, by more than the threshold. A missing baseline
+file also fails the run (exit status 2), so a comparison is never silently skipped.
+
+Usage:
+
+    # Run the default sizes and compare with the saved baseline
+    python3 benchmarks/run.py --output benchmarks/results.json --baseline benchmarks/baseline.json
+
+    # Save a new baseline, including the largest tables
+    python3 benchmarks/run.py --sizes 1000 10000 100000 1000000 10000000 --output benchmarks/baseline.json
+
+    # Only run some cases
+    python3 benchmarks/run.py --cases sqhelper_insert influxhelper_insert
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dbops.sqhelper import SQHelper  # noqa: E402
+from dbops.influxhelper import InfluxHelper  # noqa: E402
+from dbops.fakeinflux import FakeInfluxServer  # noqa: E402
+from dbops._version import __version__  # noqa: E402
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_WIDTHS = (2, 10)
+INPUT_TYPES = ('dict', 'list', 'dataframe')
+PRAGMAS = {
+    'default': [],
+    'wal': ['PRAGMA journal_mode=WAL', 'PRAGMA synchronous=NORMAL'],
+    'memory': ['PRAGMA journal_mode=MEMORY', 'PRAGMA synchronous=OFF'],
+}
+# Dictionaries and lists are inserted one row (and one commit) per call, larger sizes take too long.
+PER_ROW_LIMIT = 10000
+DATAFRAME_BATCH = 10000
+RANGE_QUERIES = 20
+READ_WORKERS = max(min(os.cpu_count() or 1, 8), 2)
+TABLE = 'bench'
+
+
+def make_frame(rows, width, seed=0):
+    """ Create a dataframe with a 'timestamp' column and width - 1 float columns """
+    rng = np.random.default_rng(seed)
+    columns = {'timestamp': np.arange(1585848415, 1585848415 + rows, dtype='int64')}
+    for i in range(width - 1):
+        columns['value_{:02d}'.format(i)] = rng.random(rows)
+    return pd.DataFrame(columns)
+
+
+def open_database(directory, pragma, width):
+    """ Create an empty sqlite3 database with a benchmark table, using the given PRAGMA setting """
+    path = os.path.join(directory, 'bench_{}.sql'.format(time.monotonic_ns()))
+    database = SQHelper(path)
+    for statement in PRAGMAS[pragma]:
+        database.con.execute(statement)
+    database.create_table(TABLE, {c: ('NUMERIC' if c == 'timestamp' else 'REAL') for c in make_frame(0, width)})
+    return database
+
+
+def fill_database(database, rows, width):
+    """ Insert rows into the benchmark table in batches, without timing """
+    for start in range(0, rows, DATAFRAME_BATCH):
+        database.insert(TABLE, make_frame(min(DATAFRAME_BATCH, rows - start), width, seed=start)
+                        .assign(timestamp=lambda df: df['timestamp'] + start))
+
+
+def iterate_inputs(df, input_type):
+    """ Yield the arguments of each insert call for an input type """
+    if input_type == 'dataframe':
+        for start in range(0, len(df), DATAFRAME_BATCH):
+            yield df.iloc[start:start + DATAFRAME_BATCH]
+    elif input_type == 'dict':
+        yield from df.to_dict(orient='records')
+    else:
+        yield from (list(row) for row in df.itertuples(index=False, name=None))
+
+
+def timed_calls(calls):
+    """ Run each callable, returning the duration of each call in seconds """
+    durations = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+# Each benchmark returns the number of rows written or read, and the duration of each call.
+def bench_sqhelper_insert(directory, rows, width, input_type, pragma):
+    database = open_database(directory, pragma, width)
+    inputs = list(iterate_inputs(make_frame(rows, width), input_type))
+    durations = timed_calls(lambda values=values: database.insert(TABLE, values) for values in inputs)
+    database.con.close()
+    return rows, durations
+
+
+def bench_sqhelper_table_to_df(directory, rows, width, input_type, pragma):
+    database = open_database(directory, pragma, width)
+    fill_database(database, rows, width)
+    durations = timed_calls([lambda: database.table_to_df(TABLE)])
+    database.con.close()
+    return rows, durations
+
+
+def bench_sqhelper_table_to_df_workers(directory, rows, width, input_type, pragma):
+    database = open_database(directory, pragma, width)
+    fill_database(database, rows, width)
+    durations = timed_calls([lambda: database.table_to_df(TABLE, workers=READ_WORKERS)])
+    database.con.close()
+    return rows, durations
+
+
+def bench_sqhelper_get_row_range(directory, rows, width, input_type, pragma):
+    database = open_database(directory, pragma, width)
+    fill_database(database, rows, width)
+    # Each query reads a different tenth of the table.
+    span = max(rows // 10, 1)
+    starts = [1585848415 + (i * span) % max(rows - span, 1) for i in range(RANGE_QUERIES)]
+    durations = timed_calls(lambda start=start: database.get_row_range(TABLE, 'timestamp', start, start + span - 1)
+                            for start in starts)
+    database.con.close()
+    return span * RANGE_QUERIES, durations
+
+
+def bench_influxhelper_insert(directory, rows, width, input_type, pragma):
+    df = make_frame(rows, width)
+    fields = list(df.columns[1:])
+    with FakeInfluxServer() as server:
+        database = InfluxHelper('bench', port=server.port)
+        inputs = list(iterate_inputs(df, input_type))
+        if input_type == 'list':
+            # InfluxHelper takes dictionaries or dataframes, lists are given as one row dataframes.
+            inputs = [pd.DataFrame([values], columns=df.columns) for values in inputs]
+        durations = timed_calls(lambda values=values: database.insert('bench', values, fields, [], use_timestamp=True)
+                                for values in inputs)
+    return rows, durations
+
+
+# Each case lists the input types and PRAGMA settings it is run with, reads are the same for any input type.
+CASES = {
+    'sqhelper_insert': (bench_sqhelper_insert, INPUT_TYPES, tuple(PRAGMAS)),
+    'sqhelper_table_to_df': (bench_sqhelper_table_to_df, ('dataframe', ), tuple(PRAGMAS)),
+    'sqhelper_table_to_df_workers': (bench_sqhelper_table_to_df_workers, ('dataframe', ), ('wal', )),
+    'sqhelper_get_row_range': (bench_sqhelper_get_row_range, ('dataframe', ), tuple(PRAGMAS)),
+    'influxhelper_insert': (bench_influxhelper_insert, INPUT_TYPES, ('default', )),
+}
+
+
+def summarise(runs, rows):
+    """ Summarise the call durations of repeated runs, using the median run for throughput
+
+    Parameters:
+    runs (list): The number of rows written or read, and the duration of each call, of each run.
+    rows (int): The size of the table.
+    """
+    totals = [sum(durations) for _, durations in runs]
+    durations = np.array(list(itertools.chain.from_iterable(durations for _, durations in runs)))
+    p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+    return {
+        'rows': rows,
+        'calls': len(runs[0][1]),
+        'seconds': statistics.median(totals),
+        'rows_per_second': runs[0][0] / max(statistics.median(totals), 1e-9),
+        'latency_p50': float(p50),
+        'latency_p95': float(p95),
+        'latency_p99': float(p99),
+    }
+
+
+def run(cases, sizes, widths, repeat):
+    """ Run the benchmarks, returning the summary of each case keyed by its name and parameters """
+    results = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        for name in cases:
+            function, input_types, pragmas = CASES[name]
+            for rows, width, input_type, pragma in itertools.product(sizes, widths, input_types, pragmas):
+                key = '{}[rows={},width={},input={},pragma={}]'.format(name, rows, width, input_type, pragma)
+                if input_type != 'dataframe' and rows > PER_ROW_LIMIT:
+                    log.info("Skipping {}, more than {} rows inserted one at a time".format(key, PER_ROW_LIMIT))
+                    continue
+                runs = [function(directory, rows, width, input_type, pragma) for _ in range(repeat)]
+                results[key] = summarise(runs, rows)
+                print("{:<80} {:>14,.0f} rows/s  p95 {:.6f}s".format(
+                    key, results[key]['rows_per_second'], results[key]['latency_p95']))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Compare results with a baseline
+
+    Returns:
+    regressions (list): A description of each case which is slower than the baseline by more than the threshold.
+    """
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        if result['rows_per_second'] < previous['rows_per_second'] * (1 - threshold):
+            regressions.append("{}: throughput {:,.0f} rows/s, baseline {:,.0f} rows/s".format(
+                key, result['rows_per_second'], previous['rows_per_second']))
+        if result['latency_p95'] > previous['latency_p95'] * (1 + threshold):
+            regressions.append("{}: p95 latency {:.6f}s, baseline {:.6f}s".format(
+                key, result['latency_p95'], previous['latency_p95']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the SQHelper and InfluxHelper hot paths.')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(DEFAULT_SIZES), help='Row counts to run.')
+    parser.add_argument('--widths', nargs='+', type=int, default=list(DEFAULT_WIDTHS),
+                        help='Column counts to run, including the timestamp column.')
+    parser.add_argument('--repeat', type=int, default=3, help='The number of runs of each case.')
+    parser.add_argument('--output', help='The JSON file to write results to.')
+    parser.add_argument('--baseline', help='A JSON results file to compare with, exits with 2 if it does not exist.')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='The allowed fraction of slowdown before a case counts as a regression.')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    logging.getLogger('dbops').setLevel(logging.CRITICAL)
+    results = run(args.cases, args.sizes, args.widths, args.repeat)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'dbops': __version__,
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'created': time.time(),
+                    'repeat': args.repeat,
+                },
+                'results': results
+            }, f, indent=2, sort_keys=True)
+
+    if args.baseline is None:
+        return 0
+    if not os.path.exists(args.baseline):
+        print("WARNING No baseline at {}, nothing was compared. Create one with 'make bench-baseline' "
+              "(or 'make bench-full-baseline'), or run without --baseline.".format(args.baseline), file=sys.stderr)
+        return 2
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    if len(regressions) > 0:
+        return 1
+    print("No regressions against {} (threshold {:.0%}).".format(args.baseline, args.threshold))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
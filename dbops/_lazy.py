@@ -0,0 +1,38 @@
+"""
+Lazy: Helpers for importing heavy dependencies the first time they are used.
+Author Stuart Ianna
+"""
+
+import importlib
+import sys
+
+
+class LazyModule():
+    """ A module which is imported the first time one of its attributes is used
+
+    >>> pd = LazyModule('pandas')
+    >>> pd.DataFrame  # pandas is imported here
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+
+    def __getattr__(self, attribute):
+        value = getattr(importlib.import_module(self._name), attribute)
+        # Later lookups find the attribute directly, without calling __getattr__.
+        self.__dict__[attribute] = value
+        return value
+
+    def __repr__(self):
+        return "<lazy module '{}'>".format(self._name)
+
+
+def is_dataframe(obj):
+    """ Check if an object is a pandas DataFrame, without importing pandas """
+    pandas = sys.modules.get('pandas')
+    return pandas is not None and type(obj) is pandas.DataFrame
+
+
+def is_series(obj):
+    """ Check if an object is a pandas Series, without importing pandas """
+    pandas = sys.modules.get('pandas')
+    return pandas is not None and isinstance(obj, pandas.Series)
@@ -0,0 +1,156 @@
+"""
+ArrayColumn: Single class module for storing NumPy arrays in sqlite3 BLOB columns.
+Author Stuart Ianna
+"""
+
+from dbops._lazy import LazyModule
+import logging
+import zlib
+import re
+
+log = logging.getLogger(__name__)
+
+np = LazyModule('numpy')
+
+COMPRESSIONS = (None, 'zlib')
+# e.g ARRAY(float32, 1024), ARRAY(int16, (2, 512), zlib) or ARRAY(float64) for any length.
+DECLARED_TYPE = re.compile(r'^\s*ARRAY\(\s*(\w+)\s*(?:,\s*(\d+|\([\d,\s]*\)|None)\s*)?(?:,\s*(\w+)\s*)?\)\s*$',
+                           re.IGNORECASE)
+
+
+def ARRAY(dtype, shape=None, compression=None):
+    """ Get the declared type of an array column, for SQHelper.create_table
+
+    >>> database.create_table('Waveform', {'timestamp': 'INTEGER', 'samples': ARRAY('float32', 1024)})
+
+    Parameters:
+    dtype (str): The NumPy data type of the array, e.g 'float32'.
+    shape (int, tuple): The shape of each array, None for one dimensional arrays of any length.
+    compression (str): None, or 'zlib' to compress each array (reads are then copies, not views).
+
+    Returns:
+    The declared type, quoted so sqlite3 accepts it, e.g '"ARRAY(float32, 1024)"'.
+    """
+    column = ArrayColumn(dtype, shape, compression)
+    return '"{}"'.format(column)
+
+
+class ArrayColumn():
+    """Class for converting NumPy arrays to and from the BLOBs stored in an ARRAY column
+
+    Arrays are stored as their raw little-endian, C ordered bytes, optionally compressed. Reads of
+    uncompressed arrays are read-only np.frombuffer views of the BLOB sqlite3 returned, no copy is made.
+    Many arrays of a fixed shape are stacked into one (rows, *shape) array with a single copy.
+
+    The logging module is used to log errors and warnings.
+
+    Typical Usage:
+
+    >>> column = ArrayColumn.parse('ARRAY(float32, 4)')
+    >>> blob = column.to_blob([1, 2, 3, 4])
+    >>> column.from_blob(blob)
+    array([1., 2., 3., 4.], dtype=float32)
+    >>> column.stack([blob, blob]).shape
+    (2, 4)
+
+    Attributes:
+        - dtype (str) - The NumPy data type of the arrays
+        - shape (tuple) - The shape of each array, None for one dimensional arrays of any length
+        - compression (str) - None, or 'zlib' if each array is compressed
+    """
+    def __init__(self, dtype, shape=None, compression=None):
+        """ Create a column of arrays of a data type and shape
+
+        Parameters:
+        dtype (str): The NumPy data type of the arrays, e.g 'float32'. Byte order is always little-endian.
+        shape (int, tuple): The shape of each array, None for one dimensional arrays of any length.
+        compression (str): None, or 'zlib' to compress each array.
+
+        Raises:
+        ValueError: The data type, shape or compression is not supported.
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError("Unknown compression {}, expected one of {}".format(compression, COMPRESSIONS))
+        dtype = np.dtype(dtype)
+        if dtype.hasobject or dtype.fields is not None:
+            raise ValueError("Array columns can't hold {} values".format(dtype))
+        self.dtype = dtype.name
+        self.shape = (shape, ) if type(shape) is int else (tuple(shape) if shape is not None else None)
+        self.compression = compression
+        self.__dtype = dtype.newbyteorder('<')
+
+    @classmethod
+    def parse(cls, declared):
+        """ Create a column from a declared column type, e.g 'ARRAY(float32, 1024)'
+
+        Returns:
+        The column, or None if the declared type is not an array (or is not valid).
+        """
+        match = DECLARED_TYPE.match(declared)
+        if match is None:
+            return None
+        dtype, shape, compression = match.groups()
+        if shape is None or shape == 'None':
+            shape = None
+        else:
+            shape = tuple(int(size) for size in shape.strip('()').split(',') if size.strip() != '')
+        try:
+            return cls(dtype, shape, compression.lower() if compression is not None else None)
+        except (TypeError, ValueError) as e:
+            log.error("Cannot use array column type {}. Exception: {}".format(declared, e))
+            return None
+
+    def to_blob(self, value):
+        """ Convert an array (or anything np.asarray accepts) to the bytes stored in the column
+
+        Raises:
+        ValueError: The array doesn't have the column's shape, or can't be converted to its data type.
+        """
+        array = np.asarray(value)
+        if self.shape is None and array.ndim != 1:
+            raise ValueError("Expected a one dimensional array, got shape {}".format(array.shape))
+        if self.shape is not None and array.shape != self.shape:
+            raise ValueError("Expected an array of shape {}, got shape {}".format(self.shape, array.shape))
+        data = np.ascontiguousarray(array, dtype=self.__dtype).tobytes()
+        if self.compression == 'zlib':
+            data = zlib.compress(data)
+        return data
+
+    def from_blob(self, blob):
+        """ Convert the bytes stored in the column to an array
+
+        Returns:
+        A read-only view of the BLOB if uncompressed, a new array if compressed, None if blob is None.
+        """
+        if blob is None:
+            return None
+        if self.compression == 'zlib':
+            blob = zlib.decompress(blob)
+        array = np.frombuffer(blob, dtype=self.__dtype)
+        return array.reshape(self.shape) if self.shape is not None else array
+
+    def stack(self, blobs):
+        """ Convert the bytes stored in many rows to a single (rows, *shape) array
+
+        The BLOBs are joined and viewed as one array, copying the data once. Rows of one dimensional
+        columns of any length, or with missing (None) values, can't be stacked.
+
+        Returns:
+        The array, or None if the rows can't be stacked.
+        """
+        if self.shape is None or any(blob is None for blob in blobs):
+            return None
+        if self.compression == 'zlib':
+            blobs = [zlib.decompress(blob) for blob in blobs]
+        return np.frombuffer(b''.join(blobs), dtype=self.__dtype).reshape((len(blobs), ) + self.shape)
+
+    def __str__(self):
+        shape = 'None' if self.shape is None else (str(self.shape[0]) if len(self.shape) == 1 else str(self.shape))
+        compression = '' if self.compression is None else ', ' + self.compression
+        return "ARRAY({}, {}{})".format(self.dtype, shape, compression)
+
+    def __eq__(self, other):
+        return isinstance(other, ArrayColumn) and str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
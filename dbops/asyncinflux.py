@@ -0,0 +1,290 @@
+"""
+AsyncInflux: Single class module for working with influxdb databases from asyncio.
+Author Stuart Ianna
+"""
+
+from dbops.influxhelper import DEFAULT_CHUNK_SIZE, _build_time_filter, _dataframe_to_lines, _dict_to_line, \
+    _series_to_df
+from dbops._lazy import LazyModule, is_dataframe
+from urllib.parse import urlencode
+import asyncio
+import logging
+import json
+
+log = logging.getLogger(__name__)
+
+pd = LazyModule('pandas')
+influxdb_exceptions = LazyModule('influxdb.exceptions')
+
+
+class AsyncInfluxHelper():
+    """Class for working with a single influx database from asyncio code
+
+    Requests are made over a pool of keep-alive HTTP connections, so several inserts and queries can be
+    in flight at once. The number of concurrent requests is limited by max_requests, further requests
+    wait for one to finish. No extra dependencies are needed, asyncio streams are used directly.
+
+    The logging module is used to log errors and warnings.
+
+    Typical Usage:
+
+    >>> async def collect():
+    ...     async with AsyncInfluxHelper('database_name', max_requests=10) as database:
+    ...         await asyncio.gather(*(database.insert('Environment', entry, ['temperature'], ['room'])
+    ...                                for entry in entries))
+    ...         return await database.get_last_time_entry('Environment', 'temperature', as_unix=True)
+    >>> asyncio.run(collect())
+    {'time': 1585848415, 'last': 23.3}
+
+    Attributes:
+        - host (str) - The influxDB host name
+        - port (int) - The influxDB HTTP port
+        - max_requests (int) - The maximum number of requests in flight, and connections kept open
+        - timeout (float) - The number of seconds to wait for a response, None waits forever
+    """
+    def __init__(self, db_name, host='localhost', port=8086, max_requests=10, timeout=None):
+        """ Set up the connection details, no connection is made until connect() is awaited
+
+        Parameters:
+        db_name (str): The name of the database
+        host (str): The host name of the influxDB service.
+        port (int): The HTTP port of the influxDB service.
+        max_requests (int): The maximum number of requests in flight, and connections kept open.
+        timeout (float): The number of seconds to wait for a response, None waits forever.
+        """
+        self.__db_name = db_name
+        self.host = host
+        self.port = port
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.__connected = False
+        self.__semaphore = None
+        self.__idle = []
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def connect(self):
+        """ Connect to the influxDB and create the database if it doesn't exist
+
+        Returns:
+        True: The database exists and is usable.
+        False: An error occured, check logs for info.
+        """
+        try:
+            await self.__query('CREATE DATABASE "{}"'.format(self.__db_name), method='POST')
+        except Exception as e:
+            log.critical("Cannot create database {}, is influx service started?. Exception {}".format(
+                self.__db_name, e))
+            return False
+        self.__connected = True
+        return True
+
+    def exists(self):
+        """ Check if connect() succeeded
+
+        Returns:
+        - True: Everything is setup correctly
+        - False: The database isn't usable.
+        """
+        return self.__connected
+
+    async def close(self):
+        """ Close all pooled connections """
+        while len(self.__idle) > 0:
+            reader, writer = self.__idle.pop()
+            writer.close()
+        self.__connected = False
+
+    async def insert(self, measurement, data, field_keys, tag_keys, use_timestamp=False):
+        """ Insert one or more entries into a measurement, the same as InfluxHelper.insert
+
+        Parameters:
+        measurement (str): The measurement to add the data to
+        data (dict, DataFrame): The data to add to the measurement
+        field_keys (list): The dictionary keys or dataframe columns to use for the field entries.
+        tag_keys (list): The dictionary keys or dataframe columns to use for the tag entries.
+        use_timestamp (Boolean):
+        -True: The dictionary's 'timestamp' key or dataframe's timestamp column is used in the influxDB timestamp.
+        -False: The server's time is used.
+
+        Returns:
+        True: No error occured, data was added to the database.
+        False: Some error occured, check logs for info
+        """
+        if not self.__connected or type(field_keys) is not list:
+            return False
+        try:
+            if type(data) is dict:
+                lines = [_dict_to_line(measurement, data, field_keys, tag_keys, use_timestamp)]
+            elif is_dataframe(data):
+                lines = _dataframe_to_lines(measurement, data, field_keys, tag_keys, use_timestamp)
+            else:
+                return False
+        except Exception as e:
+            log.error("Cannot serialise entry for measurement {}. Exception {}".format(measurement, e))
+            return False
+        if len(lines) == 0:
+            return True
+        try:
+            await self.__request('POST', '/write', {'db': self.__db_name, 'precision': 'n'},
+                                 '\n'.join(lines).encode('utf-8'))
+        except Exception as e:
+            log.error("Cannot add {} entries to measurement {}. Exception {}".format(len(lines), measurement, e))
+            return False
+        return True
+
+    async def get_last_time_entry(self, measurement, field, tag=None, tag_value=None, as_unix=False):
+        """ Get the last time entry for a given query, the same as InfluxHelper.get_last_time_entry
+
+        Returns:
+        entry (dict):
+            'time': The timestamp in the requested format
+            'last': The value of the field at this timestamp
+        - None if no entry exists or an error occured.
+        """
+        if not self.__connected:
+            return None
+        query = "SELECT last({}) FROM {}".format(field, measurement)
+        if tag is not None and tag_value is not None:
+            query = query + " WHERE {} ='{}'".format(tag, tag_value)
+        try:
+            results = await self.__query(query, epoch='s' if as_unix else None)
+        except Exception as e:
+            log.error("Cannot get last time entry from measurement {}. Exception {}".format(measurement, e))
+            return None
+        for series in results[0].get('series', []):
+            for values in series.get('values', []):
+                return dict(zip(series['columns'], values))
+        return None
+
+    async def query_range(self, measurement, fields, start, end, tags=None):
+        """ Get all entries of a measurement between two unix timestamps (inclusive), the same as InfluxHelper
+
+        Returns:
+        - A Pandas DataFrame with a 'timestamp' column followed by the requested fields.
+        - An empty DataFrame if no entries exist in the range.
+        - None if an error occured.
+        """
+        if not self.__connected or type(fields) is not list or len(fields) == 0:
+            return None
+        columns = ['timestamp'] + fields
+        query = "SELECT {} FROM {} WHERE {}".format(', '.join(fields), measurement,
+                                                    _build_time_filter(start, end, tags))
+        try:
+            results = await self.__query(query, epoch='s', chunked=True)
+        except Exception as e:
+            log.error("Cannot query measurement {}. Exception {}".format(measurement, e))
+            return None
+        frames = [_series_to_df(series, columns) for result in results for series in result.get('series', [])]
+        if len(frames) == 0:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+    async def __query(self, query, method='GET', epoch=None, chunked=False):
+        params = {'q': query, 'db': self.__db_name}
+        if epoch is not None:
+            params['epoch'] = epoch
+        if chunked:
+            params.update({'chunked': 'true', 'chunk_size': DEFAULT_CHUNK_SIZE})
+        body = await self.__request(method, '/query', params)
+        # Chunked responses hold one JSON document per chunk, each on its own line.
+        results = []
+        for document in body.decode('utf-8').splitlines():
+            if not document.strip():
+                continue
+            response = json.loads(document)
+            if 'error' in response:
+                raise influxdb_exceptions.InfluxDBClientError(response['error'])
+            for result in response.get('results', []):
+                if 'error' in result:
+                    raise influxdb_exceptions.InfluxDBClientError(result['error'])
+                results.append(result)
+        return results
+
+    async def __request(self, method, path, params, body=b''):
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.max_requests)
+        async with self.__semaphore:
+            request = self.__exchange(method, path, params, body)
+            if self.timeout is not None:
+                request = asyncio.wait_for(request, self.timeout)
+            status, content = await request
+        if status >= 500:
+            raise influxdb_exceptions.InfluxDBServerError(content)
+        if status >= 300:
+            raise influxdb_exceptions.InfluxDBClientError(content, status)
+        return content
+
+    async def __exchange(self, method, path, params, body):
+        head = "{} {}?{} HTTP/1.1\r\nHost: {}:{}\r\nAccept: application/json\r\nContent-Length: {}\r\n\r\n".format(
+            method, path, urlencode(params), self.host, self.port, len(body)).encode('latin-1')
+        while True:
+            reused = len(self.__idle) > 0
+            if reused:
+                reader, writer = self.__idle.pop()
+            else:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                writer.write(head + body)
+                await writer.drain()
+                status, content, keep_alive = await _read_response(reader, method)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    # The server closed the idle connection, try again on a new one.
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self.__idle.append((reader, writer))
+            else:
+                writer.close()
+            return status, content
+
+
+async def _read_response(reader, method='GET'):
+    """ Read a HTTP/1.1 response, returning the status, body and whether the connection can be reused
+
+    1xx, 204 and 304 responses, and responses to HEAD, have no body. influxd sends 204 for writes and
+    pings without a Content-Length, so reading to the end of the stream would wait for the server to
+    close the connection.
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by server")
+    status = int(status_line.split()[1])
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, value = line.decode('latin-1').split(':', 1)
+        headers[key.strip().lower()] = value.strip()
+
+    keep_alive = headers.get('connection', '').lower() != 'close'
+    if method == 'HEAD' or status < 200 or status in (204, 304):
+        body = b''
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+        body = bytes(body)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+        keep_alive = False
+    return status, body, keep_alive
@@ -0,0 +1,354 @@
+"""
+Bridge: Incremental replication between sqlite3 and influx databases.
+Author Stuart Ianna
+"""
+
+from dbops._lazy import LazyModule
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+pd = LazyModule('pandas')
+
+CHECKPOINT_TABLE = 'dbops_checkpoints'
+CHECKPOINT_COLUMNS = {'table_name': 'TEXT PRIMARY KEY', 'position': 'NUMERIC', 'updated': 'NUMERIC'}
+SPAN_TABLE = 'dbops_cached_spans'
+SPAN_COLUMNS = {'table_name': 'TEXT PRIMARY KEY', 'span_start': 'NUMERIC', 'span_end': 'NUMERIC', 'updated': 'NUMERIC'}
+FIELD_TYPES = {'float': 'REAL', 'integer': 'INTEGER', 'string': 'TEXT', 'boolean': 'INTEGER'}
+
+
+class SQInfluxBridge():
+    """Class for mirroring tables of a single sqlite3 database into an influx database
+
+    Only rows added since the last sync are sent. The position (high-water mark) reached in each table
+    is stored in a checkpoint table inside the sqlite3 file, so replication resumes where it stopped
+    after a restart. Rows are read and written in chunks, keeping memory use bounded.
+
+    Each row is written with its 'timestamp' column as the influxDB timestamp. A chunk which was written
+    but not checkpointed before a crash is sent again on restart, and overwrites the identical points
+    rather than duplicating them.
+
+    The logging module is used to log errors and warnings.
+
+    Typical Usage:
+
+    >>> bridge = SQInfluxBridge(SQHelper('database.db'), InfluxHelper('database_name'))
+    >>> bridge.add_table('temperature', tag_keys=['room'])
+    True
+
+    # Send all new rows once
+    >>> bridge.sync()
+    {'temperature': 2}
+
+    # Or keep sending new rows every 10 seconds until stop() is called
+    >>> bridge.run(interval=10)
+
+    Attributes:
+        - sqhelper (SQHelper) - The source sqlite3 database
+        - influxhelper (InfluxHelper) - The destination influx database
+        - chunksize (int) - The maximum number of rows read and written at a time
+    """
+    def __init__(self, sqhelper, influxhelper, chunksize=10000):
+        """ Create a bridge between a sqlite3 and influx database
+
+        Parameters:
+        sqhelper (SQHelper): The source sqlite3 database, the checkpoint table is created in it.
+        influxhelper (InfluxHelper): The destination influx database.
+        chunksize (int): The maximum number of rows read and written at a time.
+        """
+        self.sqhelper = sqhelper
+        self.influxhelper = influxhelper
+        self.chunksize = chunksize
+        self.__tables = dict()
+        self.__stop = threading.Event()
+        if sqhelper.exists():
+            sqhelper.create_table(CHECKPOINT_TABLE, CHECKPOINT_COLUMNS)
+
+    def add_table(self, table, measurement=None, field_keys=None, tag_keys=None, key='rowid'):
+        """ Add a table to replicate
+
+        Parameters:
+        table (str): The sqlite3 table to replicate, it must have a 'timestamp' column of unix timestamps.
+        measurement (str): The measurement to write to, the table name is used if None.
+        field_keys (list): The columns to write as fields, all columns except 'timestamp' and tags if None.
+        tag_keys (list): The columns to write as tags.
+        key (str): The column used as the high-water mark, it must only increase as rows are added:
+        -'rowid': The sqlite3 row id, suitable for tables which are only appended to.
+        -'timestamp' (or other column): Rows with a greater value than the last replicated are sent.
+
+        Returns:
+        True: The table exists and will be replicated.
+        False: The table doesn't exist or has no timestamp column.
+        """
+        columns = self.sqhelper.get_column_names(table)
+        if 'timestamp' not in columns or (key != 'rowid' and key not in columns):
+            log.error("Cannot replicate table {}, it needs a timestamp and {} column".format(table, key))
+            return False
+        tag_keys = list(tag_keys or [])
+        if field_keys is None:
+            field_keys = [c for c in columns if c != 'timestamp' and c not in tag_keys]
+        self.__tables[table] = {
+            'measurement': measurement or table,
+            'field_keys': list(field_keys),
+            'tag_keys': tag_keys,
+            'key': key
+        }
+        return True
+
+    def get_checkpoint(self, table):
+        """ Get the high-water mark reached for a table
+
+        Returns:
+        - The value of the table's key column for the last replicated row.
+        - None if nothing has been replicated yet.
+        """
+        row = self.sqhelper.con.execute("SELECT position FROM {} WHERE table_name = ?".format(CHECKPOINT_TABLE),
+                                        (table, )).fetchone()
+        return None if row is None else row[0]
+
+    def reset_checkpoint(self, table):
+        """ Forget the high-water mark for a table, the next sync replicates it from the start """
+        self.sqhelper.con.execute("DELETE FROM {} WHERE table_name = ?".format(CHECKPOINT_TABLE), (table, ))
+        self.sqhelper.con.commit()
+
+    def sync(self, table=None):
+        """ Send all rows added since the last sync to influx
+
+        Parameters:
+        table (str): The table to sync, all added tables if None.
+
+        Returns:
+        replicated (dict): The number of rows sent for each table. A table stops at the first chunk which
+        fails to write, the next sync retries from that chunk.
+        """
+        tables = self.__tables if table is None else [table]
+        return {t: self.__sync_table(t) for t in tables}
+
+    def run(self, interval=10):
+        """ Sync all tables continuously until stop() is called
+
+        The sqlite3 connection is used, so this must be called from the thread which created the SQHelper.
+
+        Parameters:
+        interval (float): The number of seconds to wait after a sync which found no new rows.
+        """
+        while not self.__stop.is_set():
+            replicated = self.sync()
+            if sum(replicated.values()) == 0:
+                self.__stop.wait(interval)
+        self.__stop.clear()
+
+    def stop(self):
+        """ Stop a running run() call after its current chunk """
+        self.__stop.set()
+
+    def __sync_table(self, table):
+        config = self.__tables[table]
+        replicated = 0
+        while not self.__stop.is_set():
+            chunk, position = self.__read_chunk(table, config['key'], self.get_checkpoint(table))
+            if chunk is None or len(chunk) == 0:
+                break
+            if not self.influxhelper.insert(config['measurement'], chunk, field_keys=config['field_keys'],
+                                            tag_keys=config['tag_keys'], use_timestamp=True):
+                log.error("Failed to replicate {} rows from table {}".format(len(chunk), table))
+                break
+            self.__set_checkpoint(table, position)
+            replicated += len(chunk)
+        return replicated
+
+    def __read_chunk(self, table, key, position):
+        cur = self.sqhelper.con.cursor()
+        where = '' if position is None else ' WHERE {} > ?'.format(key)
+        try:
+            cur.execute("SELECT {0} AS dbops_key, * FROM {1}{2} ORDER BY {0} LIMIT ?".format(key, table, where),
+                        (() if position is None else (position, )) + (self.chunksize, ))
+            rows = cur.fetchall()
+            if len(rows) == self.chunksize and key != 'rowid':
+                # Don't split rows sharing the last key value across chunks, they would be skipped by the next read.
+                last = rows[-1][0]
+                rows = [r for r in rows if r[0] != last]
+                if len(rows) == 0:
+                    cur.execute("SELECT {0} AS dbops_key, * FROM {1} WHERE {0} = ?".format(key, table), (last, ))
+                    rows = cur.fetchall()
+        except Exception as e:
+            log.error("Cannot read rows from table {}. Exception {}".format(table, e))
+            return None, position
+        if len(rows) == 0:
+            return pd.DataFrame(), position
+        columns = [d[0] for d in cur.description]
+        df = pd.DataFrame.from_records(rows, columns=columns)
+        return df.drop(columns='dbops_key'), rows[-1][0]
+
+    def __set_checkpoint(self, table, position):
+        self.sqhelper.con.execute("INSERT OR REPLACE INTO {} (table_name, position, updated) VALUES (?, ?, ?)".format(
+            CHECKPOINT_TABLE), (table, position, time.time()))
+        self.sqhelper.con.commit()
+
+
+class InfluxSQCache():
+    """Class for keeping a local sqlite3 copy of influx measurements
+
+    A measurement's entries over a time range are read from influx in chunks and inserted into a sqlite3
+    table of the same name (one row per entry). The table is created from the measurement's field and tag
+    keys, with an index on the 'timestamp' column. Fields added to the measurement after the table is created
+    are not copied. The time span held for each table is stored in a span
+    table inside the sqlite3 file, so only the part of a later request outside that span is read from influx.
+
+    The logging module is used to log errors and warnings.
+
+    Typical Usage:
+
+    >>> cache = InfluxSQCache(InfluxHelper('database_name'), SQHelper('cache.db'))
+
+    # Copy a day of entries into the sqlite3 table 'temperature'
+    >>> cache.export('temperature', 1585699200, 1585785599)
+    8640
+
+    # Read two days, only the second day is requested from influx
+    >>> df = cache.query_range('temperature', 1585699200, 1585871999)
+
+    Attributes:
+        - influxhelper (InfluxHelper) - The source influx database
+        - sqhelper (SQHelper) - The sqlite3 database holding the copies
+        - chunksize (int) - The maximum number of entries read from influx at a time
+    """
+    def __init__(self, influxhelper, sqhelper, chunksize=10000):
+        """ Create a cache of an influx database in a sqlite3 database
+
+        Parameters:
+        influxhelper (InfluxHelper): The source influx database.
+        sqhelper (SQHelper): The sqlite3 database to copy into, the span table is created in it.
+        chunksize (int): The maximum number of entries read from influx and inserted at a time.
+        """
+        self.influxhelper = influxhelper
+        self.sqhelper = sqhelper
+        self.chunksize = chunksize
+        if sqhelper.exists():
+            sqhelper.create_table(SPAN_TABLE, SPAN_COLUMNS)
+
+    def export(self, measurement, start, end, table=None, missing_only=False):
+        """ Copy a measurement's entries between two unix timestamps (inclusive) into a sqlite3 table
+
+        The entries are inserted in batches of chunksize within a single transaction, so the table and its
+        span are unchanged if the export fails part way.
+
+        Parameters:
+        measurement (str): The influx measurement to copy.
+        start (int): The unix timestamp to start from (inclusive).
+        end (int): The unix timestamp to end at (inclusive).
+        table (str): The sqlite3 table to copy into, the measurement name is used if None.
+        missing_only (bool):
+        -False: Rows already held in the range are replaced with the current influx entries.
+        -True: Only the part of the range outside the table's stored span is read from influx.
+
+        Returns:
+        - The number of entries copied.
+        - None if an error occured, nothing is changed in the sqlite3 database.
+        """
+        table = table or measurement
+        columns = self.__create_table(measurement, table)
+        if columns is None:
+            return None
+
+        span = self.get_span(table)
+        start, end = int(start), int(end)
+        if span is None:
+            new_span, ranges = (start, end), [(start, end)]
+        elif missing_only:
+            # Any gap between the stored span and the request is filled, so the span stays contiguous.
+            new_span = (min(start, span[0]), max(end, span[1]))
+            ranges = [(new_span[0], span[0] - 1), (span[1] + 1, new_span[1])]
+        else:
+            new_span = (min(start, span[0]), max(end, span[1]))
+            ranges = [(start, end), (span[1] + 1, start - 1), (end + 1, span[0] - 1)]
+        ranges = [r for r in ranges if r[0] <= r[1]]
+
+        copied = 0
+        cur = self.sqhelper.con.cursor()
+        try:
+            for range_start, range_end in ranges:
+                cur.execute("DELETE FROM {} WHERE timestamp BETWEEN ? AND ?".format(table), (range_start, range_end))
+                copied += self.__copy_range(cur, measurement, table, columns, range_start, range_end)
+            cur.execute(
+                "INSERT OR REPLACE INTO {} (table_name, span_start, span_end, updated) VALUES (?, ?, ?, ?)".format(
+                    SPAN_TABLE), (table, new_span[0], new_span[1], time.time()))
+        except Exception as e:
+            self.sqhelper.con.rollback()
+            log.error("Cannot export measurement {} into table {}. Exception {}".format(measurement, table, e))
+            return None
+        self.sqhelper.con.commit()
+        return copied
+
+    def query_range(self, measurement, start, end, table=None, fetch_missing=True):
+        """ Get all entries of a measurement between two unix timestamps (inclusive) from the sqlite3 copy
+
+        Parameters:
+        measurement (str): The influx measurement.
+        start (int): The unix timestamp to start from (inclusive).
+        end (int): The unix timestamp to end at (inclusive).
+        table (str): The sqlite3 table holding the copy, the measurement name is used if None.
+        fetch_missing (bool): If True, the part of the range not held yet is first copied from influx.
+
+        Returns:
+        - A Pandas DataFrame containing the table's rows in the range, ordered by timestamp.
+        - None if an error occured.
+        """
+        table = table or measurement
+        if fetch_missing and self.export(measurement, start, end, table=table, missing_only=True) is None:
+            return None
+        cur = self.sqhelper.con.cursor()
+        try:
+            cur.execute("SELECT * FROM {} WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp".format(table),
+                        (int(start), int(end)))
+        except Exception as e:
+            log.error("Cannot read cached rows from table {}. Exception {}".format(table, e))
+            return None
+        return pd.DataFrame(cur.fetchall(), columns=[d[0] for d in cur.description])
+
+    def get_span(self, table):
+        """ Get the time span held in a sqlite3 table
+
+        Returns:
+        - A tuple of the first and last unix timestamps (inclusive) copied from influx.
+        - None if nothing has been copied yet.
+        """
+        row = self.sqhelper.con.execute(
+            "SELECT span_start, span_end FROM {} WHERE table_name = ?".format(SPAN_TABLE), (table, )).fetchone()
+        return None if row is None else (int(row[0]), int(row[1]))
+
+    def __create_table(self, measurement, table):
+        columns = self.sqhelper.get_column_names(table)
+        if 'timestamp' in columns:
+            return columns
+        field_keys = self.influxhelper.get_field_keys(measurement)
+        if len(field_keys) == 0:
+            log.error("Cannot export measurement {}, it has no fields".format(measurement))
+            return None
+        tag_keys = self.influxhelper.get_tag_keys(measurement)
+        schema = {key: FIELD_TYPES.get(field_type, 'NUMERIC') for key, field_type in field_keys.items()}
+        schema.update({key: 'TEXT' for key in tag_keys})
+        schema['timestamp'] = 'NUMERIC'
+        columns = self.sqhelper.create_table(table, schema)
+        if sorted(columns) != sorted(schema):
+            log.error("Cannot export measurement {}, table {} has columns {}".format(measurement, table, columns))
+            return None
+        self.sqhelper.con.execute("CREATE INDEX IF NOT EXISTS {0}_timestamp ON {0}(timestamp)".format(table))
+        self.sqhelper.con.commit()
+        return columns
+
+    def __copy_range(self, cur, measurement, table, columns, start, end):
+        fields = [c for c in columns if c != 'timestamp']
+        chunks = self.influxhelper.query_range(measurement, fields, start, end, chunksize=self.chunksize)
+        if chunks is None:
+            raise ValueError("Query of measurement {} failed".format(measurement))
+        statement = "INSERT INTO {} ({}) VALUES ({})".format(table, ', '.join(['timestamp'] + fields),
+                                                             ', '.join('?' * (len(fields) + 1)))
+        copied = 0
+        for df in chunks:
+            df = df.astype(object).where(df.notna(), None)
+            cur.executemany(statement, df.itertuples(index=False, name=None))
+            copied += len(df)
+        return copied
@@ -0,0 +1,151 @@
+"""
+Deadband: Single class module for dropping entries which carry no new information.
+Author Stuart Ianna
+"""
+
+import math
+import time
+
+
+class DeadbandFilter():
+    """Class for filtering entries whose fields haven't changed since the last written entry
+
+    The last written value of each field is remembered per series, where a series is identified by the
+    values of its series keys (e.g an influx tag set). An entry is dropped if every deadband field in it
+    is within its deadband of the last written value. Entries containing a field without a deadband
+    are always written. A heartbeat forces an entry to be written if none has been for that long.
+
+    Deadbands are given per field as either a number (absolute) or a dictionary:
+    - {'absolute': 0.5}: Changes of 0.5 or less are dropped.
+    - {'relative': 0.01}: Changes of 1% of the last written value or less are dropped.
+    - {'absolute': 0.5, 'relative': 0.01}: Changes within either deadband are dropped.
+    A deadband of 0 only drops entries which repeat the last written value. Non-numeric fields are
+    compared for equality, missing (None or NaN) values never count as a change.
+
+    Typical Usage:
+
+    >>> deadband = DeadbandFilter({'temperature': 0.5, 'humidity': {'relative': 0.02}}, heartbeat=300)
+    >>> deadband.filter({'timestamp': 0, 'temperature': 23.0, 'humidity': 50.0, 'room': 'kitchen'}, ['room'])
+    {'timestamp': 0, 'temperature': 23.0, 'humidity': 50.0, 'room': 'kitchen'}
+    >>> deadband.filter({'timestamp': 1, 'temperature': 23.2, 'humidity': 50.5, 'room': 'kitchen'}, ['room']) is None
+    True
+
+    Attributes:
+        - deadbands (dict) - The deadband of each filtered field
+        - heartbeat (float) - The maximum number of seconds between written entries of a series, None for no limit
+    """
+    def __init__(self, deadbands, heartbeat=None):
+        """ Create a filter with no remembered values
+
+        Parameters:
+        deadbands (dict): The deadband of each filtered field, keyed by field name.
+        heartbeat (float): The maximum number of seconds between written entries of a series, None for no limit.
+        """
+        self.deadbands = {field: self.__parse_deadband(band) for field, band in deadbands.items()}
+        self.heartbeat = heartbeat
+        self.__last = dict()
+        self.__undo = None
+
+    def filter(self, data, series_keys=None, field_keys=None, use_timestamp=True):
+        """ Remove entries which are within the deadband of the last written entry of their series
+
+        Entries which are kept become the last written entry of their series.
+
+        Parameters:
+        data (dict, DataFrame): A single entry, or one entry per row.
+        series_keys (list): The keys or columns identifying the series of each entry.
+        field_keys (list): The keys or columns compared with the last written entry, all keys except
+            the series keys and 'timestamp' if None.
+        use_timestamp (Boolean):
+        -True: The 'timestamp' key or column is used as the entry time for the heartbeat.
+        -False: The current time is used.
+
+        Returns:
+        - The dictionary if it is kept, otherwise None.
+        - A DataFrame containing the kept rows.
+        """
+        series_keys = sorted(series_keys or [])
+        keys = data.keys() if type(data) is dict else data.columns
+        if field_keys is None:
+            field_keys = [k for k in keys if k not in series_keys and k != 'timestamp']
+        fields = [k for k in field_keys if k in keys]
+        now = time.time()
+        if type(data) is dict:
+            series = tuple(data.get(k) for k in series_keys)
+            timestamp = data.get('timestamp', now) if use_timestamp else now
+            return data if self.__keep(series, {k: data[k] for k in fields}, timestamp) else None
+
+        series = data[[k for k in series_keys if k in keys]].itertuples(index=False, name=None)
+        rows = data[fields].to_dict(orient='records')
+        if use_timestamp and 'timestamp' in keys:
+            timestamps = data['timestamp'].tolist()
+        else:
+            timestamps = [now] * len(data)
+        keep = [self.__keep(s, row, t) for s, row, t in zip(series, rows, timestamps)]
+        return data[keep]
+
+    def reset(self):
+        """ Forget all remembered values, the next entry of every series is written """
+        self.__last.clear()
+        self.__undo = None
+
+    def begin(self):
+        """ Start remembering the entries kept by filter() provisionally, until commit() or rollback()
+
+        Used when kept entries are written after filtering. If the write fails, rollback() forgets
+        them so the same values aren't dropped as unchanged when they are sent again.
+        """
+        self.__undo = dict()
+
+    def commit(self):
+        """ Keep the entries remembered since begin(), they were written """
+        self.__undo = None
+
+    def rollback(self):
+        """ Forget the entries remembered since begin(), the last written entries are remembered again """
+        for series, last in (self.__undo or dict()).items():
+            if last is None:
+                self.__last.pop(series, None)
+            else:
+                self.__last[series] = last
+        self.__undo = None
+
+    def __keep(self, series, entry, timestamp):
+        last = self.__last.get(series)
+        if last is None or self.__changed(entry, last[1]) or \
+                (self.heartbeat is not None and timestamp - last[0] >= self.heartbeat):
+            values = dict() if last is None else dict(last[1])
+            values.update({k: v for k, v in entry.items() if k in self.deadbands and not _is_missing(v)})
+            if self.__undo is not None and series not in self.__undo:
+                self.__undo[series] = last
+            self.__last[series] = (timestamp, values)
+            return True
+        return False
+
+    def __changed(self, entry, last_values):
+        for field, value in entry.items():
+            if _is_missing(value):
+                continue
+            if field not in self.deadbands:
+                return True
+            last = last_values.get(field)
+            if last is None:
+                return True
+            absolute, relative = self.deadbands[field]
+            if isinstance(value, (bool, str)) or isinstance(last, (bool, str)):
+                if value != last:
+                    return True
+                continue
+            change = abs(value - last)
+            if (absolute is None or change > absolute) and (relative is None or change > relative * abs(last)):
+                return True
+        return False
+
+    def __parse_deadband(self, band):
+        if isinstance(band, dict):
+            return band.get('absolute'), band.get('relative')
+        return band, None
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
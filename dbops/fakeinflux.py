@@ -0,0 +1,1205 @@
+"""
+FakeInflux: An in-process stand-in for the influxDB 1.x HTTP API.
+Author Stuart Ianna
+"""
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+from datetime import datetime, timezone
+from pyrfc3339 import parse as parse_rfc3339
+import threading
+import statistics
+import logging
+import random
+import socket
+import json
+import gzip
+import time
+import re
+
+log = logging.getLogger(__name__)
+
+VERSION = '1.8.0-dbops-fake'
+DEFAULT_CHUNK_SIZE = 10000
+
+PRECISION = {'n': 1, 'ns': 1, 'u': 10**3, 'ms': 10**6, 's': 10**9, 'm': 60 * 10**9, 'h': 3600 * 10**9}
+DURATION = {
+    'ns': 1,
+    'u': 10**3,
+    'us': 10**3,
+    'ms': 10**6,
+    's': 10**9,
+    'm': 60 * 10**9,
+    'h': 3600 * 10**9,
+    'd': 86400 * 10**9,
+    'w': 604800 * 10**9
+}
+SELECTORS = ('last', 'first', 'min', 'max')
+AGGREGATES = ('mean', 'median', 'sum', 'count', 'spread')
+# Statements which remove data, refused over GET along with SELECT INTO.
+DATA_WRITING_STATEMENTS = ('drop_measurement', )
+
+TOKEN = re.compile(r"""\s*(?:
+    (?P<string>'(?:[^'\\]|\\.)*')
+    |(?P<qident>"(?:[^"\\]|\\.)*")
+    |(?P<duration>\d+(?:ns|us|u|ms|s|m|h|d|w)\b)
+    |(?P<number>\d+(?:\.\d+)?)
+    |(?P<op><>|!=|<=|>=|::|[=<>(),;*+\-/.:])
+    |(?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+    )""", re.X)
+
+
+class FakeInfluxServer():
+    """An in-process influxDB stand-in, served from a background thread on localhost.
+
+    The server implements the subset of the influxDB 1.x HTTP API used by InfluxHelper, so
+    the helper can be tested and benchmarked without a running influxd. All data is held in memory.
+
+    Supported:
+    - /ping
+    - /write: Line protocol or JSON points, optionally gzip compressed. All write precisions.
+    - /query: Database, measurement, tag key, field key, retention policy and continuous query management.
+    SELECT statements with raw fields and tags, the last, first, min, max, mean, median, sum, count and
+    spread functions, WHERE on time, tags and fields, GROUP BY tags and time(), fill(), INTO,
+    ORDER BY time, LIMIT and OFFSET. Chunked responses and epoch timestamps. SELECT INTO and
+    DROP MEASUREMENT are refused unless sent with POST, as influxd does.
+    - Optionally, line protocol on a UDP listener.
+
+    Continuous queries are only run when run_continuous_queries() is called and retention policy
+    durations are not enforced.
+
+    Typical Usage:
+
+    >>> with FakeInfluxServer(latency=0.001) as server:
+    ...     database = InfluxHelper('database_name', port=server.port)
+    ...     database.insert('Environment', {'temperature': 23.3}, field_keys=['temperature'], tag_keys=[])
+    ...     server.request_count['write']
+    1
+
+    Attributes:
+        - host (str) - The address the server listens on
+        - port (int) - The HTTP port of the server, assigned when started if 0 was given
+        - latency (float) - The number of seconds each request is delayed by
+        - failure_rate (float) - The probability (0 to 1) of a request failing with failure_status
+        - failure_status (int) - The HTTP status code returned for an injected failure
+        - request_count (dict) - The number of requests received, keyed by endpoint
+        - points_written (int) - The total number of points written
+    """
+    def __init__(self, host='localhost', port=0, latency=0, failure_rate=0, failure_status=500, seed=None,
+                 udp_port=None, udp_database=None):
+        """ Create the server, call start() or use as a context manager to begin serving.
+
+        Parameters:
+        host (str): The address to listen on.
+        port (int): The HTTP port to listen on, 0 picks a free port.
+        latency (float): The number of seconds each request is delayed by before it is handled.
+        failure_rate (float): The probability (0 to 1) of a request failing.
+        failure_status (int): The HTTP status code returned for an injected failure.
+        seed: The seed used for failure injection, for reproducible failures.
+        udp_port (int): If given, line protocol is also accepted on this UDP port, 0 picks a free port.
+        udp_database (str): The database UDP writes are added to.
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.udp_port = udp_port
+        self.udp_database = udp_database
+        self.request_count = dict()
+        self.points_written = 0
+        self.__random = random.Random(seed)
+        self.__fail_next = []
+        self.__lock = threading.RLock()
+        self.__databases = dict()
+        self.__http = None
+        self.__udp = None
+        self.__threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        self.stop()
+
+    @property
+    def url(self):
+        """ The base URL of the HTTP API """
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    def start(self):
+        """ Start serving in background threads.
+
+        Returns:
+        self: The running server
+        """
+        server = self
+
+        class Handler(_RequestHandler):
+            fake = server
+
+        self.__http = _ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.__http.server_address[1]
+        self.__threads = [threading.Thread(target=self.__http.serve_forever, args=(0.05, ), daemon=True)]
+        if self.udp_port is not None:
+            self.__udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.__udp.bind((self.host, self.udp_port))
+            self.__udp.settimeout(0.05)
+            self.udp_port = self.__udp.getsockname()[1]
+            self.__threads.append(threading.Thread(target=self.__serve_udp, daemon=True))
+        for thread in self.__threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """ Stop serving and close all sockets. """
+        if self.__http is not None:
+            self.__http.shutdown()
+            self.__http.server_close()
+            self.__http = None
+        udp = self.__udp
+        self.__udp = None
+        for thread in self.__threads:
+            thread.join(timeout=5)
+        self.__threads = []
+        if udp is not None:
+            udp.close()
+
+    def reset(self):
+        """ Remove all databases and clear the request counters """
+        with self.__lock:
+            self.__databases.clear()
+            self.request_count = dict()
+            self.points_written = 0
+
+    def fail_next(self, count=1, status=None):
+        """ Fail the next count requests
+
+        Parameters:
+        count (int): The number of requests to fail.
+        status (int): The HTTP status to fail with, failure_status is used if None.
+        """
+        with self.__lock:
+            self.__fail_next.extend([status or self.failure_status] * count)
+
+    def get_points(self, measurement, database=None, retention_policy=None):
+        """ Get all stored points of a measurement, sorted by time
+
+        Parameters:
+        measurement (str): The measurement to return.
+        database (str): The database of the measurement, the only database is used if None.
+        retention_policy (str): The retention policy, the default policy is used if None.
+
+        Returns:
+        points (list): A list of dictionaries with keys 'time' (ns), 'tags' and 'fields'.
+        """
+        with self.__lock:
+            if database is None:
+                database = next(iter(self.__databases))
+            db = self.__databases[database]
+            series = db.series.get((retention_policy or db.default_rp, measurement), {})
+            return [{
+                'time': t,
+                'tags': dict(tags),
+                'fields': dict(fields)
+            } for (tags, t), fields in sorted(series.items(), key=lambda item: (item[0][1], item[0][0]))]
+
+    def write_lines(self, text, database, precision=None, retention_policy=None):
+        """ Write line protocol directly to a database, bypassing HTTP
+
+        Parameters:
+        text (str): Newline separated line protocol.
+        database (str): The database to write to, created if it doesn't exist.
+        precision (str): The precision of the line timestamps, nanoseconds if None.
+        retention_policy (str): The retention policy to write to, the default if None.
+        """
+        points = parse_lines(text, precision)
+        with self.__lock:
+            self.__databases.setdefault(database, _Database())
+            self.__write(database, retention_policy, points)
+
+    def run_continuous_queries(self, now=None):
+        """ Run every continuous query once, over all intervals up to now
+
+        Parameters:
+        now (int): The unix timestamp to run the queries at, the current time if None.
+
+        Returns:
+        written (int): The number of points written by all continuous queries.
+        """
+        now_ns = int((time.time() if now is None else now) * 10**9)
+        written = 0
+        with self.__lock:
+            for db_name, db in list(self.__databases.items()):
+                for select in list(db.continuous_queries.values()):
+                    statement = _Parser(select).parse_statement()
+                    interval = statement['group_time'][0] if statement['group_time'] else 1
+                    statement['upper'] = now_ns - now_ns % interval - 1
+                    result = self.__select(statement, db_name, 0)
+                    written += result['series'][0]['values'][0][1] if 'series' in result else 0
+        return written
+
+    def _count_request(self, endpoint):
+        with self.__lock:
+            self.request_count[endpoint] = self.request_count.get(endpoint, 0) + 1
+            if self.__fail_next:
+                return self.__fail_next.pop(0)
+            if self.failure_rate > 0 and self.__random.random() < self.failure_rate:
+                return self.failure_status
+        return None
+
+    def _handle_write(self, params, body, content_type):
+        database = params.get('db')
+        with self.__lock:
+            if database not in self.__databases:
+                return 404, {'error': 'database not found: "{}"'.format(database)}
+        try:
+            if 'json' in content_type:
+                points = parse_json_points(json.loads(body.decode('utf-8')), params.get('precision'))
+            else:
+                points = parse_lines(body.decode('utf-8'), params.get('precision'))
+        except (ValueError, KeyError, TypeError, IndexError) as e:
+            return 400, {'error': 'unable to parse: {}'.format(e)}
+        with self.__lock:
+            try:
+                self.__write(database, params.get('rp'), points)
+            except _QueryError as e:
+                return 400, {'error': 'partial write: {}'.format(e)}
+        return 204, None
+
+    def _handle_query(self, params, method='POST'):
+        try:
+            statements = _Parser(params.get('q', '')).parse()
+        except _QueryError as e:
+            return 400, {'error': 'error parsing query: {}'.format(e)}
+        # Like influxd, statements which write or remove data are refused over GET.
+        for statement in statements:
+            if method != 'POST' and (statement.get('into') or statement['kind'] in DATA_WRITING_STATEMENTS):
+                return 405, {'error': '{} queries must be sent with POST'.format(
+                    'SELECT INTO' if statement.get('into') else statement['kind'].replace('_', ' ').upper())}
+        results = []
+        with self.__lock:
+            for i, statement in enumerate(statements):
+                try:
+                    result = self.__execute(statement, params.get('db'), i)
+                except _QueryError as e:
+                    result = {'statement_id': i, 'error': str(e)}
+                results.append(result)
+        return 200, results
+
+    def __serve_udp(self):
+        udp = self.__udp
+        while self.__udp is not None:
+            try:
+                data = udp.recv(65535)
+            except socket.timeout:
+                continue
+            try:
+                self.write_lines(data.decode('utf-8'), self.udp_database)
+            except Exception as e:
+                log.error("Dropped UDP packet. Exception {}".format(e))
+
+    def __write(self, database, retention_policy, points):
+        db = self.__databases[database]
+        rp = retention_policy or db.default_rp
+        if rp not in db.retention_policies:
+            raise _QueryError('retention policy not found: {}'.format(rp))
+        for measurement, tags, fields, t in points:
+            types = db.field_types.setdefault(measurement, dict())
+            for key, value in fields.items():
+                value_type = _field_type(value)
+                if types.setdefault(key, value_type) != value_type:
+                    raise _QueryError('field type conflict: input field "{}" on measurement "{}" is type {}, '
+                                      'already exists as type {}'.format(key, measurement, value_type, types[key]))
+            series = db.series.setdefault((rp, measurement), dict())
+            series.setdefault((tags, t), dict()).update(fields)
+        self.points_written += len(points)
+
+    def __database(self, name):
+        if name is None:
+            raise _QueryError('database name required')
+        if name not in self.__databases:
+            raise _QueryError('database not found: {}'.format(name))
+        return self.__databases[name]
+
+    def __execute(self, statement, default_db, statement_id):
+        kind = statement['kind']
+        result = {'statement_id': statement_id}
+        db_name = statement.get('database') or default_db
+
+        if kind == 'create_database':
+            self.__databases.setdefault(statement['name'], _Database())
+        elif kind == 'drop_database':
+            self.__databases.pop(statement['name'], None)
+        elif kind == 'show_databases':
+            result['series'] = [_series('databases', ['name'], [[name] for name in self.__databases])]
+        elif kind == 'show_measurements':
+            names = sorted({m for _, m in self.__database(db_name).series})
+            if names:
+                result['series'] = [_series('measurements', ['name'], [[name] for name in names])]
+        elif kind == 'drop_measurement':
+            db = self.__database(db_name)
+            for key in [k for k in db.series if k[1] == statement['name']]:
+                del db.series[key]
+            db.field_types.pop(statement['name'], None)
+        elif kind in ('show_tag_keys', 'show_field_keys'):
+            db = self.__database(db_name)
+            names = sorted({m for _, m in db.series}) if statement['from'] is None else [statement['from'][-1]]
+            series = []
+            for name in names:
+                if kind == 'show_tag_keys':
+                    keys = sorted({k for rp, m in db.series if m == name for tags, _ in db.series[(rp, m)]
+                                   for k, _ in tags})
+                    values = [[k] for k in keys]
+                    columns = ['tagKey']
+                else:
+                    values = [[k, v] for k, v in sorted(db.field_types.get(name, {}).items())]
+                    columns = ['fieldKey', 'fieldType']
+                if values:
+                    series.append(_series(name, columns, values))
+            if series:
+                result['series'] = series
+        elif kind == 'show_retention_policies':
+            db = self.__database(db_name)
+            values = [[name, _format_duration(rp['duration']), _format_duration(rp['shard_duration']),
+                       rp['replication'], name == db.default_rp] for name, rp in db.retention_policies.items()]
+            result['series'] = [
+                _series(None, ['name', 'duration', 'shardGroupDuration', 'replicaN', 'default'], values)
+            ]
+        elif kind == 'create_retention_policy':
+            db = self.__database(db_name)
+            db.retention_policies[statement['name']] = {
+                'duration': statement['duration'],
+                'shard_duration': statement['shard_duration'] or 168 * DURATION['h'],
+                'replication': statement['replication']
+            }
+            if statement['default']:
+                db.default_rp = statement['name']
+        elif kind == 'drop_retention_policy':
+            db = self.__database(db_name)
+            db.retention_policies.pop(statement['name'], None)
+            for key in [k for k in db.series if k[0] == statement['name']]:
+                del db.series[key]
+        elif kind == 'create_continuous_query':
+            self.__database(db_name).continuous_queries[statement['name']] = statement['select']
+        elif kind == 'drop_continuous_query':
+            self.__database(db_name).continuous_queries.pop(statement['name'], None)
+        elif kind == 'show_continuous_queries':
+            result['series'] = [
+                _series(name, ['name', 'query'], [[
+                    cq, 'CREATE CONTINUOUS QUERY {} ON {} BEGIN {} END'.format(cq, name, select)
+                ] for cq, select in db.continuous_queries.items()]) for name, db in self.__databases.items()
+            ]
+        elif kind == 'select':
+            return self.__select(statement, default_db, statement_id)
+        return result
+
+    def __select(self, statement, default_db, statement_id):
+        source = statement['from']
+        db_name = source[0] if len(source) == 3 else default_db
+        db = self.__database(db_name)
+        rp = source[-2] if len(source) > 1 and source[-2] else db.default_rp
+        measurement = source[-1]
+        stored = db.series.get((rp, measurement), {})
+        result = {'statement_id': statement_id}
+
+        where = statement['where']
+        points = sorted(((t, tags, fields, dict(tags)) for (tags, t), fields in stored.items()),
+                        key=lambda p: (p[0], p[1]))
+        if where is not None:
+            points = [p for p in points if where(p[0], p[3], p[2])]
+        lower = statement['lower']
+        upper = statement['upper']
+        points = [p for p in points if (lower is None or p[0] >= lower) and (upper is None or p[0] <= upper)]
+
+        group_tags = statement['group_tags']
+        if group_tags == ['*']:
+            group_tags = sorted({k for tags, _ in stored for k, _ in tags})
+        groups = dict()
+        for p in points:
+            groups.setdefault(tuple(p[3].get(k, '') for k in group_tags), []).append(p)
+
+        fields = statement['fields']
+        if fields == '*':
+            known_tags = {k for tags, _ in stored for k, _ in tags}
+            names = sorted(set(db.field_types.get(measurement, {})) | (known_tags - set(group_tags)))
+            fields = [{'function': None, 'argument': n, 'alias': None} for n in names]
+        columns = ['time'] + _column_names(fields)
+        aggregate = fields[0]['function'] is not None
+
+        series = []
+        for key in sorted(groups):
+            if aggregate:
+                rows = self.__aggregate_rows(statement, fields, groups[key])
+            else:
+                arguments = [f['argument'] for f in fields]
+                rows = [[p[0]] + [p[2][a] if a in p[2] else p[3].get(a) for a in arguments]
+                        for p in groups[key] if any(a in p[2] for a in arguments)]
+            if statement['descending']:
+                rows.reverse()
+            rows = rows[statement['offset']:]
+            if statement['limit'] is not None:
+                rows = rows[:statement['limit']]
+            if rows:
+                series.append((dict(zip(group_tags, key)), rows))
+
+        if statement['into'] is not None:
+            return self.__select_into(statement, db_name, columns, series, statement_id)
+        if series:
+            result['series'] = []
+            for tags, rows in series:
+                entry = _series(measurement, columns, rows)
+                if group_tags:
+                    entry['tags'] = tags
+                result['series'].append(entry)
+        return result
+
+    def __aggregate_rows(self, statement, fields, points):
+        if not statement['group_time']:
+            single_selector = len(fields) == 1 and fields[0]['function'] in SELECTORS
+            row = []
+            for f in fields:
+                row.append(_aggregate(f['function'], [(p[0], p[2][f['argument']]) for p in points
+                                                      if f['argument'] in p[2]]))
+            if single_selector and row[0] is not None:
+                return [[row[0][0], row[0][1]]]
+            return [[statement['lower'] or 0] + [None if r is None else r[1] for r in row]]
+
+        interval, offset = statement['group_time']
+        start = statement['lower'] if statement['lower'] is not None else points[0][0]
+        end = statement['upper'] if statement['upper'] is not None else points[-1][0]
+        first_bucket = start - (start - offset) % interval
+        buckets = dict()
+        for p in points:
+            buckets.setdefault(p[0] - (p[0] - offset) % interval, []).append(p)
+        if statement['fill'] == 'none':
+            starts = sorted(b for b in buckets if first_bucket <= b <= end)
+        else:
+            starts = range(first_bucket, end + 1, interval)
+        rows = []
+        for bucket in starts:
+            in_bucket = buckets.get(bucket, [])
+            row = [bucket]
+            for f in fields:
+                value = _aggregate(f['function'], [(p[0], p[2][f['argument']]) for p in in_bucket
+                                                   if f['argument'] in p[2]])
+                row.append(None if value is None else value[1])
+            rows.append(row)
+        return _fill(rows, statement['fill'])
+
+    def __select_into(self, statement, db_name, columns, series, statement_id):
+        target = statement['into']
+        target_db = target[0] if len(target) == 3 else db_name
+        target_rp = target[-2] if len(target) > 1 and target[-2] else None
+        points = []
+        for tags, rows in series:
+            tag_tuple = tuple(sorted((k, v) for k, v in tags.items() if v != ''))
+            for row in rows:
+                fields = {c: v for c, v in zip(columns[1:], row[1:]) if v is not None}
+                if fields:
+                    points.append((target[-1], tag_tuple, fields, row[0]))
+        self.__database(target_db)
+        self.__write(target_db, target_rp, points)
+        return {'statement_id': statement_id, 'series': [_series('result', ['time', 'written'], [[0, len(points)]])]}
+
+
+class _Database():
+    def __init__(self):
+        self.series = dict()
+        self.field_types = dict()
+        self.retention_policies = {'autogen': {'duration': 0, 'shard_duration': 168 * DURATION['h'], 'replication': 1}}
+        self.default_rp = 'autogen'
+        self.continuous_queries = dict()
+
+
+class _QueryError(Exception):
+    pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        self.__handle()
+
+    def do_POST(self):
+        self.__handle()
+
+    def __handle(self):
+        url = urlparse(self.path)
+        endpoint = url.path.strip('/')
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.headers.get('Content-Encoding') == 'gzip' and body:
+            body = gzip.decompress(body)
+        if 'x-www-form-urlencoded' in (self.headers.get('Content-Type') or ''):
+            params.update({k: v[-1] for k, v in parse_qs(body.decode('utf-8')).items()})
+
+        if self.fake.latency > 0:
+            time.sleep(self.fake.latency)
+        failure = self.fake._count_request(endpoint)
+        if failure is not None:
+            return self.__send_json(failure, {'error': 'injected failure'})
+
+        if endpoint == 'ping':
+            return self.__send_json(204, None)
+        if endpoint == 'write' and self.command == 'POST':
+            return self.__send_json(*self.fake._handle_write(params, body, self.headers.get('Content-Type') or ''))
+        if endpoint == 'query':
+            status, results = self.fake._handle_query(params, self.command)
+            if status != 200:
+                return self.__send_json(status, results)
+            results = [_format_times(r, params.get('epoch')) for r in results]
+            if params.get('chunked') == 'true':
+                return self.__send_chunked(results, int(params.get('chunk_size') or DEFAULT_CHUNK_SIZE))
+            return self.__send_json(200, {'results': results})
+        return self.__send_json(404, {'error': 'not found'})
+
+    def __send_headers(self, status, extra):
+        self.send_response(status)
+        self.send_header('X-Influxdb-Version', VERSION)
+        self.send_header('Content-Type', 'application/json')
+        for key, value in extra.items():
+            self.send_header(key, value)
+        self.end_headers()
+
+    def __send_json(self, status, content):
+        data = b'' if content is None else json.dumps(content).encode('utf-8')
+        # Like influxd, 204 responses have no Content-Length.
+        self.__send_headers(status, {} if status == 204 else {'Content-Length': str(len(data))})
+        if data and self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def __send_chunked(self, results, chunk_size):
+        self.__send_headers(200, {'Transfer-Encoding': 'chunked'})
+        try:
+            for chunk in _chunk_results(results, chunk_size):
+                data = json.dumps({'results': [chunk]}).encode('utf-8') + b'\n'
+                self.wfile.write(b'%X\r\n%s\r\n' % (len(data), data))
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+def _chunk_results(results, chunk_size):
+    for result in results:
+        series = result.get('series', [])
+        if not series:
+            yield result
+            continue
+        for s_index, s in enumerate(series):
+            values = s.get('values', [])
+            starts = range(0, len(values), chunk_size) if values else [0]
+            for start in starts:
+                entry = dict(s, values=values[start:start + chunk_size])
+                more_values = start + chunk_size < len(values)
+                if more_values:
+                    entry['partial'] = True
+                chunk = {'statement_id': result['statement_id'], 'series': [entry]}
+                if more_values or s_index < len(series) - 1:
+                    chunk['partial'] = True
+                yield chunk
+
+
+def _series(name, columns, values):
+    series = {'columns': columns}
+    if name is not None:
+        series['name'] = name
+    if values:
+        series['values'] = values
+    return series
+
+
+def _column_names(fields):
+    names = []
+    for f in fields:
+        name = f['alias'] or f['function'] or f['argument']
+        candidate = name
+        count = 0
+        while candidate in names:
+            count += 1
+            candidate = '{}_{}'.format(name, count)
+        names.append(candidate)
+    return names
+
+
+def _aggregate(function, values):
+    """ Apply an aggregate to a list of (time, value) tuples, returning (time, result) or None if empty """
+    if len(values) == 0:
+        return (None, 0) if function == 'count' else None
+    if function == 'last':
+        return max(values, key=lambda v: v[0])
+    if function == 'first':
+        return min(values, key=lambda v: v[0])
+    if function == 'min':
+        return min(values, key=lambda v: (v[1], v[0]))
+    if function == 'max':
+        return max(values, key=lambda v: (v[1], -v[0]))
+    numbers = [v[1] for v in values]
+    if function == 'count':
+        return (None, len(numbers))
+    if function == 'sum':
+        return (None, sum(numbers))
+    if function == 'mean':
+        return (None, sum(numbers) / len(numbers))
+    if function == 'median':
+        return (None, statistics.median(numbers))
+    if function == 'spread':
+        return (None, max(numbers) - min(numbers))
+    raise _QueryError('undefined function {}()'.format(function))
+
+
+def _fill(rows, fill):
+    if fill == 'none':
+        return [r for r in rows if any(v is not None for v in r[1:])]
+    if fill == 'null':
+        return rows
+    for column in range(1, len(rows[0]) if rows else 1):
+        if fill == 'previous':
+            previous = None
+            for r in rows:
+                if r[column] is None:
+                    r[column] = previous
+                previous = r[column]
+        elif fill == 'linear':
+            known = [(i, r[column]) for i, r in enumerate(rows) if r[column] is not None]
+            for (i0, v0), (i1, v1) in zip(known, known[1:]):
+                for i in range(i0 + 1, i1):
+                    rows[i][column] = v0 + (v1 - v0) * (i - i0) / (i1 - i0)
+        else:
+            for r in rows:
+                if r[column] is None:
+                    r[column] = fill
+    return rows
+
+
+def _field_type(value):
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'integer'
+    if isinstance(value, float):
+        return 'float'
+    return 'string'
+
+
+def _format_duration(ns):
+    if ns == 0:
+        return '0s'
+    seconds = ns // 10**9
+    return '{}h{}m{}s'.format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def _format_time(ns, epoch):
+    if epoch is not None:
+        return ns // PRECISION[epoch]
+    seconds, nanoseconds = divmod(ns, 10**9)
+    text = datetime.fromtimestamp(seconds, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+    if nanoseconds:
+        text += '.' + '{:09d}'.format(nanoseconds).rstrip('0')
+    return text + 'Z'
+
+
+def _format_times(result, epoch):
+    for series in result.get('series', []):
+        if series.get('columns', [None])[0] == 'time':
+            for row in series.get('values', []):
+                row[0] = _format_time(row[0], epoch)
+    return result
+
+
+def _rfc3339_to_ns(text):
+    moment = parse_rfc3339(text)
+    return int(moment.timestamp()) * 10**9 + moment.microsecond * 1000
+
+
+def _split(text, separator, quotes=False):
+    """ Split text on a separator which isn't escaped (or quoted if quotes is True) """
+    parts = []
+    current = []
+    quoted = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == '\\' and i + 1 < len(text):
+            current.append(text[i:i + 2])
+            i += 2
+            continue
+        if quotes and char == '"':
+            quoted = not quoted
+        if char == separator and not quoted:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+        i += 1
+    parts.append(''.join(current))
+    return parts
+
+
+def _unescape(text):
+    return re.sub(r'\\(.)', r'\1', text)
+
+
+def _parse_field_value(text):
+    if text.startswith('"'):
+        return text[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    if text[-1] in 'iu' and re.match(r'^-?\d+[iu]$', text):
+        return int(text[:-1])
+    if text in ('t', 'T', 'true', 'True', 'TRUE'):
+        return True
+    if text in ('f', 'F', 'false', 'False', 'FALSE'):
+        return False
+    return float(text)
+
+
+def parse_lines(text, precision=None):
+    """ Parse line protocol into a list of (measurement, tags, fields, time) tuples
+
+    Tags are a sorted tuple of (key, value) pairs and time is in nanoseconds.
+    Lines without a timestamp are given the current time.
+
+    Parameters:
+    text (str): Newline separated line protocol.
+    precision (str): The precision of the timestamps, nanoseconds if None.
+    """
+    multiplier = PRECISION[precision or 'n']
+    now = _now_ns()
+    points = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = _split(line, ' ', quotes=True)
+        parts = [p for p in parts if p != '']
+        if len(parts) not in (2, 3):
+            raise ValueError('invalid line: {}'.format(line))
+        key = _split(parts[0], ',')
+        tags = []
+        for tag in key[1:]:
+            tag_key, tag_value = _split(tag, '=')
+            tags.append((_unescape(tag_key), _unescape(tag_value)))
+        fields = dict()
+        for field in _split(parts[1], ',', quotes=True):
+            field_key, field_value = field.split('=', 1) if '\\' not in field else _split(field, '=', True)[:2]
+            fields[_unescape(field_key)] = _parse_field_value(field_value)
+        t = int(parts[2]) * multiplier if len(parts) == 3 else now
+        points.append((_unescape(key[0]), tuple(sorted(tags)), fields, t))
+    return points
+
+
+def parse_json_points(data, precision=None):
+    """ Parse JSON points (a list, or a dictionary with 'points' and shared 'tags') into point tuples """
+    shared_tags = dict()
+    if type(data) is dict:
+        shared_tags = data.get('tags') or dict()
+        data = data['points']
+    multiplier = PRECISION[precision or 'n']
+    now = _now_ns()
+    points = []
+    for point in data:
+        tags = dict(shared_tags, **(point.get('tags') or dict()))
+        t = point.get('time')
+        if t is None:
+            t = now
+        elif type(t) is str:
+            t = _rfc3339_to_ns(t)
+        else:
+            t = int(t) * multiplier
+        points.append((point['measurement'], tuple(sorted((k, str(v)) for k, v in tags.items())),
+                       dict(point['fields']), t))
+    return points
+
+
+class _Parser():
+    """ Recursive descent parser for the supported subset of InfluxQL """
+    def __init__(self, text):
+        self.text = text
+        self.tokens = []
+        position = 0
+        text = text.rstrip()
+        while position < len(text):
+            match = TOKEN.match(text, position)
+            if match is None or match.end() == position:
+                raise _QueryError('found {}, unexpected character'.format(text[position:position + 10]))
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind == 'string':
+                value = _unescape(value[1:-1])
+            elif kind == 'qident':
+                value = _unescape(value[1:-1])
+                kind = 'ident'
+            self.tokens.append((kind, value, match.start(kind), match.end(kind)))
+            position = match.end()
+        self.index = 0
+
+    def peek(self, offset=0):
+        if self.index + offset < len(self.tokens):
+            return self.tokens[self.index + offset]
+        return (None, None, len(self.text), len(self.text))
+
+    def next(self):
+        token = self.peek()
+        self.index += 1
+        return token
+
+    def is_keyword(self, *words, offset=0):
+        kind, value = self.peek(offset)[:2]
+        return kind == 'ident' and value.upper() in words
+
+    def accept(self, *words):
+        if self.is_keyword(*words):
+            return self.next()[1].upper()
+        return None
+
+    def accept_op(self, op):
+        if self.peek()[0] == 'op' and self.peek()[1] == op:
+            return self.next()
+        return None
+
+    def expect(self, *words):
+        word = self.accept(*words)
+        if word is None:
+            raise _QueryError('found {}, expected {}'.format(self.peek()[1], ' '.join(words)))
+        return word
+
+    def expect_op(self, op):
+        if self.accept_op(op) is None:
+            raise _QueryError('found {}, expected {}'.format(self.peek()[1], op))
+
+    def identifier(self):
+        kind, value = self.next()[:2]
+        if kind != 'ident':
+            raise _QueryError('found {}, expected identifier'.format(value))
+        return value
+
+    def duration(self):
+        kind, value = self.next()[:2]
+        if kind != 'duration':
+            raise _QueryError('found {}, expected duration'.format(value))
+        return _duration_ns(value)
+
+    def dotted_name(self):
+        names = [self.identifier()]
+        while self.accept_op('.'):
+            if self.peek()[:2] == ('op', '.'):
+                names.append('')
+            else:
+                names.append(self.identifier())
+        if len(names) > 3:
+            raise _QueryError('invalid measurement name {}'.format('.'.join(names)))
+        return names
+
+    def parse(self):
+        statements = []
+        while self.peek()[0] is not None:
+            if self.accept_op(';'):
+                continue
+            statements.append(self.parse_statement())
+            if self.peek()[0] is not None:
+                self.expect_op(';')
+        if len(statements) == 0:
+            raise _QueryError('empty query')
+        return statements
+
+    def parse_statement(self):
+        word = self.expect('SELECT', 'SHOW', 'CREATE', 'DROP')
+        if word == 'SELECT':
+            return self.parse_select()
+        if word == 'SHOW':
+            return self.parse_show()
+        if word == 'CREATE':
+            what = self.expect('DATABASE', 'RETENTION', 'CONTINUOUS')
+            if what == 'DATABASE':
+                return {'kind': 'create_database', 'name': self.identifier()}
+            if what == 'RETENTION':
+                return self.parse_create_retention_policy()
+            return self.parse_create_continuous_query()
+        what = self.expect('DATABASE', 'MEASUREMENT', 'RETENTION', 'CONTINUOUS')
+        if what in ('RETENTION', 'CONTINUOUS'):
+            self.expect('POLICY', 'QUERY')
+            name = self.identifier()
+            self.expect('ON')
+            return {'kind': 'drop_retention_policy' if what == 'RETENTION' else 'drop_continuous_query',
+                    'name': name, 'database': self.identifier()}
+        return {'kind': 'drop_' + what.lower(), 'name': self.identifier()}
+
+    def parse_show(self):
+        what = self.expect('DATABASES', 'MEASUREMENTS', 'TAG', 'FIELD', 'RETENTION', 'CONTINUOUS')
+        if what in ('DATABASES', 'MEASUREMENTS'):
+            statement = {'kind': 'show_' + what.lower()}
+        elif what in ('TAG', 'FIELD'):
+            self.expect('KEYS')
+            statement = {'kind': 'show_{}_keys'.format(what.lower()), 'from': None}
+        elif what == 'RETENTION':
+            self.expect('POLICIES')
+            statement = {'kind': 'show_retention_policies'}
+        else:
+            self.expect('QUERIES')
+            return {'kind': 'show_continuous_queries'}
+        if self.accept('ON'):
+            statement['database'] = self.identifier()
+        if 'from' in statement and self.accept('FROM'):
+            statement['from'] = self.dotted_name()
+        return statement
+
+    def parse_create_retention_policy(self):
+        self.expect('POLICY')
+        statement = {'kind': 'create_retention_policy', 'name': self.identifier(), 'shard_duration': None,
+                     'default': False}
+        self.expect('ON')
+        statement['database'] = self.identifier()
+        self.expect('DURATION')
+        kind, value = self.next()[:2]
+        statement['duration'] = 0 if value.upper() == 'INF' else _duration_ns(value)
+        self.expect('REPLICATION')
+        statement['replication'] = int(self.next()[1])
+        if self.accept('SHARD'):
+            self.expect('DURATION')
+            statement['shard_duration'] = self.duration()
+        if self.accept('DEFAULT'):
+            statement['default'] = True
+        return statement
+
+    def parse_create_continuous_query(self):
+        self.expect('QUERY')
+        statement = {'kind': 'create_continuous_query', 'name': self.identifier()}
+        self.expect('ON')
+        statement['database'] = self.identifier()
+        if self.accept('RESAMPLE'):
+            while self.accept('EVERY', 'FOR'):
+                self.duration()
+        self.expect('BEGIN')
+        start = self.peek()[2]
+        self.expect('SELECT')
+        select = self.parse_select()
+        if select['into'] is None or not select['group_time']:
+            raise _QueryError('continuous query requires INTO and GROUP BY time()')
+        end = self.peek()[2]
+        self.expect('END')
+        statement['select'] = self.text[start:end].strip()
+        return statement
+
+    def parse_select(self):
+        statement = {
+            'kind': 'select',
+            'into': None,
+            'where': None,
+            'lower': None,
+            'upper': None,
+            'group_tags': [],
+            'group_time': None,
+            'fill': 'null',
+            'descending': False,
+            'limit': None,
+            'offset': 0
+        }
+        if self.accept_op('*'):
+            statement['fields'] = '*'
+        else:
+            statement['fields'] = [self.parse_field()]
+            while self.accept_op(','):
+                statement['fields'].append(self.parse_field())
+            if len({f['function'] is None for f in statement['fields']}) > 1:
+                raise _QueryError('mixing aggregate and non-aggregate queries is not supported')
+        if self.accept('INTO'):
+            statement['into'] = self.dotted_name()
+        self.expect('FROM')
+        statement['from'] = self.dotted_name()
+        if self.accept('WHERE'):
+            condition = self.parse_or()
+            statement['where'] = condition['evaluate']
+            statement['lower'], statement['upper'] = condition['bounds']
+        if self.accept('GROUP'):
+            self.expect('BY')
+            self.parse_group_by(statement)
+        if self.accept('FILL'):
+            self.expect_op('(')
+            kind, value = self.next()[:2]
+            if kind == 'number':
+                statement['fill'] = float(value) if '.' in value else int(value)
+            elif kind == 'ident' and value.lower() in ('null', 'none', 'previous', 'linear'):
+                statement['fill'] = value.lower()
+            else:
+                raise _QueryError('fill must be a number, null, none, previous or linear')
+            self.expect_op(')')
+        if self.accept('ORDER'):
+            self.expect('BY')
+            if self.identifier().lower() != 'time':
+                raise _QueryError('only ORDER BY time supported at this time')
+            statement['descending'] = self.accept('ASC', 'DESC') == 'DESC'
+        if self.accept('LIMIT'):
+            statement['limit'] = int(self.next()[1])
+        if self.accept('OFFSET'):
+            statement['offset'] = int(self.next()[1])
+        if statement['group_time'] and statement['fields'] != '*' and statement['fields'][0]['function'] is None:
+            raise _QueryError('GROUP BY requires at least one aggregate function')
+        return statement
+
+    def parse_field(self):
+        name = self.identifier()
+        field = {'function': None, 'argument': name, 'alias': None}
+        if self.accept_op('('):
+            if name.lower() not in SELECTORS + AGGREGATES:
+                raise _QueryError('undefined function {}()'.format(name))
+            field = {'function': name.lower(), 'argument': self.identifier(), 'alias': None}
+            self.expect_op(')')
+        if self.accept('AS'):
+            field['alias'] = self.identifier()
+        return field
+
+    def parse_group_by(self, statement):
+        while True:
+            if self.accept_op('*'):
+                statement['group_tags'] = ['*']
+            elif self.is_keyword('TIME') and self.peek(1)[1] == '(':
+                self.next()
+                self.next()
+                interval = self.duration()
+                offset = 0
+                if self.accept_op(','):
+                    negative = self.accept_op('-') is not None
+                    offset = -self.duration() if negative else self.duration()
+                self.expect_op(')')
+                statement['group_time'] = (interval, offset % interval)
+            else:
+                statement['group_tags'].append(self.identifier())
+            if not self.accept_op(','):
+                return
+
+    def parse_or(self):
+        left = self.parse_and()
+        while self.accept('OR'):
+            right = self.parse_and()
+            left = _combine(left, right, any)
+            left['bounds'] = (None, None)
+        return left
+
+    def parse_and(self):
+        left = self.parse_comparison()
+        while self.accept('AND'):
+            right = self.parse_comparison()
+            bounds = _merge_bounds(left['bounds'], right['bounds'])
+            left = _combine(left, right, all)
+            left['bounds'] = bounds
+        return left
+
+    def parse_comparison(self):
+        if self.accept_op('('):
+            condition = self.parse_or()
+            self.expect_op(')')
+            return condition
+        left = self.parse_operand()
+        kind, op = self.next()[:2]
+        if kind != 'op' or op not in ('=', '!=', '<>', '<', '<=', '>', '>='):
+            raise _QueryError('found {}, expected comparison operator'.format(op))
+        right = self.parse_operand()
+        if right[0] == 'ident' and left[0] != 'ident':
+            left, right = right, left
+            op = {'<': '>', '<=': '>=', '>': '<', '>=': '<='}.get(op, op)
+        if left[0] != 'ident':
+            raise _QueryError('comparison requires an identifier')
+        return _comparison(left[1], op, right)
+
+    def parse_operand(self):
+        kind, value = self.next()[:2]
+        if kind == 'ident' and value.lower() == 'now' and self.accept_op('('):
+            self.expect_op(')')
+            operand = ('time', _now_ns())
+        elif kind == 'op' and value == '-':
+            inner = self.parse_operand()
+            operand = (inner[0], -inner[1])
+        elif kind == 'duration':
+            operand = ('time', _duration_ns(value))
+        elif kind == 'number':
+            operand = ('number', float(value) if '.' in value else int(value))
+        elif kind in ('string', 'ident'):
+            if kind == 'ident' and self.accept_op('::'):
+                self.identifier()
+            operand = (kind, value)
+        else:
+            raise _QueryError('found {}, expected operand'.format(value))
+        while self.peek()[0] == 'op' and self.peek()[1] in ('+', '-'):
+            sign = 1 if self.next()[1] == '+' else -1
+            other = self.parse_operand()
+            operand = ('time', operand[1] + sign * other[1])
+        return operand
+
+
+def _now_ns():
+    return time.time_ns() if hasattr(time, 'time_ns') else int(time.time() * 10**9)
+
+
+def _duration_ns(text):
+    match = re.match(r'^(\d+)(ns|us|u|ms|s|m|h|d|w)$', text)
+    if match is None:
+        raise _QueryError('invalid duration {}'.format(text))
+    return int(match.group(1)) * DURATION[match.group(2)]
+
+
+def _combine(left, right, join):
+    a = left['evaluate']
+    b = right['evaluate']
+    return {'evaluate': lambda t, tags, fields: join((a(t, tags, fields), b(t, tags, fields)))}
+
+
+def _merge_bounds(a, b):
+    lower = [x for x in (a[0], b[0]) if x is not None]
+    upper = [x for x in (a[1], b[1]) if x is not None]
+    return (max(lower) if lower else None, min(upper) if upper else None)
+
+
+def _compare(value, op, other):
+    try:
+        if op == '=':
+            return value == other
+        if op in ('!=', '<>'):
+            return value != other
+        if value is None:
+            return False
+        if op == '<':
+            return value < other
+        if op == '<=':
+            return value <= other
+        if op == '>':
+            return value > other
+        return value >= other
+    except TypeError:
+        return False
+
+
+def _comparison(name, op, operand):
+    if name.lower() == 'time':
+        kind, value = operand
+        if kind == 'string':
+            value = _rfc3339_to_ns(value)
+        bounds = (None, None)
+        if op in ('>', '>='):
+            bounds = (value + (1 if op == '>' else 0), None)
+        elif op in ('<', '<='):
+            bounds = (None, value - (1 if op == '<' else 0))
+        elif op == '=':
+            bounds = (value, value)
+        return {'evaluate': lambda t, tags, fields: _compare(t, op, value), 'bounds': bounds}
+
+    value = operand[1]
+
+    def evaluate(t, tags, fields):
+        if name in fields:
+            return _compare(fields[name], op, value)
+        return _compare(tags.get(name, ''), op, value)
+    return {'evaluate': evaluate, 'bounds': (None, None)}
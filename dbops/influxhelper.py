@@ -3,13 +3,44 @@ Influx: Single class module for working with influxdb databases.
 Author Stuart Ianna
 """
 
-from influxdb import InfluxDBClient
 from dbops import timeconverter as timeconverter
-import pandas as pd
+from dbops.outbox import InfluxOutbox
+from dbops.deadband import DeadbandFilter
+from dbops.querycache import QueryCache
+from dbops.instrumentation import instrumented, current_call
+from dbops._lazy import LazyModule, is_dataframe, is_series
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 import logging
+import json
+import time
+import gzip
+import csv
+import io
+import re
 
 log = logging.getLogger(__name__)
 
+# The influxdb client (which imports pandas itself) is only imported once an InfluxHelper is created.
+pd = LazyModule('pandas')
+influxdb = LazyModule('influxdb')
+influxdb_exceptions = LazyModule('influxdb.exceptions')
+line_protocol = LazyModule('influxdb.line_protocol')
+
+DEFAULT_CHUNK_SIZE = 10000
+UDP_BATCH_SIZE = 100
+MAX_PAYLOAD_BYTES = 1024 * 1024
+FILE_FORMATS = ('line', 'csv')
+TRANSPORTS = ('http', 'udp')
+TIME_INDEXES = (None, 'epoch', 'datetime')
+INT32_MIN, INT32_MAX = -2**31, 2**31 - 1
+
+_LP_KEY = r'(?:[^ ,=\\]|\\.)+'
+_LP_VALUE = r'(?:"(?:[^"\\]|\\.)*"|-?\d+[iu]|[tT]|[fF]|[tT]rue|TRUE|[fF]alse|FALSE|' \
+            r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)'
+_LINE_PROTOCOL = re.compile(r'^(?:[^ ,\\]|\\.)+(?:,{0}={0})* {0}={1}(?:,{0}={1})*(?: -?\d+)?$'.format(
+    _LP_KEY, _LP_VALUE))
+
 
 class InfluxHelper():
     """Class for working with a single influx database
@@ -46,10 +77,26 @@ class InfluxHelper():
     >>> last_time_entry['time']
     1585848415
 
+    # Trade durability for throughput, points are sent to the UDP listener without waiting for a response
+    >>> database = InfluxHelper('database_name', host='influx.local', transport='udp', udp_port=8089)
+
+    # Keep inserting while the server is slow or down, points are spooled to disk and sent in the background
+    >>> database = InfluxHelper('database_name', outbox='spool.sql')
+    >>> database.outbox.get_stats()['size']
+    0
+
     Attributes:
         - client (influx.InfluxDBClient) - Influx DB client clas object
+        - host (str) - The influxDB host name
+        - port (int) - The influxDB HTTP port
+        - transport (str) - The transport used for writes, 'http' or 'udp'
+        - outbox (InfluxOutbox) - The spool inserts are written to, None if inserts are sent directly
+        - query_cache (QueryCache) - The cache of read results, disabled unless query_cache_ttl is given
+        - instrumentation (Instrumentation) - Records timings and counters of each call, None to disable
     """
-    def __init__(self, db_name):
+    def __init__(self, db_name, metadata_ttl=0, host='localhost', port=8086, pool_size=10, gzip=False, retries=3,
+                 timeout=None, transport='http', udp_port=4444, batch_size=None, outbox=None, outbox_batch_size=5000,
+                 query_cache_ttl=0, query_cache_size=256, instrumentation=None):
         """ Connect to the influxDB and create a database if it doesn't exist
 
         WARNING: The influxDB service must be installed and started for this module to function.
@@ -59,17 +106,78 @@ class InfluxHelper():
 
         Parameters:
         db_name (str): The name of the database
+        metadata_ttl (float): The number of seconds database, measurement, tag key and field key listings
+            are cached for. The cache is kept up to date by this object's own inserts and removals, changes
+            made by other clients are seen once the entry expires or refresh_metadata() is called.
+            0 disables the cache.
+        host (str): The host name of the influxDB service.
+        port (int): The HTTP port of the influxDB service.
+        pool_size (int): The number of HTTP connections kept open for reuse.
+        gzip (Boolean): If true HTTP requests and responses are gzip compressed.
+        retries (int): The number of attempts made for a failed HTTP request, 0 retries forever.
+        timeout (float): The number of seconds to wait for a HTTP response, None waits forever.
+        transport (str): The transport used by all inserts:
+        -'http': Each write waits for the server to confirm it.
+        -'udp': Fire and forget, points are sent to the server's UDP listener on udp_port and insert
+        always returns True. The database written to is set by the server's UDP listener configuration.
+        Queries and database management always use HTTP.
+        udp_port (int): The port of the influxDB UDP listener.
+        batch_size (int): The maximum number of points sent per write, None sends all points of an insert
+            in a single HTTP request. UDP writes are sent in batches of 100 points by default.
+        outbox (str): The path to a sqlite3 spool file. If given, inserts are appended to the spool and return
+            without waiting for the server. A background thread sends spooled points once the server is
+            reachable, including points left from a previous run. The object is created even if the server
+            can't be reached, the database is created on the first successful send.
+        outbox_batch_size (int): The maximum number of spooled points sent at a time.
+        query_cache_ttl (float, dict): The number of seconds the results of get_last_time_entry,
+            get_last_time_entries, query_range and query_aggregated are cached for. A dictionary keyed by
+            method name sets the time per method, missing methods aren't cached. Identical reads made
+            while a query is running wait for its result instead of querying again. Results for a
+            measurement are discarded when this object writes to or removes it. 0 disables the cache.
+        query_cache_size (int): The maximum number of cached results, the least recently used is discarded.
+        instrumentation (Instrumentation): Records the latency, rows, bytes sent and requests of inserts and
+            reads, see dbops.instrumentation. None disables recording.
         """
+        self.__db_name = db_name
+        self.metadata_ttl = metadata_ttl
+        self.__metadata = dict()
+        self.host = host
+        self.port = port
+        self.transport = transport
+        self.__batch_size = batch_size
+        self.__database_created = False
+        self.__deadbands = dict()
+        self.__query_cache_ttl = query_cache_ttl
+        self.query_cache = QueryCache(max_entries=query_cache_size)
+        self.outbox = None
+        self.instrumentation = instrumentation
+        if transport == 'udp' and batch_size is None:
+            self.__batch_size = UDP_BATCH_SIZE
+        if transport not in TRANSPORTS:
+            log.critical("Unknown transport {}, expected one of {}".format(transport, TRANSPORTS))
+            self.client = None
+            return
         try:
-            client = InfluxDBClient(database=db_name)
-            client.create_database(db_name)
+            client = influxdb.InfluxDBClient(host=host, port=port, database=db_name, pool_size=pool_size, gzip=gzip,
+                                             retries=retries, timeout=timeout, use_udp=transport == 'udp',
+                                             udp_port=udp_port)
             client.switch_database(db_name)
             self.client = client
+            client.create_database(db_name)
+            self.__database_created = True
         except Exception as e:
-            log.critical("Cannot create database {}, is influx service started?. Exception {}".format(db_name, e))
-            self.client = None
+            if outbox is None:
+                log.critical("Cannot create database {}, is influx service started?. Exception {}".format(db_name, e))
+                self.client = None
+                return
+            log.warning("Cannot create database {}, inserts are spooled until it is. Exception {}".format(db_name, e))
+        if outbox is not None:
+            self.outbox = InfluxOutbox(outbox, self.__send_spooled, batch_size=outbox_batch_size)
+            self.outbox.start()
 
     def __del__(self):
+        if getattr(self, 'outbox', None) is not None:
+            self.outbox.stop()
         if self.client is not None:
             self.client.close()
 
@@ -93,6 +201,11 @@ class InfluxHelper():
         """
         if self.client is not None:
             self.client.drop_database(db_name)
+            if db_name == self.__db_name:
+                self.refresh_metadata()
+                self.query_cache.invalidate()
+            else:
+                self.__metadata.pop('databases', None)
             return True
         return False
 
@@ -104,7 +217,7 @@ class InfluxHelper():
         """
         if self.client is None:
             return []
-        return [db['name'] for db in self.client.get_list_database()]
+        return self.__cached('databases', lambda: [db['name'] for db in self.client.get_list_database()])
 
     def remove_measurement(self, measurement_name):
         if self.client is None or type(measurement_name) is not str:
@@ -114,6 +227,7 @@ class InfluxHelper():
             return False
 
         self.client.drop_measurement(measurement_name)
+        self.__forget_measurement(measurement_name)
         return True
 
     def get_measurement_names(self):
@@ -124,8 +238,76 @@ class InfluxHelper():
         """
         if self.client is None:
             return []
-        return [m['name'] for m in self.client.get_list_measurements()]
+        return self.__cached('measurements', lambda: [m['name'] for m in self.client.get_list_measurements()])
+
+    def get_tag_keys(self, measurement):
+        """ Get the names of all tag keys of a measurement
+
+        Returns:
+        tags (list): A list of all tag keys, this list is empty if an error occured.
+        """
+        if self.client is None:
+            return []
+        try:
+            return self.__cached(('tag_keys', measurement), lambda: [
+                t['tagKey'] for t in self.client.query("SHOW TAG KEYS FROM {}".format(measurement)).get_points()])
+        except Exception as e:
+            log.error("Cannot get tag keys for measurement {}. Exception {}".format(measurement, e))
+            return []
+
+    def get_field_keys(self, measurement):
+        """ Get the names and types of all field keys of a measurement
+
+        Returns:
+        fields (dict): The type of each field keyed by field name ('float', 'integer', 'string' or 'boolean').
+        This dictionary is empty if an error occured.
+        """
+        if self.client is None:
+            return dict()
+        try:
+            return self.__cached(('field_keys', measurement), lambda: {
+                f['fieldKey']: f['fieldType']
+                for f in self.client.query("SHOW FIELD KEYS FROM {}".format(measurement)).get_points()})
+        except Exception as e:
+            log.error("Cannot get field keys for measurement {}. Exception {}".format(measurement, e))
+            return dict()
+
+    def refresh_metadata(self):
+        """ Clear all cached metadata, the next listing of each is read from the server. """
+        self.__metadata.clear()
 
+    def __cached(self, key, loader):
+        if self.metadata_ttl > 0:
+            entry = self.__metadata.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.metadata_ttl:
+                return entry[1].copy()
+        value = loader()
+        if self.metadata_ttl > 0:
+            self.__metadata[key] = (time.monotonic(), value)
+        return value.copy()
+
+    def __forget_measurement(self, measurement):
+        self.query_cache.invalidate(measurement)
+        entry = self.__metadata.get('measurements')
+        if entry is not None and measurement in entry[1]:
+            entry[1].remove(measurement)
+        self.__metadata.pop(('tag_keys', measurement), None)
+        self.__metadata.pop(('field_keys', measurement), None)
+
+    def __note_write(self, measurement, field_keys, tag_keys):
+        # Keep the cached listings valid for anything this object writes, without another round trip.
+        self.query_cache.invalidate(measurement)
+        entry = self.__metadata.get('measurements')
+        if entry is not None and measurement not in entry[1]:
+            entry[1].append(measurement)
+        tags = self.__metadata.get(('tag_keys', measurement))
+        if tags is not None and not set(tag_keys or []) <= set(tags[1]):
+            del self.__metadata[('tag_keys', measurement)]
+        fields = self.__metadata.get(('field_keys', measurement))
+        if fields is not None and not set(field_keys) <= fields[1].keys():
+            del self.__metadata[('field_keys', measurement)]
+
+    @instrumented
     def get_last_time_entry(self, measurement, field, tag=None, tag_value=None, as_unix=False):
         """ Get the last time entry for a given query
 
@@ -144,11 +326,15 @@ class InfluxHelper():
         if self.client is None:
             return None
         if tag is None or tag_value is None:
-            lastTimeEntry = self.client.query("SELECT last({}) FROM {}".format(field, measurement))
+            query = "SELECT last({}) FROM {}".format(field, measurement)
         else:
-            lastTimeEntry = self.client.query("SELECT last({}) FROM {} WHERE {} ='{}'".format(
-                field, measurement, tag, tag_value))
-        dataPoints = lastTimeEntry.get_points()
+            query = "SELECT last({}) FROM {} WHERE {} ='{}'".format(field, measurement, tag, tag_value)
+        return self.__cached_query('get_last_time_entry', measurement, query, as_unix,
+                                   lambda: self.__read_last_time_entry(query, as_unix))
+
+    def __read_last_time_entry(self, query, as_unix):
+        current_call(self.instrumentation).add(statements=1)
+        dataPoints = self.client.query(query).get_points()
         try:
             data = next(dataPoints)
             if as_unix:
@@ -157,6 +343,314 @@ class InfluxHelper():
         except StopIteration:
             return None
 
+    @instrumented(error_result=None)
+    def get_last_time_entries(self, measurement, fields, group_by_tag, tag_values=None, as_unix=False):
+        """ Get the last time entry of one or more fields for every value of a tag in a single query
+
+        All statements are sent to the server in a single request, one round trip is made regardless
+        of the number of tag values.
+
+        Parameters:
+        measurement (str): The database measuement to use
+        fields (list): The fields of the measurement to query
+        group_by_tag (str): The tag to group the last entries by, e.g 'room'.
+        tag_values (list): The tag values to return, if None all tag values are returned.
+        as_unix: If true the time column contains unix timestamps, if false rfc3339 timestamps are returned.
+
+        Returns:
+        - A Pandas DataFrame indexed by tag value, with a 'time' column followed by the last value of each field.
+        The time is that of the most recent of the fields for each tag value.
+        - An empty DataFrame if no entries exist.
+        - None if an error occured.
+        """
+        if self.client is None or type(fields) is not list or len(fields) == 0:
+            return None
+
+        where = ''
+        if tag_values is not None:
+            where = ' WHERE ' + _build_tag_filter({group_by_tag: list(tag_values)})
+        query = ';'.join("SELECT last({0}) AS {0} FROM {1}{2} GROUP BY {3}".format(
+            field, measurement, where, group_by_tag) for field in fields)
+        return self.__cached_query('get_last_time_entries', measurement, query, as_unix,
+                                   lambda: self.__read_last_time_entries(query, measurement, fields, group_by_tag,
+                                                                         as_unix))
+
+    def __read_last_time_entries(self, query, measurement, fields, group_by_tag, as_unix):
+        current_call(self.instrumentation).add(statements=1)
+        try:
+            results = self.client.query(query, epoch='s' if as_unix else None)
+        except Exception as e:
+            log.error("Cannot get last time entries from measurement {}. Exception {}".format(measurement, e))
+            return None
+        if type(results) is not list:
+            results = [results]
+
+        entries = dict()
+        for field, result in zip(fields, results):
+            for series in result.raw.get('series', []):
+                tag_value = series.get('tags', {}).get(group_by_tag)
+                for time, value in series.get('values', []):
+                    entry = entries.setdefault(tag_value, {'time': time})
+                    # RFC3339 strings don't sort by time once some have fractional seconds.
+                    if as_unix:
+                        entry['time'] = max(entry['time'], time)
+                    else:
+                        entry['time'] = max(entry['time'], time, key=pd.Timestamp)
+                    entry[field] = value
+
+        df = pd.DataFrame.from_dict(entries, orient='index', columns=['time'] + fields)
+        df.index.name = group_by_tag
+        return df
+
+    @instrumented(error_result=None)
+    def query_range(self, measurement, fields, start, end, tags=None, chunksize=None, compact=False,
+                    time_index=None):
+        """ Get all entries of a measurement between two unix timestamps (inclusive)
+
+        The query is made using influxDB chunked responses with unix epoch timestamps. Each chunk
+        is parsed directly into a dataframe, so only one chunk is held as raw data at a time.
+
+        Parameters:
+        measurement (str): The database measurement to query
+        fields (list): The fields (or tags) to return as columns.
+        start (int): The unix timestamp to start the query from (inclusive).
+        end (int): The unix timestamp to end the query at (inclusive).
+        tags (dict): Tag values used as a filter, e.g {'room': 'kitchen'}.
+            A list of values can be given for a tag to match any of them, e.g {'room': ['kitchen', 'bedroom']}
+        chunksize (int):
+        -None: All entries are returned as a single dataframe.
+        -int: A generator is returned which yields a dataframe for each chunk of up to chunksize entries.
+        compact (Boolean):
+        -True: Tag (and string field) columns are returned as 'category', float fields as float32 and integer
+        fields as int32 where every value fits.
+        -False: Columns use the default pandas types.
+        time_index (str):
+        -None: The timestamps are returned in the 'timestamp' column.
+        -'epoch': The timestamps are returned as an int64 unix timestamp index named 'timestamp'.
+        -'datetime': The timestamps are returned as a datetime64[ns, UTC] index named 'timestamp'.
+
+        Returns:
+        - A Pandas DataFrame with a 'timestamp' column followed by the requested fields, or a generator
+        of DataFrames if chunksize is given.
+        - An empty DataFrame if no entries exist in the range.
+        - None if an error occured.
+        """
+        if self.client is None or type(fields) is not list or len(fields) == 0:
+            return None
+        if time_index not in TIME_INDEXES:
+            log.error("Unknown time index {}, expected one of {}".format(time_index, TIME_INDEXES))
+            return None
+
+        query = "SELECT {} FROM {} WHERE {}".format(', '.join(fields), measurement,
+                                                    _build_time_filter(start, end, tags))
+        return self.__read_frames(query, measurement, ['timestamp'] + fields, chunksize, 'query_range',
+                                  (compact, time_index))
+
+    @instrumented(error_result=None)
+    def query_aggregated(self, measurement, fields, start, end, every='1m', fn='mean', fill=None, tags=None,
+                         chunksize=None, compact=False, time_index=None):
+        """ Get entries of a measurement aggregated into time intervals by the server
+
+        The aggregation is done by influxDB using GROUP BY time(), only one entry per interval is sent.
+
+        Parameters:
+        measurement (str): The database measurement to query
+        fields (list): The fields to aggregate, each field is returned as a column of the same name.
+        start (int): The unix timestamp to start the query from (inclusive).
+        end (int): The unix timestamp to end the query at (inclusive).
+        every (str): The interval length as an influxDB duration, e.g '10s', '1m', '1h'.
+        fn (str): The influxDB aggregate or selector function, e.g 'mean', 'max', 'last', 'count'.
+        fill: The value used for intervals with no entries:
+        -None: Empty intervals are returned with null values.
+        -'none': Empty intervals are not returned.
+        -'previous' or 'linear': The value is taken from the previous entry or interpolated.
+        -int or float: The value is replaced with this number.
+        tags (dict): Tag values used as a filter, the same as query_range.
+        chunksize (int): If given, a generator of dataframes is returned, the same as query_range.
+        compact (Boolean): Return compact column types, the same as query_range.
+        time_index (str): Return the timestamps as the index, the same as query_range.
+
+        Returns:
+        - A Pandas DataFrame with a 'timestamp' column containing the start of each interval,
+        followed by the aggregated fields, or a generator of DataFrames if chunksize is given.
+        - An empty DataFrame if no entries exist in the range.
+        - None if an error occured.
+        """
+        if self.client is None or type(fields) is not list or len(fields) == 0:
+            return None
+        if time_index not in TIME_INDEXES:
+            log.error("Unknown time index {}, expected one of {}".format(time_index, TIME_INDEXES))
+            return None
+
+        query = "SELECT {} FROM {} WHERE {} GROUP BY time({})".format(
+            ', '.join("{0}({1}) AS {1}".format(fn, field) for field in fields), measurement,
+            _build_time_filter(start, end, tags), every)
+        if fill is not None:
+            query = query + " fill({})".format(fill)
+        return self.__read_frames(query, measurement, ['timestamp'] + fields, chunksize, 'query_aggregated',
+                                  (compact, time_index))
+
+    def create_downsample(self, measurement, every, fn, into_rp, fields=None, duration='INF', into_measurement=None,
+                          backfill=False):
+        """ Continuously aggregate a measurement into a retention policy
+
+        A continuous query is created which aggregates each completed interval of the measurement into
+        the retention policy, keeping all tags. The retention policy is created if it doesn't exist.
+        The result can be read with query_range or query_aggregated using the measurement name
+        '<into_rp>.<into_measurement>'.
+
+        Parameters:
+        measurement (str): The measurement to downsample.
+        every (str): The interval length as an influxDB duration, e.g '1m', '1h'.
+        fn (str): The influxDB aggregate or selector function, e.g 'mean', 'max'.
+        into_rp (str): The retention policy to write the aggregated entries to.
+        fields (list): The fields to aggregate, if None all numeric fields are used.
+        duration (str): The duration of the retention policy if it is created, 'INF' keeps data forever.
+        into_measurement (str): The measurement name to write to, the source measurement name if None.
+        backfill (Boolean): If true the existing entries of the measurement are aggregated immediately,
+            otherwise only intervals completed after the continuous query is created are aggregated.
+
+        Returns:
+        True: The continuous query exists (created or already existed).
+        False: An error occured, check logs for info.
+        """
+        if self.client is None:
+            return False
+        if fields is None:
+            fields = [k for k, v in self.get_field_keys(measurement).items() if v in ('float', 'integer')]
+        if len(fields) == 0:
+            log.error("No fields to downsample for measurement {}".format(measurement))
+            return False
+
+        name = self.__downsample_name(measurement, every, fn, into_rp)
+        select = "SELECT {} INTO {}.{} FROM {}{} GROUP BY time({}), *"
+        selection = ', '.join("{0}({1}) AS {1}".format(fn, field) for field in fields)
+        target = into_measurement or measurement
+        try:
+            if into_rp not in [rp['name'] for rp in self.client.get_list_retention_policies()]:
+                self.client.create_retention_policy(into_rp, duration, 1)
+            if name not in self.__continuous_query_names():
+                self.client.create_continuous_query(name, select.format(selection, into_rp, target, measurement, '',
+                                                                        every))
+            if backfill:
+                # SELECT INTO writes points, influxd only accepts it as a POST.
+                self.client.query(select.format(selection, into_rp, target, measurement, ' WHERE time >= 0s', every) +
+                                  ' fill(none)', method='POST')
+        except Exception as e:
+            log.error("Cannot create downsample {}. Exception {}".format(name, e))
+            return False
+        self.__metadata.pop('measurements', None)
+        self.query_cache.invalidate(target)
+        return True
+
+    def remove_downsample(self, measurement, every, fn, into_rp):
+        """ Remove a continuous query made by create_downsample, the retention policy and its data are kept
+
+        Returns:
+        True: The continuous query existed and was removed.
+        False: An error occured or the continuous query doesn't exist.
+        """
+        if self.client is None:
+            return False
+        name = self.__downsample_name(measurement, every, fn, into_rp)
+        try:
+            if name not in self.__continuous_query_names():
+                return False
+            self.client.drop_continuous_query(name)
+        except Exception as e:
+            log.error("Cannot remove downsample {}. Exception {}".format(name, e))
+            return False
+        return True
+
+    def __downsample_name(self, measurement, every, fn, into_rp):
+        return "{}_{}_{}_{}".format(measurement, fn, every, into_rp)
+
+    def __continuous_query_names(self):
+        for database in self.client.get_list_continuous_queries():
+            if self.__db_name in database:
+                return [cq['name'] for cq in database[self.__db_name]]
+        return []
+
+    def __cached_query(self, method, measurement, query, params, loader):
+        ttl = self.__query_cache_ttl
+        if type(ttl) is dict:
+            ttl = ttl.get(method, 0)
+        key = (method, ' '.join(query.split()), params)
+        return self.query_cache.get(key, measurement, loader, ttl=ttl)
+
+    def __read_frames(self, query, measurement, columns, chunksize, method, shape=(False, None)):
+        if chunksize is None:
+            return self.__cached_query(method, measurement, query, tuple(columns) + shape,
+                                       lambda: self.__read_frames_uncached(query, measurement, columns, chunksize,
+                                                                           shape))
+        return self.__read_frames_uncached(query, measurement, columns, chunksize, shape)
+
+    def __read_frames_uncached(self, query, measurement, columns, chunksize, shape):
+        compact, time_index = shape
+        try:
+            chunks = self.__query_chunked(query, chunksize or DEFAULT_CHUNK_SIZE)
+        except Exception as e:
+            log.error("Cannot query measurement {}. Exception {}".format(measurement, e))
+            return None
+
+        if chunksize is not None:
+            return (_shape_frame(df, compact, time_index)
+                    for df in self.__iterate_chunk_frames(chunks, columns))
+
+        try:
+            frames = list(self.__iterate_chunk_frames(chunks, columns))
+        except Exception as e:
+            log.error("Failed reading query response for measurement {}. Exception {}".format(measurement, e))
+            return None
+        if len(frames) == 0:
+            return _shape_frame(pd.DataFrame(columns=columns), compact, time_index)
+        # Frames are shaped after joining, categories from different chunks would otherwise differ.
+        return _shape_frame(pd.concat(frames, ignore_index=True), compact, time_index)
+
+    def __query_chunked(self, query, chunksize, epoch='s'):
+        current_call(self.instrumentation).add(statements=1)
+        # Chunked responses are only streamed when encoded as JSON, one JSON document per chunk.
+        headers = dict(self.client._headers, Accept='application/json')
+        params = {'q': query, 'db': self.__db_name, 'epoch': epoch, 'chunked': 'true', 'chunk_size': int(chunksize)}
+        response = self.client.request('query', params=params, stream=True, headers=headers)
+        return self.__iterate_chunks(response)
+
+    def __iterate_chunks(self, response):
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if 'error' in chunk:
+                raise influxdb_exceptions.InfluxDBClientError(chunk['error'])
+            for result in chunk.get('results', []):
+                if 'error' in result:
+                    raise influxdb_exceptions.InfluxDBClientError(result['error'])
+                yield result
+
+    def __iterate_chunk_frames(self, chunks, columns):
+        for chunk in chunks:
+            for series in chunk.get('series', []):
+                yield _series_to_df(series, columns)
+
+    def set_deadband(self, measurement, deadbands, heartbeat=None):
+        """ Only insert entries into a measurement which differ from the last inserted entry of their tag set
+
+        Entries passed to insert() are dropped before they are sent if every field with a deadband has
+        changed by no more than its deadband since the last inserted entry with the same tags. An entry is
+        always inserted if any of its other fields hold values. See DeadbandFilter.
+
+        Parameters:
+        measurement (str): The measurement to filter inserts for.
+        deadbands (dict): The deadband of each field, e.g {'temperature': 0.5, 'humidity': {'relative': 0.01}}.
+            None removes the measurement's filter.
+        heartbeat (float): An entry is inserted if the tag set's last was inserted this many seconds before.
+        """
+        if deadbands is None:
+            self.__deadbands.pop(measurement, None)
+        else:
+            self.__deadbands[measurement] = DeadbandFilter(deadbands, heartbeat)
+
+    @instrumented
     def insert(self, measurement, data, field_keys, tag_keys, use_timestamp=False):
         """ Insert one or more entries into a measuremtn
 
@@ -173,44 +667,339 @@ class InfluxHelper():
         -True: The dictionary's 'timestamp' key or dataframe's timestamp column is used in the influxDB timestamp value.
         -False: The current time is used in the influxDB timestamp value.
 
+        If a deadband is set for the measurement, unchanged entries are dropped first (see set_deadband).
+
         Returns:
-        True: No error occured, data was added to the database.
+        True: No error occured, data was added to the database (or all entries were dropped by the deadband).
         False: Some error occured, check logs for info
         """
         if self.client is None:
             return False
 
-        if type(data) is dict:
-            return self.__insert_dict_entry(measurement, data, field_keys, tag_keys, use_timestamp)
-        elif type(data) is pd.DataFrame:
-            return self.__insert_dataframe_entry(measurement, data, field_keys, tag_keys, use_timestamp)
+        deadband = None
+        if measurement in self.__deadbands and (type(data) is dict or is_dataframe(data)) and type(field_keys) is list:
+            # Entries kept by the deadband are only remembered if they are written.
+            deadband = self.__deadbands[measurement]
+            deadband.begin()
+        success = False
+        try:
+            success = self.__insert(measurement, data, field_keys, tag_keys, use_timestamp, deadband)
+        finally:
+            if deadband is not None and success:
+                deadband.commit()
+            elif deadband is not None:
+                deadband.rollback()
+        return success
+
+    def __insert(self, measurement, data, field_keys, tag_keys, use_timestamp, deadband):
+        if deadband is not None:
+            data = deadband.filter(data, tag_keys, field_keys, use_timestamp)
+            if data is None or len(data) == 0:
+                return True
+
+        if self.outbox is not None:
+            success = self.__spool_entry(measurement, data, field_keys, tag_keys, use_timestamp)
+        elif type(data) is dict:
+            success = self.__insert_dict_entry(measurement, data, field_keys, tag_keys, use_timestamp)
+        elif is_dataframe(data):
+            success = self.__insert_dataframe_entry(measurement, data, field_keys, tag_keys, use_timestamp)
         else:
             return False
+        if success:
+            self.__note_write(measurement, field_keys, tag_keys)
+            current_call(self.instrumentation).add(rows_in=1 if type(data) is dict else len(data))
+        return success
 
     def __insert_dataframe_entry(self, measurement, df, field_keys, tag_keys, use_timestamp):
-        all_entries = []
-        for index, row in df.iterrows():
-            single_entry = self.__organise_single_entry(row.to_dict(), measurement, field_keys, tag_keys, use_timestamp)
-            if single_entry is None:
-                return False
-            all_entries.append(single_entry)
+        if type(field_keys) is not list:
+            return False
+        call = current_call(self.instrumentation)
         try:
-            return self.client.write_points(all_entries)
+            with call.phase('convert'):
+                lines = _dataframe_to_lines(measurement, df, field_keys, tag_keys, use_timestamp)
+            if len(lines) == 0:
+                return True
+            with call.phase('write'):
+                return self.__write_points(lines, protocol='line')
         except Exception as e:
             log.error("Failed to add datapoints for dataframe entry. Exception {}".format(e))
             return False
 
+    @instrumented
+    def insert_many(self, entries, use_timestamp=False, max_payload=MAX_PAYLOAD_BYTES):
+        """ Insert entries for several measurements with as few writes as possible
+
+        The entries are combined into line protocol payloads of up to max_payload bytes, each sent as a
+        single write. Deadbands and the outbox are applied the same as insert().
+
+        Parameters:
+        entries (list): Tuples of (measurement, data, field_keys, tag_keys), with the same meaning as the
+            arguments of insert(). A measurement may appear more than once.
+        use_timestamp (Boolean):
+        -True: The 'timestamp' key or column of each entry is used in the influxDB timestamp value.
+        -False: The current time is used for all entries.
+        max_payload (int): The maximum number of bytes sent per write.
+
+        Returns:
+        results (dict): For each measurement, True if all its entries were written, otherwise False.
+        """
+        entries = list(entries)
+        if self.client is None:
+            return {entry[0]: False for entry in entries}
+
+        stamp = None if use_timestamp else str(time.time_ns())
+        results = dict()
+        pending = []
+        # Entries kept by a deadband are only remembered if their measurement's entries are all written.
+        deadbands = dict()
+        try:
+            self.__collect_entries(entries, use_timestamp, stamp, results, pending, deadbands)
+            self.__write_entries(pending, max_payload, results)
+        finally:
+            for measurement, deadband in deadbands.items():
+                if results.get(measurement):
+                    deadband.commit()
+                else:
+                    deadband.rollback()
+
+        for measurement, lines, field_keys, tag_keys in pending:
+            if results[measurement] and len(lines) > 0:
+                self.__note_write(measurement, field_keys, tag_keys)
+                current_call(self.instrumentation).add(rows_in=len(lines))
+        return results
+
+    def __collect_entries(self, entries, use_timestamp, stamp, results, pending, deadbands):
+        for measurement, data, field_keys, tag_keys in entries:
+            results.setdefault(measurement, True)
+            if measurement in self.__deadbands and (type(data) is dict or is_dataframe(data)) and \
+                    type(field_keys) is list:
+                if measurement not in deadbands:
+                    deadbands[measurement] = self.__deadbands[measurement]
+                    deadbands[measurement].begin()
+                data = deadbands[measurement].filter(data, tag_keys, field_keys, use_timestamp)
+                if data is None:
+                    continue
+            lines = self.__entry_to_lines(measurement, data, field_keys, tag_keys, use_timestamp, stamp)
+            if lines is None:
+                results[measurement] = False
+            else:
+                pending.append((measurement, lines, field_keys, tag_keys))
+
+    def __write_entries(self, pending, max_payload, results):
+        if self.outbox is not None:
+            if not self.outbox.append([line for entry in pending for line in entry[1]]):
+                results.update({entry[0]: False for entry in pending})
+        else:
+            for lines, measurements in self.__split_payloads(pending, max_payload):
+                try:
+                    success = self.__write_points(lines, protocol='line')
+                except Exception as e:
+                    log.error("Cannot write {} entries for measurements {}. Exception {}".format(
+                        len(lines), sorted(measurements), e))
+                    success = False
+                if not success:
+                    results.update({m: False for m in measurements})
+
+    def import_file(self, path, format='line', batch_size=5000, precision='n', measurement=None, tag_keys=None,
+                    field_keys=None, workers=4):
+        """ Stream entries from a file into the database without loading the whole file
+
+        The file is read (and decompressed if it is gzip) a batch at a time. Invalid lines are logged and
+        skipped. Up to workers batches are written concurrently. Deadbands and the outbox are not applied.
+
+        Parameters:
+        path (str): The file to read, it may be gzip compressed.
+        format (str):
+        -'line': influxDB line protocol, one point per line. Empty lines and '#' comments are skipped.
+        -'csv': A header row followed by one entry per row, with a 'timestamp' column of unix timestamps.
+        batch_size (int): The number of points sent per write.
+        precision (str): The precision of line protocol timestamps, 'n', 'u', 'ms', 's', 'm' or 'h'.
+        measurement (str): The measurement of csv entries, if None each row's 'measurement' column is used.
+        tag_keys (list): The csv columns written as tags.
+        field_keys (list): The csv columns written as fields, all other columns if None.
+            Numeric values are written as floats, 'true' and 'false' as booleans and others as strings.
+        workers (int): The number of writes made concurrently.
+
+        Returns:
+        - A dictionary with the number of points 'written', lines 'rejected' as invalid and points which
+        'failed' to write.
+        - None if the file can't be read or the format is unknown.
+        """
+        if self.client is None or format not in FILE_FORMATS:
+            log.error("Cannot import {} as format {}, expected one of {}".format(path, format, FILE_FORMATS))
+            return None
+        try:
+            handle = _open_text(path, 'r')
+        except Exception as e:
+            log.error("Cannot open file {} for import. Exception {}".format(path, e))
+            return None
+
+        counts = {'written': 0, 'rejected': 0, 'failed': 0}
+        if format == 'csv':
+            lines = self.__read_csv_lines(handle, measurement, tag_keys or [], field_keys, counts)
+            precision = 'n'
+        else:
+            lines = self.__read_protocol_lines(handle, counts)
+        in_flight = deque()
+        with handle, ThreadPoolExecutor(workers) as pool:
+            try:
+                for batch in _batches(lines, batch_size):
+                    in_flight.append((pool.submit(self.__write_batch, batch, precision), len(batch)))
+                    while len(in_flight) >= 2 * workers:
+                        self.__finish_batch(in_flight.popleft(), counts)
+            except Exception as e:
+                log.error("Cannot read file {}, the import stopped. Exception {}".format(path, e))
+            while len(in_flight) > 0:
+                self.__finish_batch(in_flight.popleft(), counts)
+        self.refresh_metadata()
+        self.query_cache.invalidate()
+        return counts
+
+    def export_to_file(self, measurement, start, end, path, tags=None, chunksize=DEFAULT_CHUNK_SIZE):
+        """ Stream all entries of a measurement between two unix timestamps (inclusive) to a line protocol file
+
+        The query is read in chunks, each chunk is written before the next is read. Integer fields keep their
+        type and timestamps are written in nanoseconds, so the file can be read back with import_file.
+
+        Parameters:
+        measurement (str): The measurement to export, 'rp.measurement' reads from another retention policy.
+        start (int): The unix timestamp to start from (inclusive).
+        end (int): The unix timestamp to end at (inclusive).
+        path (str): The file to write, it is gzip compressed if the name ends with '.gz'.
+        tags (dict): Tag values used as a filter, the same as query_range.
+        chunksize (int): The number of entries read from the server at a time.
+
+        Returns:
+        - The number of points written to the file.
+        - None if an error occured.
+        """
+        if self.client is None:
+            return None
+        field_types = self.get_field_keys(measurement)
+        tag_keys = self.get_tag_keys(measurement)
+        name = measurement.split('.')[-1]
+        query = "SELECT * FROM {} WHERE {}".format(measurement, _build_time_filter(start, end, tags))
+        written = 0
+        try:
+            with _open_text(path, 'w') as handle:
+                for chunk in self.__query_chunked(query, chunksize, epoch='ns'):
+                    for series in chunk.get('series', []):
+                        df = _series_to_df(series)
+                        lines = _dataframe_to_lines(name, df, list(field_types), tag_keys, True,
+                                                    field_types=field_types, time_scale=1)
+                        handle.writelines(line + '\n' for line in lines)
+                        written += len(lines)
+        except Exception as e:
+            log.error("Cannot export measurement {} to {}. Exception {}".format(measurement, path, e))
+            return None
+        return written
+
+    def __read_protocol_lines(self, handle, counts):
+        for line in handle:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            if _LINE_PROTOCOL.match(line) is None:
+                counts['rejected'] += 1
+                log.warning("Skipping invalid line protocol: {}".format(line[:200]))
+                continue
+            yield line
+
+    def __read_csv_lines(self, handle, measurement, tag_keys, field_keys, counts):
+        for row in csv.DictReader(handle):
+            try:
+                name = measurement or row['measurement']
+                keys = field_keys
+                if keys is None:
+                    keys = [k for k in row if k not in tag_keys and k not in ('timestamp', 'measurement')]
+                tags = ''.join(',' + _escape_key(k) + '=' + _escape_key(row[k]) for k in sorted(tag_keys) if row[k])
+                fields = ','.join(_escape_key(k) + '=' + _format_field_value(_parse_csv_value(row[k]))
+                                  for k in sorted(keys) if row[k])
+                if len(fields) == 0:
+                    raise ValueError('No field values')
+                yield '{}{} {} {}'.format(_escape_key(name), tags, fields, _unix_to_ns(row['timestamp']))
+            except Exception as e:
+                counts['rejected'] += 1
+                log.warning("Skipping invalid csv row {}. Exception {}".format(row, e))
+
+    def __write_batch(self, lines, precision):
+        return self.client.write_points(lines, time_precision=precision, batch_size=self.__batch_size,
+                                        protocol='line')
+
+    def __finish_batch(self, batch, counts):
+        future, size = batch
+        try:
+            success = future.result()
+        except Exception as e:
+            log.error("Failed to write {} imported points. Exception {}".format(size, e))
+            success = False
+        counts['written' if success else 'failed'] += size
+
+    def __split_payloads(self, pending, max_payload):
+        lines, measurements, size = [], set(), 0
+        for measurement, entry_lines, _, _ in pending:
+            for line in entry_lines:
+                length = len(line.encode()) + 1
+                if size + length > max_payload and len(lines) > 0:
+                    yield lines, measurements
+                    lines, measurements, size = [], set(), 0
+                lines.append(line)
+                measurements.add(measurement)
+                size += length
+        if len(lines) > 0:
+            yield lines, measurements
+
+    def __spool_entry(self, measurement, data, field_keys, tag_keys, use_timestamp):
+        # Spooled lines are sent later, so entries without a timestamp are given the current time now.
+        stamp = None if use_timestamp else str(time.time_ns())
+        lines = self.__entry_to_lines(measurement, data, field_keys, tag_keys, use_timestamp, stamp)
+        if lines is None:
+            return False
+        return self.outbox.append(lines)
+
+    def __entry_to_lines(self, measurement, data, field_keys, tag_keys, use_timestamp, stamp=None):
+        if type(field_keys) is not list or not (type(data) is dict or is_dataframe(data)):
+            log.error("Cannot write entry for measurement {}, expected a dict or dataframe and a list of "
+                      "field keys".format(measurement))
+            return None
+        try:
+            if type(data) is dict:
+                lines = [_dict_to_line(measurement, data, field_keys, tag_keys, use_timestamp)]
+            else:
+                lines = _dataframe_to_lines(measurement, data, field_keys, tag_keys, use_timestamp)
+        except Exception as e:
+            log.error("Cannot serialise entry for measurement {}. Exception {}".format(measurement, e))
+            return None
+        if stamp is not None:
+            lines = [line + ' ' + stamp for line in lines]
+        return lines
+
+    def __send_spooled(self, lines):
+        if not self.__database_created:
+            self.client.create_database(self.__db_name)
+            self.__database_created = True
+        return self.client.write_points(lines, batch_size=self.__batch_size, protocol='line')
+
     def __insert_dict_entry(self, measurement, data, field_keys, tag_keys, use_timestamp):
 
         new_entry = self.__organise_single_entry(data, measurement, field_keys, tag_keys, use_timestamp)
         if new_entry is None:
             return False
         try:
-            return self.client.write_points([new_entry])
+            with current_call(self.instrumentation).phase('write'):
+                return self.__write_points([new_entry])
         except Exception as e:
             log.error("Cannot add entry for measurent {} with entry {}. Exception {}".format(measurement, new_entry, e))
             return False
 
+    def __write_points(self, points, protocol='json'):
+        call = current_call(self.instrumentation)
+        if call.enabled:
+            lines = points if protocol == 'line' else line_protocol.make_lines({'points': points}).splitlines()
+            call.add(bytes_sent=sum(len(line.encode('utf-8')) + 1 for line in lines),
+                     statements=-(-len(points) // (self.__batch_size or len(points))))
+        return self.client.write_points(points, batch_size=self.__batch_size, protocol=protocol)
+
     def __organise_single_entry(self, data, measurement, field_keys, tag_keys, use_timestamp):
         new_entry = dict()
 
@@ -227,3 +1016,173 @@ class InfluxHelper():
 
         new_entry['measurement'] = measurement
         return new_entry
+
+
+def _escape_key(key):
+    """ Escape a measurement, tag or field key (or a series of them) for line protocol """
+    if is_series(key):
+        for char in ('\\', ' ', ',', '='):
+            key = key.str.replace(char, '\\' + char, regex=False)
+        return key.str.replace('\n', '\\n', regex=False)
+    for char in ('\\', ' ', ',', '='):
+        key = key.replace(char, '\\' + char)
+    return key.replace('\n', '\\n')
+
+
+def _build_time_filter(start, end, tags=None):
+    """ Build an InfluxQL condition for an inclusive range of unix timestamps, and optionally tag values """
+    condition = "time >= {}s AND time <= {}s".format(int(start), int(end))
+    if tags:
+        condition = condition + ' AND ' + _build_tag_filter(tags)
+    return condition
+
+
+def _build_tag_filter(tags):
+    """ Build an InfluxQL condition matching tag values, a list of values matches any of them """
+    conditions = []
+    for tag, value in tags.items():
+        if type(value) in (list, tuple, set):
+            conditions.append('(' + ' OR '.join("{} = '{}'".format(tag, v) for v in value) + ')')
+        else:
+            conditions.append("{} = '{}'".format(tag, value))
+    return ' AND '.join(conditions)
+
+
+def _series_to_df(series, columns=None):
+    """ Convert a series of a query result into a dataframe, the 'time' column is named 'timestamp' """
+    values = series.get('values', [])
+    names = ['timestamp' if c == 'time' else c for c in series['columns']]
+    if len(values) == 0:
+        return pd.DataFrame(columns=columns or names)
+    df = pd.DataFrame({name: column for name, column in zip(names, zip(*values))})
+    if columns is not None:
+        df = df[columns]
+    return df
+
+
+def _shape_frame(df, compact, time_index):
+    """ Convert the columns of a query dataframe to compact types and move the timestamps to the index
+
+    Tag values are always strings, so string columns are made categories without listing the tag keys.
+    """
+    if compact:
+        for column in df.columns:
+            values = df[column]
+            if column == 'timestamp':
+                continue
+            if pd.api.types.is_string_dtype(values):
+                df[column] = values.astype('category')
+            elif pd.api.types.is_float_dtype(values.dtype):
+                df[column] = values.astype('float32')
+            elif pd.api.types.is_integer_dtype(values.dtype) and \
+                    (len(values) == 0 or (values.min() >= INT32_MIN and values.max() <= INT32_MAX)):
+                df[column] = values.astype('int32')
+    if time_index is None:
+        return df
+    timestamps = df.pop('timestamp').to_numpy(dtype='int64')
+    if time_index == 'epoch':
+        df.index = pd.Index(timestamps, name='timestamp')
+    else:
+        df.index = pd.DatetimeIndex(pd.to_datetime(timestamps, unit='s', utc=True), name='timestamp')
+    return df
+
+
+def _dataframe_to_lines(measurement, df, field_keys, tag_keys, use_timestamp, field_types=None, time_scale=10**9):
+    """ Serialise the rows of a dataframe to line protocol
+
+    Each column is serialised as a whole, rather than building a point per row. Integer columns are
+    written as integer fields and other numeric columns as float fields, the same as single entries,
+    unless field_types gives the field's type ('integer' or 'float'). Rows without any field values are
+    skipped. Timestamps are multiplied by time_scale to give nanoseconds.
+    """
+    lines = pd.Series(_escape_key(measurement), index=df.index, dtype=object)
+    for tag in sorted(set(tag_keys or []) & set(df.columns)):
+        values = _escape_key(df[tag].astype(str))
+        present = df[tag].notna() & (values != '')
+        lines = lines + (',' + _escape_key(tag) + '=' + values).where(present, '')
+
+    fields = pd.Series('', index=df.index, dtype=object)
+    for field in sorted(set(field_keys) & set(df.columns)):
+        column = df[field]
+        field_type = (field_types or {}).get(field)
+        if pd.api.types.is_bool_dtype(column.dtype):
+            values = column.map(str)
+        elif field_type == 'integer' or (field_type is None and pd.api.types.is_integer_dtype(column.dtype)):
+            values = column.where(column.notna(), 0).astype('int64').astype(str) + 'i'
+        elif pd.api.types.is_numeric_dtype(column.dtype):
+            values = column.astype(float).map(repr)
+        else:
+            values = column.map(_format_field_value)
+        fields = fields + (',' + _escape_key(field) + '=' + values).where(column.notna(), '')
+
+    lines = lines + ' ' + fields.str[1:]
+    if use_timestamp:
+        lines = lines + ' ' + (df['timestamp'].astype('int64') * time_scale).astype(str)
+    return lines[fields != ''].tolist()
+
+
+def _dict_to_line(measurement, data, field_keys, tag_keys, use_timestamp):
+    """ Serialise a single dictionary entry to line protocol, a ValueError is raised if it has no fields """
+    tags = [(k, str(data[k])) for k in sorted(data.keys() & (tag_keys or [])) if data[k] is not None]
+    fields = [(k, data[k]) for k in sorted(data.keys() & field_keys) if data[k] is not None]
+    if len(fields) == 0:
+        raise ValueError("Entry has no field values")
+    line = _escape_key(measurement) + ''.join(
+        ',' + _escape_key(k) + '=' + _escape_key(v) for k, v in tags if v != '')
+    line = line + ' ' + ','.join(_escape_key(k) + '=' + _format_field_value(v) for k, v in fields)
+    if use_timestamp:
+        line = line + ' ' + str(int(data['timestamp']) * 10**9)
+    return line
+
+
+def _open_text(path, mode):
+    """ Open a text file for streaming, gzip files are detected when reading and chosen by name when writing """
+    if mode == 'w':
+        if path.endswith('.gz'):
+            return gzip.open(path, 'wt', encoding='utf-8', newline='')
+        return open(path, 'w', encoding='utf-8', newline='')
+    with open(path, 'rb') as handle:
+        compressed = handle.read(2) == b'\x1f\x8b'
+    if compressed:
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def _parse_csv_value(value):
+    if value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _unix_to_ns(timestamp):
+    try:
+        return int(timestamp) * 10**9
+    except ValueError:
+        return int(round(float(timestamp) * 10**9))
+
+
+def _format_field_value(value):
+    """ Format a single field value for line protocol, the same as the influxdb client """
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, str):
+        return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, int):
+        return str(value) + 'i'
+    return repr(float(value))
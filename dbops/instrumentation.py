@@ -0,0 +1,310 @@
+"""
+Instrumentation: Single class module for recording per call timings and counters.
+Author Stuart Ianna
+"""
+
+import functools
+import threading
+import logging
+import time
+import os
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+COUNTERS = ('rows_in', 'rows_out', 'bytes_sent', 'statements', 'commits')
+
+
+class Instrumentation():
+    """Class for recording what SQHelper and InfluxHelper calls spend their time on
+
+    Each instrumented method call records its latency in a histogram, whether it failed, and counters
+    for rows written and read, bytes sent, statements (sqlite3 statements or influxDB requests) and
+    commits. Some methods also record the time spent in each phase, e.g 'convert', 'execute' and 'commit'.
+
+    Results can be read with get_stats(), written as a Prometheus text file, passed to a callback
+    after every call, or reported as spans to an OpenTelemetry style tracer. Any object with a
+    start_as_current_span(name) context manager whose span has set_attribute(key, value) can be used,
+    including opentelemetry.trace.get_tracer(__name__).
+
+    Helpers are instrumented by passing an instance, e.g SQHelper('database.db', instrumentation=...).
+    One instance can be shared between helpers and threads. Helpers without an instance skip all
+    recording, only a single attribute check is made per call.
+
+    The logging module is used to log errors and warnings.
+
+    Typical Usage:
+
+    >>> instrumentation = Instrumentation(callback=print)
+    >>> database = SQHelper('database.db', instrumentation=instrumentation)
+    >>> database.insert('Temperature', {'timestamp': 1587222785, 'value': 23.2})
+    {'name': 'SQHelper.insert', 'seconds': 0.0021, 'error': False, 'rows_in': 1, 'rows_out': 0, 'bytes_sent': 0,
+     'statements': 1, 'commits': 1, 'phases': {'convert': 0.00001, 'execute': 0.00003, 'commit': 0.0020}}
+    True
+    >>> instrumentation.get_stats()['SQHelper.insert']['calls']
+    1
+
+    # Write the stats for the node exporter text file collector
+    >>> instrumentation.write_prometheus('/var/lib/node_exporter/dbops.prom')
+    True
+
+    Attributes:
+        - callback (callable) - Called with a dictionary describing each call, None for no callback
+        - tracer - An OpenTelemetry style tracer each call is reported to as a span, None for no spans
+        - buckets (tuple) - The upper bounds in seconds of the latency histogram buckets
+    """
+    def __init__(self, callback=None, tracer=None, buckets=LATENCY_BUCKETS):
+        """ Create an instance with no recorded calls
+
+        Parameters:
+        callback (callable): Called with a dictionary describing each call, exceptions raised are logged.
+        tracer: An OpenTelemetry style tracer each call is reported to as a span.
+        buckets (tuple): The upper bounds in seconds of the latency histogram buckets, in increasing order.
+        """
+        self.callback = callback
+        self.tracer = tracer
+        self.buckets = tuple(buckets)
+        self.__stats = dict()
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    def call(self, name):
+        """ Create a context manager recording a single call
+
+        Parameters:
+        name (str): The name of the call, e.g 'SQHelper.insert'.
+
+        Returns:
+        - The call, use add() and phase() to record its counters and phases.
+        """
+        return _Call(self, name)
+
+    def current(self):
+        """ Get the innermost call in progress on this thread
+
+        Returns:
+        - The call, or a call which records nothing if none is in progress.
+        """
+        calls = getattr(self.__local, 'calls', None)
+        return calls[-1] if calls else NULL_CALL
+
+    def get_stats(self):
+        """ Get the recorded stats of every call name
+
+        Returns:
+        stats (dict): Keyed by call name, each a dictionary of:
+        -'calls': The number of calls.
+        -'errors': The number of calls which raised an exception or returned their failure value.
+        -'seconds': The total time spent in the calls.
+        -'histogram': The number of calls which took at most each bucket's seconds (cumulative), the last bucket is inf.
+        -'phases': The total time spent in each phase of the calls.
+        -'rows_in', 'rows_out', 'bytes_sent', 'statements', 'commits': The total of each counter.
+        """
+        with self.__lock:
+            bounds = self.buckets + (float('inf'), )
+            return {name: dict(entry, phases=dict(entry['phases']),
+                               histogram=dict(zip(bounds, _cumulative(entry['histogram']))))
+                    for name, entry in self.__stats.items()}
+
+    def reset(self):
+        """ Forget all recorded calls """
+        with self.__lock:
+            self.__stats.clear()
+
+    def write_prometheus(self, path, prefix='dbops'):
+        """ Write the recorded stats in the Prometheus text format
+
+        The file is written to a temporary file and renamed, so a collector never reads a partial file.
+
+        Parameters:
+        path (str): The path of the file to write, e.g for the node exporter text file collector.
+        prefix (str): The prefix of each metric name.
+
+        Returns:
+        True: The file was written.
+        False: An error occured, check logs for info.
+        """
+        lines = []
+        stats = self.get_stats()
+
+        def metric(name, kind, help_text, samples):
+            lines.append("# HELP {}_{} {}".format(prefix, name, help_text))
+            lines.append("# TYPE {}_{} {}".format(prefix, name, kind))
+            for suffix, labels, value in samples:
+                lines.append("{}_{}{}{{{}}} {}".format(prefix, name, suffix, ','.join(
+                    '{}="{}"'.format(k, v) for k, v in labels), repr(float(value)) if type(value) is float else value))
+
+        metric('call_duration_seconds', 'histogram', 'The duration of each call.', [
+            sample for name, entry in sorted(stats.items()) for sample in
+            [('_bucket', [('call', name), ('le', '+Inf' if bound == float('inf') else repr(float(bound)))], count)
+             for bound, count in entry['histogram'].items()] +
+            [('_sum', [('call', name)], entry['seconds']), ('_count', [('call', name)], entry['calls'])]])
+        metric('call_errors_total', 'counter', 'The number of failed calls.',
+               [('', [('call', name)], entry['errors']) for name, entry in sorted(stats.items())])
+        for counter in COUNTERS:
+            metric(counter + '_total', 'counter', 'The total {} of each call.'.format(counter.replace('_', ' ')),
+                   [('', [('call', name)], entry[counter]) for name, entry in sorted(stats.items())])
+        metric('phase_seconds_total', 'counter', 'The time spent in each phase of a call.', [
+            ('', [('call', name), ('phase', phase)], seconds)
+            for name, entry in sorted(stats.items()) for phase, seconds in sorted(entry['phases'].items())])
+
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            with open(temporary, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(temporary, path)
+        except Exception as e:
+            log.error("Cannot write Prometheus stats to {}. Exception {}".format(path, e))
+            return False
+        return True
+
+    def _push(self, call):
+        calls = getattr(self.__local, 'calls', None)
+        if calls is None:
+            calls = self.__local.calls = []
+        calls.append(call)
+
+    def _pop(self, call, seconds):
+        self.__local.calls.pop()
+        bucket = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                bucket = i
+                break
+        with self.__lock:
+            entry = self.__stats.get(call.name)
+            if entry is None:
+                entry = self.__stats[call.name] = dict({c: 0 for c in COUNTERS}, calls=0, errors=0, seconds=0.0,
+                                                       histogram=[0] * (len(self.buckets) + 1), phases=dict())
+            entry['calls'] += 1
+            entry['errors'] += int(call.error)
+            entry['seconds'] += seconds
+            entry['histogram'][bucket] += 1
+            for counter in COUNTERS:
+                entry[counter] += call.counters[counter]
+            for phase, phase_seconds in call.phases.items():
+                entry['phases'][phase] = entry['phases'].get(phase, 0) + phase_seconds
+        if self.callback is not None:
+            try:
+                self.callback(dict(call.counters, name=call.name, seconds=seconds, error=call.error,
+                                   phases=dict(call.phases)))
+            except Exception as e:
+                log.error("Instrumentation callback failed for {}. Exception {}".format(call.name, e))
+
+
+class _Call():
+    """ A single instrumented call, used as a context manager """
+    enabled = True
+
+    def __init__(self, instrumentation, name):
+        self.name = name
+        self.error = False
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.phases = dict()
+        self.__instrumentation = instrumentation
+        self.__span_context = None
+        self.__span = None
+
+    def __enter__(self):
+        if self.__instrumentation.tracer is not None:
+            self.__span_context = self.__instrumentation.tracer.start_as_current_span(self.name)
+            self.__span = self.__span_context.__enter__()
+        self.__instrumentation._push(self)
+        self.__start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.__start
+        if exc_type is not None:
+            self.error = True
+        self.__instrumentation._pop(self, seconds)
+        if self.__span is not None:
+            try:
+                for counter, value in self.counters.items():
+                    self.__span.set_attribute('dbops.' + counter, value)
+                for phase, phase_seconds in self.phases.items():
+                    self.__span.set_attribute('dbops.phase.' + phase, phase_seconds)
+                self.__span.set_attribute('dbops.error', self.error)
+            finally:
+                self.__span_context.__exit__(exc_type, exc_value, traceback)
+        return False
+
+    def add(self, **counters):
+        """ Add to the call's counters, e.g add(rows_in=10, statements=1) """
+        for counter, value in counters.items():
+            self.counters[counter] += value
+
+    def phase(self, name):
+        """ Create a context manager adding the time spent in it to a phase of the call """
+        return _Phase(self.phases, name)
+
+
+class _Phase():
+    def __init__(self, phases, name):
+        self.__phases = phases
+        self.__name = name
+
+    def __enter__(self):
+        self.__start = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.__phases[self.__name] = self.__phases.get(self.__name, 0) + time.perf_counter() - self.__start
+        return False
+
+
+class _NullCall():
+    """ A call which records nothing, used when instrumentation is disabled """
+    enabled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def add(self, **counters):
+        pass
+
+    def phase(self, name):
+        return self
+
+
+NULL_CALL = _NullCall()
+
+
+def instrumented(function=None, error_result=False, count_rows=True):
+    """ Decorate a helper method so each call is recorded by the helper's instrumentation attribute
+
+    A call counts as an error if it raises or returns error_result (or an equal value of the same type,
+    e.g an empty list). If count_rows, the length of a returned dataframe, list or array is added to rows_out.
+    """
+    if function is None:
+        return functools.partial(instrumented, error_result=error_result, count_rows=count_rows)
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        if self.instrumentation is None:
+            return function(self, *args, **kwargs)
+        with self.instrumentation.call(name) as call:
+            result = function(self, *args, **kwargs)
+            if result is error_result or (type(result) is type(error_result) and result == error_result):
+                call.error = True
+            elif count_rows and type(result) not in (dict, str, bool) and hasattr(result, '__len__'):
+                call.add(rows_out=len(result))
+            return result
+    return wrapper
+
+
+def current_call(instrumentation):
+    """ Get the innermost call in progress on this thread, a call which records nothing if disabled """
+    return NULL_CALL if instrumentation is None else instrumentation.current()
+
+
+def _cumulative(counts):
+    total = 0
+    result = []
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
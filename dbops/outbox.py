@@ -0,0 +1,227 @@
+"""
+Outbox: Single class module for spooling influx writes to a local sqlite3 database.
+Author Stuart Ianna
+"""
+
+from dbops.sqhelper import SQHelper
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+SPOOL_TABLE = 'dbops_outbox'
+SPOOL_COLUMNS = {'id': 'INTEGER PRIMARY KEY', 'line': 'TEXT', 'created': 'NUMERIC'}
+# Lines the server refused, kept for inspection instead of blocking the spool.
+REJECTED_TABLE = 'dbops_outbox_rejected'
+REJECTED_COLUMNS = {'id': 'INTEGER PRIMARY KEY', 'line': 'TEXT', 'created': 'NUMERIC', 'rejected': 'NUMERIC',
+                    'error': 'TEXT'}
+# Client errors which are fixed by configuration (authentication, a missing database) rather than by the lines.
+RETRIED_CLIENT_ERRORS = (401, 403, 404)
+MAX_BACKOFF = 60
+
+
+class InfluxOutbox():
+    """Class for durably spooling influx line protocol writes and replaying them in the background
+
+    Lines are appended to a table in a sqlite3 file, one transaction per append. A background thread
+    reads the oldest lines in batches, writes them and removes them from the spool once the write
+    succeeds. While writes fail the drainer waits, doubling the wait up to one minute, and retries.
+    Lines spooled before a restart are sent once a new outbox is started on the same file.
+
+    A batch the server rejects as invalid (a 4xx client error, e.g bad line protocol or a field type
+    conflict) would never be accepted, so it is split in half and each half sent again until the
+    rejected lines are found. They are moved to the REJECTED_TABLE table with the error and logged, and
+    the lines after them are sent.
+
+    This class is normally created through InfluxHelper(..., outbox='spool.sql'). The spool is only
+    appended to from the thread which created the outbox, the drainer uses its own connection.
+
+    The logging module is used to log errors and warnings.
+
+    Typical Usage:
+
+    >>> outbox = InfluxOutbox('spool.sql', write=lambda lines: client.write_points(lines, protocol='line'))
+    >>> outbox.start()
+    >>> outbox.append(['Environment,room=kitchen temperature=23.3 1585848415000000000'])
+    True
+    >>> outbox.get_stats()
+    {'size': 1, 'age': 0.2, 'drained': 0, 'drain_rate': 0.0, 'failures': 0, 'rejected': 0}
+    >>> outbox.flush(timeout=10)
+    True
+    >>> outbox.stop()
+
+    Attributes:
+        - path (str) - The path to the sqlite3 spool file
+        - batch_size (int) - The maximum number of lines written at a time
+        - interval (float) - The number of seconds to wait when the spool is empty, or after a failed write
+    """
+    def __init__(self, path, write, batch_size=5000, interval=1, is_rejected=None):
+        """ Open (or create) a spool file, the drainer is not started until start() is called
+
+        Parameters:
+        path (str): The path to the sqlite3 spool file.
+        write (callable): Called by the drainer with a list of lines, a falsy return or an exception
+            means the write failed and the lines are kept.
+        batch_size (int): The maximum number of lines written at a time.
+        interval (float): The number of seconds to wait when the spool is empty, or after a failed write.
+        is_rejected (callable): Called with the exception raised by write, True if the server will never
+            accept the lines. If None, exceptions with a 'code' attribute of 400-499 (e.g InfluxDBClientError)
+            count as rejected, except 401, 403 and 404.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.__write = write
+        self.__is_rejected = _is_client_error if is_rejected is None else is_rejected
+        self.__spool = SQHelper(path)
+        self.__spool.con.execute('PRAGMA journal_mode=WAL')
+        self.__spool.con.execute('PRAGMA synchronous=NORMAL')
+        self.__spool.create_table(SPOOL_TABLE, SPOOL_COLUMNS)
+        self.__spool.create_table(REJECTED_TABLE, REJECTED_COLUMNS)
+        self.__stop = threading.Event()
+        self.__wake = threading.Event()
+        self.__thread = None
+        self.__drained = 0
+        self.__drain_rate = 0.0
+        self.__failures = 0
+
+    def start(self):
+        """ Start the background drainer, if it isn't already running """
+        if self.__thread is not None and self.__thread.is_alive():
+            return
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__drain, name='dbops-outbox', daemon=True)
+        self.__thread.start()
+
+    def stop(self, timeout=None):
+        """ Stop the background drainer after its current batch, spooled lines are kept
+
+        Parameters:
+        timeout (float): The maximum number of seconds to wait for the drainer, None waits forever.
+        """
+        self.__stop.set()
+        self.__wake.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+            self.__thread = None
+
+    def append(self, lines):
+        """ Add lines to the spool in a single transaction
+
+        Parameters:
+        lines (list): Line protocol strings, each must include its timestamp.
+
+        Returns:
+        True: The lines are stored and will be sent by the drainer.
+        False: The lines could not be stored.
+        """
+        if len(lines) == 0:
+            return True
+        now = time.time()
+        try:
+            self.__spool.con.executemany("INSERT INTO {} (line, created) VALUES (?, ?)".format(SPOOL_TABLE),
+                                         ((line, now) for line in lines))
+            self.__spool.con.commit()
+        except Exception as e:
+            self.__spool.con.rollback()
+            log.error("Cannot add {} lines to spool {}. Exception {}".format(len(lines), self.path, e))
+            return False
+        self.__wake.set()
+        return True
+
+    def flush(self, timeout=None):
+        """ Wait until the spool is empty
+
+        Parameters:
+        timeout (float): The maximum number of seconds to wait, None waits forever.
+
+        Returns:
+        True: All spooled lines have been sent.
+        False: Lines remain after the timeout, or the drainer isn't running.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.get_stats()['size'] > 0:
+            if self.__thread is None or (deadline is not None and time.monotonic() > deadline):
+                return False
+            self.__wake.set()
+            time.sleep(0.01)
+        return True
+
+    def get_stats(self):
+        """ Get the state of the spool and drainer
+
+        Returns:
+        stats (dict):
+        -'size': The number of lines waiting to be sent.
+        -'age': The number of seconds the oldest waiting line has been spooled for, 0 if empty.
+        -'drained': The number of lines sent since the outbox was created.
+        -'drain_rate': The lines per second sent by the last successful batch.
+        -'failures': The number of consecutive failed writes, 0 once a write succeeds.
+        -'rejected': The number of lines the server rejected, kept in REJECTED_TABLE.
+        """
+        size, oldest = self.__spool.con.execute("SELECT count(*), min(created) FROM {}".format(SPOOL_TABLE)).fetchone()
+        rejected = self.__spool.con.execute("SELECT count(*) FROM {}".format(REJECTED_TABLE)).fetchone()[0]
+        return {
+            'size': size,
+            'age': 0 if oldest is None else max(time.time() - oldest, 0),
+            'drained': self.__drained,
+            'drain_rate': self.__drain_rate,
+            'failures': self.__failures,
+            'rejected': rejected
+        }
+
+    def __drain(self):
+        spool = SQHelper(self.path)
+        try:
+            while not self.__stop.is_set():
+                rows = spool.con.execute("SELECT id, line FROM {} ORDER BY id LIMIT ?".format(SPOOL_TABLE),
+                                         (self.batch_size, )).fetchall()
+                if len(rows) == 0:
+                    self.__wait(self.interval)
+                elif self.__send(spool, rows):
+                    self.__failures = 0
+                else:
+                    self.__failures += 1
+                    # New appends don't cut the backoff short, only stop() does.
+                    self.__stop.wait(min(self.interval * 2**(self.__failures - 1), MAX_BACKOFF))
+        finally:
+            spool.con.close()
+
+    def __send(self, spool, rows):
+        start = time.monotonic()
+        try:
+            if not self.__write([row[1] for row in rows]):
+                return False
+        except Exception as e:
+            if not self.__is_rejected(e):
+                log.warning("Cannot send {} spooled lines, retrying later. Exception {}".format(len(rows), e))
+                return False
+            if len(rows) > 1:
+                # Find the rejected lines, so the others are still sent.
+                half = len(rows) // 2
+                return self.__send(spool, rows[:half]) and self.__send(spool, rows[half:])
+            self.__reject(spool, rows[0], e)
+            return True
+        spool.con.execute("DELETE FROM {} WHERE id <= ?".format(SPOOL_TABLE), (rows[-1][0], ))
+        spool.con.commit()
+        self.__drained += len(rows)
+        self.__drain_rate = len(rows) / max(time.monotonic() - start, 1e-6)
+        return True
+
+    def __reject(self, spool, row, error):
+        log.error("Influx rejected spooled line {}, moved to {}. Exception {}".format(row[1], REJECTED_TABLE, error))
+        spool.con.execute("INSERT INTO {} (id, line, created, rejected, error) SELECT id, line, created, ?, ? FROM {} "
+                          "WHERE id = ?".format(REJECTED_TABLE, SPOOL_TABLE), (time.time(), str(error), row[0]))
+        spool.con.execute("DELETE FROM {} WHERE id = ?".format(SPOOL_TABLE), (row[0], ))
+        spool.con.commit()
+
+    def __wait(self, seconds):
+        self.__wake.wait(seconds)
+        self.__wake.clear()
+
+
+def _is_client_error(error):
+    """ Check if a write failed because the server will never accept the lines, e.g a 400 response """
+    code = getattr(error, 'code', None)
+    return type(code) is int and 400 <= code < 500 and code not in RETRIED_CLIENT_ERRORS
@@ -0,0 +1,129 @@
+"""
+QueryCache: Single class module for caching query results in memory.
+Author Stuart Ianna
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class QueryCache():
+    """Class for caching query results for a short time, shared between threads
+
+    Results are stored against a key (e.g normalised query text and parameters) with the measurement
+    they read, and expire after a time to live. The least recently used result is evicted once
+    max_entries are held. Concurrent misses for the same key are coalesced, only one caller runs
+    the query while the others wait for its result.
+
+    Results are returned as copies, so callers may modify them.
+
+    Typical Usage:
+
+    >>> cache = QueryCache(ttl=1, max_entries=256)
+    >>> cache.get(('last', 'SELECT last(temperature) FROM Environment'), 'Environment', run_query)
+    {'time': 1585848415, 'last': 23.3}
+
+    # Results which read a measurement are removed when it is written to
+    >>> cache.invalidate('Environment')
+
+    Attributes:
+        - ttl (float) - The default number of seconds results are kept for
+        - max_entries (int) - The maximum number of results held
+        - hits (int) - The number of results returned from the cache, including coalesced waits
+        - misses (int) - The number of results which were queried
+    """
+    def __init__(self, ttl=1, max_entries=256):
+        """ Create an empty cache
+
+        Parameters:
+        ttl (float): The default number of seconds results are kept for.
+        max_entries (int): The maximum number of results held.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__loading = dict()
+        self.__generation = 0
+        self.__lock = threading.Lock()
+
+    def get(self, key, measurement, loader, ttl=None):
+        """ Get a cached result, or run the loader and cache its result
+
+        Parameters:
+        key (hashable): Identifies the query and its parameters.
+        measurement (str): The measurement the query reads, used for invalidation.
+        loader (callable): Runs the query, a result of None is returned but not cached.
+        ttl (float): The number of seconds the result is kept for, the cache's ttl if None. 0 disables caching.
+
+        Returns:
+        - A copy of the cached or loaded result.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return loader()
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return _copy(entry[2])
+            loading = self.__loading.get(key)
+            if loading is None:
+                loading = self.__loading[key] = threading.Event()
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            loading.wait()
+            with self.__lock:
+                entry = self.__entries.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    return _copy(entry[2])
+            # The leader failed or its result was invalidated, query separately.
+            return loader()
+
+        with self.__lock:
+            generation = self.__generation
+            self.misses += 1
+        try:
+            result = loader()
+            with self.__lock:
+                if result is not None and generation == self.__generation:
+                    self.__entries[key] = (time.monotonic() + ttl, measurement, result)
+                    self.__entries.move_to_end(key)
+                    while len(self.__entries) > self.max_entries:
+                        self.__entries.popitem(last=False)
+            return _copy(result)
+        finally:
+            with self.__lock:
+                del self.__loading[key]
+            loading.set()
+
+    def invalidate(self, measurement=None):
+        """ Remove cached results
+
+        Parameters:
+        measurement (str): Remove the results which read this measurement (in any retention policy),
+            None removes all results.
+        """
+        with self.__lock:
+            self.__generation += 1
+            if measurement is None:
+                self.__entries.clear()
+                return
+            for key in [k for k, e in self.__entries.items()
+                        if e[1] == measurement or e[1].endswith('.' + measurement)]:
+                del self.__entries[key]
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+def _copy(result):
+    return result.copy() if hasattr(result, 'copy') else result
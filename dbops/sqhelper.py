@@ -3,13 +3,62 @@ SQHelper: Single class module for working with sqlite3 databases.
 Author Stuart Ianna
 """
 
+from dbops.deadband import DeadbandFilter
+from dbops.arraycolumn import ArrayColumn
+from dbops.instrumentation import instrumented, current_call
+from dbops._lazy import LazyModule, is_dataframe
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
 import sqlite3 as sq
-import pandas as pd
+import itertools
+import operator
+import numbers
 import logging
+import time
 import os
 
 log = logging.getLogger(__name__)
 
+# pandas is only imported once a dataframe is returned, inserts of lists and dictionaries don't need it.
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+pa = LazyModule('pyarrow')
+
+RESULT_FORMATS = ('dataframe', 'tuples', 'dicts', 'numpy', 'arrow')
+MODES = ('rw', 'ro', 'immutable')
+# Immutable databases are memory mapped up to this many bytes unless mmap_size is given.
+IMMUTABLE_MMAP_SIZE = 1 << 30
+
+# The side table holding the row count and timestamp range of each table, see table_stats.
+STATS_TABLE = 'dbops_table_stats'
+# The current unix time in seconds, as a sqlite3 expression.
+NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+STATS_TRIGGERS = {
+    'insert': "CREATE TRIGGER IF NOT EXISTS dbops_stats_insert_{table} AFTER INSERT ON {table} BEGIN "
+              "UPDATE " + STATS_TABLE + " SET rows = rows + 1, {timestamp}last_insert = " + NOW + " "
+              "WHERE name = '{table}'; END",
+    'delete': "CREATE TRIGGER IF NOT EXISTS dbops_stats_delete_{table} AFTER DELETE ON {table} BEGIN "
+              "UPDATE " + STATS_TABLE + " SET rows = rows - 1{stale} WHERE name = '{table}'; END",
+    'update': "CREATE TRIGGER IF NOT EXISTS dbops_stats_update_{table} AFTER UPDATE OF timestamp ON {table} BEGIN "
+              "UPDATE " + STATS_TABLE + " SET stale = 1 WHERE name = '{table}'; END",
+}
+# Inserts widen the range, deleting the first or last timestamp marks it to be recomputed.
+STATS_INSERT_RANGE = ("min_timestamp = coalesce(min(min_timestamp, NEW.timestamp), min_timestamp, NEW.timestamp), "
+                      "max_timestamp = coalesce(max(max_timestamp, NEW.timestamp), max_timestamp, NEW.timestamp), ")
+STATS_DELETE_RANGE = (", stale = max(stale, coalesce(OLD.timestamp <= min_timestamp "
+                      "OR OLD.timestamp >= max_timestamp, 0))")
+
+# The statement run by each query method, also used by explain().
+QUERIES = {
+    'table_to_df': "SELECT * FROM {table}",
+    'get_last_time_entry': "SELECT * FROM {table} ORDER BY timestamp DESC LIMIT 1",
+    'get_row_range': "SELECT * FROM {table} WHERE {column} BETWEEN {minimum} AND {maximum}",
+    'get_row': "SELECT * FROM {table} WHERE {column} = {query}",
+    'get_last_rows': "SELECT * FROM {table} ORDER BY timestamp DESC LIMIT {maximum}",
+    'remove_row_range': "DELETE FROM {table} WHERE {column} BETWEEN {minimum} AND {maximum}",
+}
+LIKE_QUERY = "SELECT * FROM {table} WHERE {column} LIKE '{query}'"
+
 
 class SQHelper():
     """Class for working with a single database
@@ -41,37 +90,116 @@ class SQHelper():
     temperature = 23.2
     df = database.get_row(table_name,column,temperature);
 
+    # Return query results as a list of dictionaries instead of a dataframe
+    rows = database.get_row_range(table_name, 'timestamp', 0, 1587222785, result='dicts')
+
+    # Store NumPy arrays as BLOBs, read back as arrays without copying
+    database.create_table('Waveform', {'timestamp': 'INTEGER', 'samples': ARRAY('float32', 1024)})
+    database.insert('Waveform', {'timestamp': 1587222785, 'samples': np.zeros(1024)})
+
+    # Convert inserted values to the declared column types, rejecting rows which can't be converted
+    database = SQHelper('database.db', coerce_types=True)
+
+    # Keep the row count and timestamp range of every table, read without scanning the tables
+    database = SQHelper('database.db', table_stats=True)
+    database.get_table_stats()
+
+    # Open an archived database read-only, without locking, for reports which shouldn't block a writer
+    archive = SQHelper('archive.db', mode='immutable')
+
+    # Log statements taking longer than 0.5 seconds with their query plan, and check a query uses an index
+    database = SQHelper('database.db', slow_query_threshold=0.5)
+    database.explain('get_row_range', table=table_name, column='timestamp', minimum=0, maximum=1587222785)
+
     Attributes:
         - con:sqlite3.Connection - Database class object
+        - instrumentation (Instrumentation) - Records timings and counters of each call, None to disable
+        - slow_query_threshold (float) - Statements taking longer than this many seconds are logged, None to disable
+        - result (str) - The format query methods return rows in when none is given, see RESULT_FORMATS
+        - coerce_types (bool) - Inserted values are converted to their column's declared type if True
+        - mode (str) - How the database is opened, see MODES
+        - table_stats (bool) - The row count and timestamp range of each table are kept in STATS_TABLE if True
     """
-    def __init__(self, db_name):
+    def __init__(self, db_name, instrumentation=None, slow_query_threshold=None, result='dataframe',
+                 coerce_types=False, mode='rw', mmap_size=None, table_stats=False):
         """Create a class instance specifying the path to the database to work with.
 
         Success can be determined by calling object.exists()
 
         Parameters:
         db_name (str): Path the the sqlite3 database file.
+        instrumentation (Instrumentation): Records the latency, rows, statements and commits of inserts
+            and reads, see dbops.instrumentation. None disables recording.
+        slow_query_threshold (float): Statements run by inserts and queries which take longer than this many
+            seconds (including fetching the rows) are logged as warnings, along with their parameters and
+            query plan. None disables the log.
+        result (str): The format table_to_df, get_row_range, get_row and get_last_rows return rows in,
+            unless the call gives its own:
+        -'dataframe': A Pandas DataFrame.
+        -'tuples': A list of tuples, one per row, in column order.
+        -'dicts': A list of dictionaries, one per row, keyed by column name.
+        -'numpy': A NumPy structured array with a field per column.
+        -'arrow': A pyarrow Table, pyarrow must be installed.
+        coerce_types (bool): Convert inserted values to the type affinity of their column's declared type,
+            e.g '23.2' becomes 23.2 in a REAL column. A row with a value which can't be converted, e.g 'abc'
+            in a REAL column or 1.5 in an INTEGER column, is rejected before anything is inserted.
+            None (NULL) is always allowed. Columns declared without a type are inserted unchanged.
+        mode (str): How the database is opened:
+        -'rw': Read and write, the database file is created if it doesn't exist.
+        -'ro': Read only, through a 'file:...?mode=ro' URI. The file must exist. create_table, remove_table,
+            insert and remove_row_range log an error and fail. Readers still take shared locks, so a
+            long read can delay a writer's commit.
+        -'immutable': Read only, and the file is assumed never to change (immutable=1), so no locks are
+            taken and no journal is checked. Only use for files no process writes to, e.g archived
+            partitions, otherwise reads can return corrupt results.
+        mmap_size (int): The number of bytes of the file to memory map (PRAGMA mmap_size), None for
+            sqlite3's default. Immutable databases default to IMMUTABLE_MMAP_SIZE.
+        table_stats (bool): Keep the row count, first and last timestamp and last insert time of each table
+            in the STATS_TABLE side table, so get_table_stats() doesn't scan the tables. Triggers keep the
+            stats current for inserts and deletes from any connection, at a small cost per inserted row.
+            Existing tables are scanned once when first tracked. Ignored by read only modes, which can
+            still read stats kept by a writer.
         """
         self.__dbName = db_name
         self.con = None
+        self.instrumentation = instrumentation
+        self.slow_query_threshold = slow_query_threshold
+        self.result = result
+        self.coerce_types = coerce_types
+        self.mode = mode
+        self.table_stats = table_stats
+        self.__mmap_size = IMMUTABLE_MMAP_SIZE if mmap_size is None and mode == 'immutable' else mmap_size
+        self.__deadbands = dict()
+        self.__adapters = dict()
         self.create_database()
 
     def create_database(self):
         """Create the sqlite3 database if it doesn't exist.
 
         The database name is that which was passed when the class object was initialised.
+        Read only modes connect to an existing database and fail if there is none.
 
         Returns:
         True if the data base was created.
         False if an error occured.
         """
 
+        if self.mode not in MODES:
+            log.error("Unknown mode {}, expected one of {}".format(self.mode, MODES))
+            return False
         try:
-            self.con = sq.connect(self.__dbName)
-            return True
+            if self.mode == 'rw':
+                self.con = sq.connect(self.__dbName)
+            else:
+                self.con = sq.connect(_connection_uri(self.__dbName, self.mode), uri=True)
+            if self.__mmap_size is not None:
+                self.con.execute("PRAGMA mmap_size={:d}".format(self.__mmap_size))
         except Exception as e:
             log.error('Cannot connect to database {}, raised exception {}.'.format(self.__dbName, e))
             return False
+        if self.table_stats and self.mode == 'rw':
+            return self.__track_tables(self.get_table_names())
+        return True
 
     def exists(self):
         """Checks if the database exists and has been connected successfuly
@@ -90,6 +218,15 @@ class SQHelper():
             return False
         return True
 
+    def __check_database_is_writable(self):
+        if self.__check_database_is_initialised() is False:
+            return False
+        if self.mode != 'rw':
+            log.error("Trying to write to database {} opened in {} mode.".format(self.__dbName, self.mode))
+            return False
+        return True
+
+    @instrumented(error_result=[], count_rows=False)
     def create_table(self, table_name, columns):
         """Add a new table to an initialised database
 
@@ -114,7 +251,7 @@ class SQHelper():
         On failure: An empty list.
         """
 
-        if self.__check_database_is_initialised() is False:
+        if self.__check_database_is_writable() is False:
             return []
 
         df = None
@@ -123,11 +260,12 @@ class SQHelper():
             for key in sorted(columns.keys()):
                 columnString = columnString + key + ' ' + str(columns[key]) + ','
             columns = columnString.strip(',')
-        elif type(columns) is pd.DataFrame:
+        elif is_dataframe(columns):
             columnString = ', '.join(sorted(columns.columns))
             df = columns
             columns = columnString.strip(',')
 
+        self.__adapters.pop(table_name, None)
         cur = self.con.cursor()
         try:
             cur.execute("CREATE TABLE IF NOT EXISTS {}({})".format(table_name, columns))
@@ -137,7 +275,10 @@ class SQHelper():
             return []
         self.con.commit()
 
-        if type(df) is pd.DataFrame:
+        if self.table_stats:
+            self.__track_tables([table_name])
+
+        if is_dataframe(df):
             self.insert(table_name, df)
 
         return self.get_column_names(table_name)
@@ -153,12 +294,15 @@ class SQHelper():
         False: An issue occured and the nothing was done.
         """
 
-        if self.__check_database_is_initialised() is False:
+        if self.__check_database_is_writable() is False:
             return False
 
+        self.__adapters.pop(table_name, None)
         cur = self.con.cursor()
         try:
             cur.execute("DROP TABLE {}".format(table_name))
+            if self.table_stats:
+                cur.execute("DELETE FROM {} WHERE name = ?".format(STATS_TABLE), (table_name, ))
         except Exception as e:
             log.error('Cannot remove table: {}. Exception: {}.'.format(table_name, e))
             return False
@@ -182,7 +326,8 @@ class SQHelper():
         finalList = []
         tupleList = cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
         for l in tupleList:
-            finalList.append(l[0])
+            if l[0] != STATS_TABLE:
+                finalList.append(l[0])
         return finalList
 
     def get_column_names(self, table):
@@ -212,6 +357,52 @@ class SQHelper():
 
         return nameList
 
+    def get_table_stats(self):
+        """Get the row count and timestamp range of every table, without scanning the tables
+
+        The stats are kept by a writer created with table_stats=True. Tables without a 'timestamp'
+        column have no range. If the first or last timestamp of a table was deleted, its range is
+        recomputed (and saved, if the database is writable) using min() and max(), which only reads
+        the ends of an index on timestamp, or the table if it has none.
+
+        Returns:
+        stats (dict): Keyed by table name, each a dictionary of:
+        -'rows': The number of rows.
+        -'min_timestamp', 'max_timestamp': The first and last timestamp, None if there are no rows.
+        -'last_insert': The unix time of the last insert, None if there was none since the table was tracked.
+        None is returned if table stats are not kept, or an error occured.
+        """
+
+        if self.__check_database_is_initialised() is False:
+            return None
+
+        try:
+            rows = self.con.execute("SELECT s.name, s.rows, s.min_timestamp, s.max_timestamp, s.last_insert, s.stale "
+                                    "FROM {} s JOIN sqlite_master m ON m.type = 'table' AND m.name = s.name".format(
+                                        STATS_TABLE)).fetchall()
+        except sq.OperationalError as e:
+            log.error("Cannot read table stats, are they kept (table_stats=True)? Exception: {}".format(e))
+            return None
+
+        stats = dict()
+        try:
+            for name, count, minimum, maximum, last_insert, stale in rows:
+                if stale:
+                    minimum, maximum = self.con.execute(
+                        "SELECT min(timestamp), max(timestamp) FROM {}".format(name)).fetchone()
+                    if self.mode == 'rw':
+                        self.con.execute("UPDATE {} SET min_timestamp = ?, max_timestamp = ?, stale = 0 "
+                                         "WHERE name = ?".format(STATS_TABLE), (minimum, maximum, name))
+                stats[name] = {'rows': count, 'min_timestamp': minimum, 'max_timestamp': maximum,
+                               'last_insert': last_insert}
+        except Exception as e:
+            log.error("Cannot update the timestamp range of table {}. Exception: {}".format(name, e))
+            return None
+        finally:
+            if self.mode == 'rw':
+                self.con.commit()
+        return stats
+
     def print_table(self, table):
         """Print the entire contents of a database table to stdout.
 
@@ -233,29 +424,41 @@ class SQHelper():
             log.error("Exception: {} when trying to print table " "{}".format(e, table))
             return None
 
-    def table_to_df(self, table):
+    @instrumented(error_result=None)
+    def table_to_df(self, table, result=None, workers=None):
         """Return the taget table as a Pandas Dataframe.
 
         Parameters:
         table (str): The name of the table to query.
+        result (str): The format to return the rows in, the object's result attribute if None (see __init__).
+        workers (int): If more than one, the table is split into this many rowid ranges which are read and
+            converted in separate processes, each with its own read-only connection, then joined in order.
+            Only rows committed to the database file are seen. In-memory databases are read in this process.
 
         Returns:
-        A dataframe object containing the complete table.
+        A dataframe object containing the complete table (or the rows in the requested format).
         None is returned if the table doesn't exist or an error occured.
         """
 
-        if self.__check_database_is_initialised() is False:
+        if self.__check_database_is_initialised() is False or self.__check_result_format(result) is False:
             return None
+        result = self.result if result is None else result
 
-        cur = self.con.cursor()
+        call = current_call(self.instrumentation)
         try:
-            cur.execute("SELECT * FROM {}".format(table))
+            if workers is not None and workers > 1 and os.path.exists(self.__dbName):
+                with call.phase('execute'):
+                    return self.__read_partitions(table, result, workers)
+            with call.phase('execute'):
+                rows, columns = self.__execute(_build_query('table_to_df', table=table), fetch=True)
         except Exception as e:
             log.error("Exception: {} when trying to return table " "{} as a Dataframe".format(e, table))
             return None
-        df = pd.DataFrame(cur.fetchall(), columns=self.get_column_names(table))
-        return df
+        call.add(statements=1)
+        with call.phase('convert'):
+            return _format_rows(rows, columns, result, self.__array_columns(table))
 
+    @instrumented(error_result=None)
     def get_last_time_entry(self, table):
         """Get the last timestamp entry from the databaase.
 
@@ -275,26 +478,27 @@ class SQHelper():
         if self.__check_database_is_initialised() is False:
             return None
 
-        cur = self.con.cursor()
         try:
-            entry = cur.execute("SELECT * FROM {} ORDER BY timestamp DESC LIMIT 1".format(table))
+            lastEntry, columns = self.__execute(_build_query('get_last_time_entry', table=table), fetch=True)
         except Exception as e:
             log.error("Cannot get last time entry from {}. "
                       "Does the table have a timestamp column? "
                       "Exception: {}".format(table, e))
             return None
 
-        lastEntry = entry.fetchall()
+        current_call(self.instrumentation).add(statements=1, rows_out=len(lastEntry))
         if len(lastEntry) > 0:
-            columns = self.get_column_names(table)
             lastEntryDict = dict()
             for i, col in enumerate(columns):
                 lastEntryDict[col] = lastEntry[0][i]
+            for col, array in self.__array_columns(table).items():
+                lastEntryDict[col] = array.from_blob(lastEntryDict[col])
             return lastEntryDict
         else:
             return dict()
 
-    def get_row_range(self, table, column, minimum, maximum):
+    @instrumented(error_result=None)
+    def get_row_range(self, table, column, minimum, maximum, result=None):
         """Get a dataframe containing values of a table columns between two values (inclusive).
 
         Parameters:
@@ -302,87 +506,88 @@ class SQHelper():
         column (str): The name of the table's column to query.
         minimum (int,float): The minimum value (inclusive).
         maximum (int,float): The maximum value (inclusive).
+        result (str): The format to return the rows in, the object's result attribute if None (see __init__).
 
         Returns:
-        - A Pandas DataFrame containing the quried value on sucess.
+        - A Pandas DataFrame (or the requested format) containing the quried value on sucess.
         - An empty DataFrame if the table is empty.
         - None if an error occured (No table name, no column, invalid datatype).
         """
 
-        if self.__check_database_is_initialised() is False:
+        if self.__check_database_is_initialised() is False or self.__check_result_format(result) is False:
             return None
 
-        cur = self.con.cursor()
+        current_call(self.instrumentation).add(statements=1)
         try:
-            return pd.DataFrame(cur.execute("SELECT * FROM {} WHERE {} BETWEEN {} AND {}".format(
-                table, column, minimum, maximum)).fetchall(),
-                                columns=self.get_column_names(table))
+            return _format_rows(*self.__execute(_build_query('get_row_range', table=table, column=column,
+                                                             minimum=minimum, maximum=maximum), fetch=True),
+                                self.result if result is None else result, self.__array_columns(table))
         except Exception as e:
             log.error("Cannot query rows from {}. "
                       "Requested column: {}. "
                       "Availabe: {}. Excpetion {}".format(table, column, self.get_column_names(table), e))
             return None
 
-    def get_row(self, table, column, query):
+    @instrumented(error_result=None)
+    def get_row(self, table, column, query, result=None):
         """ Get a dataframe containing entries which match a queried value
 
         Parameters:
         table (str): The name of the table to query.
         column (str): The name of the table's column to query.
         query (int, float, str): The value of the column to query.
+        result (str): The format to return the rows in, the object's result attribute if None (see __init__).
 
         Returns:
-        - A Pandas DataFrame containing all matching values on success:
+        - A Pandas DataFrame (or the requested format) containing all matching values on success:
         - An empty dataframe if the value wasn't found in the database.
         - None if an error occured.
         """
 
-        if self.__check_database_is_initialised() is False:
+        if self.__check_database_is_initialised() is False or self.__check_result_format(result) is False:
             return None
 
-        cur = self.con.cursor()
+        current_call(self.instrumentation).add(statements=1)
         try:
-            if type(query) is str:
-                return pd.DataFrame(cur.execute("SELECT * FROM {} WHERE {} LIKE '{}'".format(table, column,
-                                                                                             query)).fetchall(),
-                                    columns=self.get_column_names(table))
-            else:
-                return pd.DataFrame(cur.execute("SELECT * FROM {} WHERE {} = {}".format(table, column,
-                                                                                        query)).fetchall(),
-                                    columns=self.get_column_names(table))
+            return _format_rows(*self.__execute(_build_query('get_row', table=table, column=column, query=query),
+                                                fetch=True), self.result if result is None else result,
+                                self.__array_columns(table))
         except Exception as e:
             log.error("Cannot query rows from {}. "
                       "Requested column: {}. Availabe: {}. "
                       "Exception: {}".format(table, column, self.get_column_names(table), e))
         return None
 
-    def get_last_rows(self, table, maximum):
+    @instrumented(error_result=None)
+    def get_last_rows(self, table, maximum, result=None):
         """Get the last n number of entries in the database as a Pandas Dataframe.
 
         Parameters:
         table (str): The name of the table to query.
         maximum (int): The maximum number of entries to return. -1 can be passed
             to return all enties.
+        result (str): The format to return the rows in, the object's result attribute if None (see __init__).
 
         Returns:
-        - A Pandas DataFrame containing the up to the number of entries requested.
+        - A Pandas DataFrame (or the requested format) containing the up to the number of entries requested.
         - None if an error occured (no table, database not initialised, bad type for maximum.
         """
 
-        if self.__check_database_is_initialised() is False:
+        if self.__check_database_is_initialised() is False or self.__check_result_format(result) is False:
             return None
 
-        cur = self.con.cursor()
+        current_call(self.instrumentation).add(statements=1)
         try:
-            return pd.DataFrame(cur.execute("SELECT * FROM {} ORDER BY timestamp DESC LIMIT {}".format(
-                table, maximum)).fetchall(),
-                                columns=self.get_column_names(table))
+            return _format_rows(*self.__execute(_build_query('get_last_rows', table=table, maximum=maximum),
+                                                fetch=True), self.result if result is None else result,
+                                self.__array_columns(table))
         except Exception as e:
             log.error("Could not get last rows from {}. "
                       "Does the table have a timestamp column? "
                       "Exception: {}".format(table, e))
         return None
 
+    @instrumented
     def remove_row_range(self, table, column, minimum, maximum):
         """Remove a number of rows from a database table.
 
@@ -397,15 +602,15 @@ class SQHelper():
         False: An error occured (bad table, column name. Bad type for minimum or maximum)
         """
 
-        if self.__check_database_is_initialised() is False:
+        if self.__check_database_is_writable() is False:
             return False
 
         if type(minimum) is str or type(maximum) is str:
             return False
 
-        cur = self.con.cursor()
         try:
-            cur.execute("DELETE FROM {} WHERE {} BETWEEN {} AND {}".format(table, column, minimum, maximum))
+            self.__execute(_build_query('remove_row_range', table=table, column=column, minimum=minimum,
+                                        maximum=maximum))
         except Exception as e:
             log.error("Cannot remove rows from {}. "
                       "Requested column: {}. "
@@ -414,16 +619,32 @@ class SQHelper():
         self.con.commit()
         return True
 
-    # For list the order must match the order when the table was created, dictionary creation is automatically sorted
-    # For dictionary, the order doesn't matter, but keys must be same as columns
-    # For datafram, the order doesn't matter, but column names must match database's
+    def set_deadband(self, table, deadbands, heartbeat=None, series_keys=None):
+        """Only insert rows into a table which differ from the last inserted row of their series
+
+        Rows passed to insert() are dropped if every column with a deadband has changed by no more than
+        its deadband since the last inserted row with the same series_keys values. A row is always
+        inserted if the table's other columns (except 'timestamp') hold values. See DeadbandFilter.
+
+        Parameters:
+        table (str): The name of the table to filter inserts for.
+        deadbands (dict): The deadband of each column, e.g {'value': 0.5, 'humidity': {'relative': 0.01}}.
+            None removes the table's filter.
+        heartbeat (float): A row is inserted if the series' last was inserted this many seconds before,
+            according to the 'timestamp' column (or the current time if the table has none).
+        series_keys (list): The columns identifying each series, e.g ['sensor_id'].
+        """
+        if deadbands is None:
+            self.__deadbands.pop(table, None)
+        else:
+            self.__deadbands[table] = (DeadbandFilter(deadbands, heartbeat), list(series_keys or []))
+
+    @instrumented
     def insert(self, table, values):
         """Insert values into a given table.
 
-        IMPORTANT: If values is of type dict or dataframe, then the keys are sorted alphabetically
-        before they are entered into the database. Therefore when working with these types, it
-        is recommened that the table be created with the columns specified as a dictionary, as
-        these are also sorted.
+        The keys of a dict or the columns of a dataframe are matched to the table's columns by name,
+        so their order doesn't matter.
 
         Parameters:
         table (str): The name of the table to insert the values into.
@@ -435,50 +656,470 @@ class SQHelper():
         values (list): A list of columns values to enter. The order of the list should be the same
         order used when the table was created.
             values = [43.3, 53.3]]
+        A list of tuples inserts a row per tuple.
+
+        The table's columns, INSERT statement and type conversions (see coerce_types) are looked up
+        on the first insert into a table and reused, until the table is created or removed through
+        this object. They are looked up again if an insert doesn't match them or fails, e.g after
+        another connection adds a column.
+
+        If a deadband is set for the table, unchanged rows are dropped first (see set_deadband).
 
         Returns:
-        True: The items were sucessfully entered into the database table.
+        True: The items were sucessfully entered into the database table, or all were dropped by the deadband.
         False: An error occured
             - The keys or columns of the dataframe don't match the database table's columns.
+            - The number of list values doesn't match the number of columns.
+            - A value can't be converted to its column's type (coerce_types only).
             - The datatype of value is not a list, dict or dataframe.
             - The table doesn't exist.
             - The database is not initialised.
             - Some other error (if caught).
         """
 
-        if self.__check_database_is_initialised() is False:
+        if self.__check_database_is_writable() is False:
             return False
 
-        if type(values) is list:
-            insertedValues = tuple(values)
-            placeHolder = ",".join(["(?)" for i in range(len(values))])
-        elif type(values) is dict:
-            if list(sorted(values.keys())) != self.get_column_names(table):
+        deadband = self.__deadbands.get(table)
+        if deadband is not None:
+            # Rows kept by the deadband are only remembered if they are written.
+            deadband[0].begin()
+        inserted = False
+        try:
+            inserted = self.__insert(table, values)
+        finally:
+            if deadband is not None and inserted:
+                deadband[0].commit()
+            elif deadband is not None:
+                deadband[0].rollback()
+        return inserted
+
+    def __insert(self, table, values):
+        call = current_call(self.instrumentation)
+        with call.phase('convert'):
+            cached = table in self.__adapters
+            adapter = self.__row_adapter(table)
+            if adapter is None:
+                log.error("Trying to insert data into table {} which doesn't exist".format(table))
                 return False
-            insertedValues = tuple(values[x] for x in sorted(values.keys()))
-            placeHolder = ",".join(["(?)" for i in range(len(values))])
-        elif type(values) is pd.DataFrame:
-            if sorted(values.columns) != self.get_column_names(table):
+
+            if table in self.__deadbands:
+                try:
+                    values = self.__apply_deadband(table, adapter, values)
+                except (KeyError, TypeError, ValueError) as e:
+                    log.error("Cannot apply the deadband of table {}. Exception: {}".format(table, e))
+                    return False
+                if values is None or len(values) == 0:
+                    return True
+
+            if type(values) is not list and type(values) is not dict and not is_dataframe(values):
+                log.error("Trying to insert data into table {} "
+                          "which is not of type list. Passed type {}".format(table, type(values)))
                 return False
-            dfDict = values.to_dict(orient='records')
-            insertedValues = []
-            for row in dfDict:
-                insertedValues.append(tuple(row[x] for x in sorted(row.keys())))
-            placeHolder = ",".join(["(?)" for i in range(len(values.columns))])
-        else:
-            log.error("Trying to insert data into table {} "
-                      "which is not of type list. Passed type {}".format(table, type(values)))
-            return False
+            try:
+                many, insertedValues = _adapt_values(adapter, values)
+            except (KeyError, TypeError, ValueError) as e:
+                if not cached:
+                    log.error("Cannot insert data into table {}. {}".format(table, e))
+                    return False
+                # The table may have been changed by another connection, look it up again and retry.
+                self.__adapters.pop(table, None)
+                adapter = self.__row_adapter(table)
+                try:
+                    many, insertedValues = _adapt_values(adapter, values)
+                except (AttributeError, KeyError, TypeError, ValueError) as e:
+                    log.error("Cannot insert data into table {}. {}".format(table, e))
+                    return False
 
-        cur = self.con.cursor()
         try:
-            if any(isinstance(i, tuple) for i in insertedValues):
-                cur.executemany("INSERT INTO {} values({})".format(table, placeHolder), insertedValues)
-            else:
-                cur.execute("INSERT INTO {} values({})".format(table, placeHolder), insertedValues)
+            with call.phase('execute'):
+                self.__execute(adapter.statement, insertedValues, many=many)
         except sq.OperationalError as e:
+            # The table may have been changed by another connection, look it up again next time.
+            self.__adapters.pop(table, None)
             log.error("Exception: {} when inserting data into table {}. "
                       "Possible data length mismatch, invalid table".format(e, table))
             return False
+        with call.phase('commit'):
+            self.con.commit()
+        call.add(rows_in=len(insertedValues) if many else 1, statements=1, commits=1)
+        return True
+
+    def explain(self, method, **args):
+        """Get the query plan of the statement a query method runs, e.g to check if an index is used
+
+        Parameters:
+        method (str): The query method, one of 'table_to_df', 'get_last_time_entry', 'get_row_range',
+            'get_row', 'get_last_rows' or 'remove_row_range'.
+        **args: The arguments the method would be called with, e.g
+            database.explain('get_row_range', table='Temperature', column='timestamp', minimum=0, maximum=10)
+
+        Returns:
+        - A list of strings describing each step of the plan, e.g
+            ['SEARCH Temperature USING INDEX Temperature_timestamp (timestamp>? AND timestamp<?)']
+            A step starting with 'SCAN' reads the whole table.
+        - None if an error occured (unknown method, missing arguments, no table or column).
+        """
+
+        if self.__check_database_is_initialised() is False:
+            return None
+
+        if method not in QUERIES:
+            log.error("Cannot explain {}, expected one of {}".format(method, sorted(QUERIES)))
+            return None
+        try:
+            return self.__query_plan(_build_query(method, **args))
+        except Exception as e:
+            log.error("Cannot explain {} with arguments {}. Exception: {}".format(method, args, e))
+            return None
+
+    def __execute(self, statement, parameters=(), many=False, fetch=False):
+        cur = self.con.cursor()
+        start = time.perf_counter()
+        if many:
+            cur.executemany(statement, parameters)
+        else:
+            cur.execute(statement, parameters)
+        result = (cur.fetchall(), [d[0] for d in cur.description]) if fetch else cur
+        if self.slow_query_threshold is not None:
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.slow_query_threshold:
+                self.__log_slow_query(statement, parameters, many, elapsed)
+        return result
+
+    def __check_result_format(self, result):
+        result = self.result if result is None else result
+        if result not in RESULT_FORMATS:
+            log.error("Unknown result format {}, expected one of {}".format(result, RESULT_FORMATS))
+            return False
+        return True
+
+    def __read_partitions(self, table, result, workers):
+        first, last = self.con.execute("SELECT min(rowid), max(rowid) FROM {}".format(table)).fetchone()
+        arrays = self.__array_columns(table)
+        if first is None:
+            rows, columns = self.__execute(_build_query('table_to_df', table=table), fetch=True)
+            return _format_rows(rows, columns, result, arrays)
+        step = (last - first) // workers + 1
+        ranges = [(start, min(start + step - 1, last)) for start in range(first, last + 1, step)]
+        statement = "SELECT * FROM {} WHERE rowid BETWEEN ? AND ? ORDER BY rowid".format(table)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            partitions = list(pool.map(_read_partition, itertools.repeat(self.__dbName),
+                                       itertools.repeat('immutable' if self.mode == 'immutable' else 'ro'),
+                                       itertools.repeat(statement),
+                                       ranges, itertools.repeat(result), itertools.repeat(arrays)))
+        current_call(self.instrumentation).add(statements=len(ranges))
+
+        columns = partitions[0][0]
+        # Gaps in the rowids left by deletes give empty partitions, their columns have no type.
+        parts = [part for _, part, count in partitions if count > 0] or [partitions[0][1]]
+        if result == 'dataframe':
+            return pd.concat(parts, ignore_index=True)
+        if result in ('tuples', 'dicts'):
+            return list(itertools.chain.from_iterable(parts))
+        if result == 'numpy':
+            return _structured_array(columns, [np.concatenate(arrays) for arrays in zip(*parts)])
+        if any(part is None for part in parts):
+            return None
+        return pa.concat_tables(parts)
+
+    def __log_slow_query(self, statement, parameters, many, elapsed):
+        if many:
+            rows = list(parameters)
+            parameters = rows[0] if len(rows) > 0 else ()
+            description = "{} rows, first {}".format(len(rows), parameters)
+        else:
+            description = str(tuple(parameters))
+        try:
+            plan = '; '.join(self.__query_plan(statement, parameters))
+        except Exception as e:
+            plan = "unavailable ({})".format(e)
+        log.warning("Slow query took {:.3f}s: {} Parameters: {} Plan: {}".format(elapsed, statement, description, plan))
+
+    def __query_plan(self, statement, parameters=()):
+        return [row[3] for row in self.con.execute("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()]
+
+    def __track_tables(self, tables):
+        cur = self.con.cursor()
+        try:
+            cur.execute("CREATE TABLE IF NOT EXISTS {}(name TEXT PRIMARY KEY, rows INTEGER, min_timestamp, "
+                        "max_timestamp, last_insert REAL, stale INTEGER)".format(STATS_TABLE))
+            # Triggers are dropped with their table, a table without one is new or was never tracked.
+            tracked = set(row[0] for row in cur.execute(
+                "SELECT tbl_name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'dbops_stats_insert_%'"))
+            for table in tables:
+                if table in tracked or table == STATS_TABLE:
+                    continue
+                has_timestamp = 'timestamp' in self.get_column_names(table)
+                timestamp_range = "min(timestamp), max(timestamp)" if has_timestamp else "NULL, NULL"
+                cur.execute("INSERT OR REPLACE INTO {} SELECT ?, count(*), {}, NULL, 0 FROM {}".format(
+                    STATS_TABLE, timestamp_range, table), (table, ))
+                cur.execute(STATS_TRIGGERS['insert'].format(table=table,
+                                                            timestamp=STATS_INSERT_RANGE if has_timestamp else ''))
+                cur.execute(STATS_TRIGGERS['delete'].format(table=table,
+                                                            stale=STATS_DELETE_RANGE if has_timestamp else ''))
+                if has_timestamp:
+                    cur.execute(STATS_TRIGGERS['update'].format(table=table))
+        except Exception as e:
+            self.con.rollback()
+            log.error("Cannot keep table stats for tables {}. Exception: {}".format(tables, e))
+            return False
         self.con.commit()
         return True
+
+    def __row_adapter(self, table):
+        adapter = self.__adapters.get(table)
+        if adapter is None:
+            try:
+                columns = self.con.execute("PRAGMA table_info({})".format(table)).fetchall()
+            except Exception as e:
+                log.error("Exception: {} when trying to get the columns of table {}".format(e, table))
+                return None
+            if len(columns) == 0:
+                return None
+            adapter = self.__adapters[table] = _RowAdapter(table, [(c[1], c[2]) for c in columns], self.coerce_types)
+        return adapter
+
+    def __array_columns(self, table):
+        adapter = self.__row_adapter(table)
+        return adapter.arrays if adapter is not None else dict()
+
+    def __apply_deadband(self, table, adapter, values):
+        deadband, series_keys = self.__deadbands[table]
+        if type(values) is list and any(isinstance(row, tuple) for row in values):
+            return [row for row in values if deadband.filter(dict(zip(adapter.columns, row)), series_keys) is not None]
+        if type(values) is list:
+            row = dict(zip(adapter.columns, values))
+            return values if deadband.filter(row, series_keys) is not None else None
+        if type(values) is dict or is_dataframe(values):
+            return deadband.filter(values, series_keys)
+        return values
+
+
+class _RowAdapter():
+    """ The column order, INSERT statement and type conversions used to insert rows into a table """
+    def __init__(self, table, columns, coerce_types):
+        """ Compile the adapter of a table
+
+        Parameters:
+        table (str): The name of the table.
+        columns (list): The name and declared type of each column, in table order.
+        coerce_types (bool): Convert values to the type affinity of their column.
+        """
+        self.arrays = {name: ArrayColumn.parse(declared) for name, declared in columns}
+        self.arrays = {name: array for name, array in self.arrays.items() if array is not None}
+        self.columns = [name for name, _ in columns]
+        self.keys = frozenset(self.columns)
+        self.statement = "INSERT INTO {} VALUES({})".format(table, ",".join("?" * len(columns)))
+        self.__getter = operator.itemgetter(*self.columns)
+        self.__single = len(columns) == 1
+        self.__converters = None
+        # Arrays are always converted to BLOBs, other values only if coerce_types.
+        converters = [(name, declared, self.arrays[name].to_blob if name in self.arrays else
+                       (_CONVERTERS[_affinity(declared)] if coerce_types else None)) for name, declared in columns]
+        if any(converter is not None for _, _, converter in converters):
+            self.__converters = converters
+
+    def from_list(self, values):
+        if len(values) != len(self.columns):
+            raise ValueError("Got {} values for {} columns {}".format(len(values), len(self.columns), self.columns))
+        return self.__convert(tuple(values))
+
+    def from_dict(self, values):
+        if values.keys() != self.keys:
+            raise KeyError("Keys {} don't match columns {}".format(sorted(values), self.columns))
+        row = self.__getter(values)
+        return self.__convert((row, ) if self.__single else row)
+
+    def from_dataframe(self, values):
+        if len(values.columns) != len(self.columns) or set(values.columns) != self.keys:
+            raise KeyError("Columns {} don't match columns {}".format(list(values.columns), self.columns))
+        rows = values[self.columns].itertuples(index=False, name=None)
+        if self.__converters is None:
+            return list(rows)
+        return [self.__convert(row) for row in rows]
+
+    def __convert(self, row):
+        if self.__converters is None:
+            return row
+        converted = []
+        for value, (name, declared, converter) in zip(row, self.__converters):
+            # None and NaN are inserted as NULL.
+            if converter is not None and value is not None and not _is_nan(value):
+                try:
+                    value = converter(value)
+                except (TypeError, ValueError) as e:
+                    raise ValueError("Value {!r} of column {} is not {}. {}".format(value, name, declared, e)) from None
+            converted.append(value)
+        return tuple(converted)
+
+
+def _adapt_values(adapter, values):
+    """ Convert a list, list of tuples, dict or dataframe to the rows inserted by an adapter
+
+    Returns:
+    (many, rows): Whether several rows are inserted, and the row or rows.
+    """
+    if type(values) is list and any(isinstance(row, tuple) for row in values):
+        return True, [adapter.from_list(row) for row in values]
+    if type(values) is list:
+        return False, adapter.from_list(values)
+    if type(values) is dict:
+        return False, adapter.from_dict(values)
+    return True, adapter.from_dataframe(values)
+
+
+def _is_nan(value):
+    return isinstance(value, numbers.Real) and value != value
+
+
+def _affinity(declared):
+    """ Get the sqlite3 type affinity of a declared column type """
+    declared = declared.upper()
+    if 'INT' in declared:
+        return 'INTEGER'
+    if any(name in declared for name in ('CHAR', 'CLOB', 'TEXT')):
+        return 'TEXT'
+    if 'BLOB' in declared or declared == '':
+        return 'BLOB'
+    if any(name in declared for name in ('REAL', 'FLOA', 'DOUB')):
+        return 'REAL'
+    return 'NUMERIC'
+
+
+def _to_integer(value):
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, numbers.Real) and float(value).is_integer():
+        return int(value)
+    if isinstance(value, str):
+        return int(value)
+    raise TypeError()
+
+
+def _to_real(value):
+    if isinstance(value, (numbers.Real, str)):
+        return float(value)
+    raise TypeError()
+
+
+def _to_text(value):
+    if isinstance(value, (bytes, bytearray)):
+        raise TypeError()
+    return str(value)
+
+
+def _to_numeric(value):
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, numbers.Real):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+    raise TypeError()
+
+
+# The conversion of each type affinity, BLOB columns store values unchanged.
+_CONVERTERS = {'INTEGER': _to_integer, 'REAL': _to_real, 'TEXT': _to_text, 'NUMERIC': _to_numeric, 'BLOB': None}
+
+
+def _build_query(method, **args):
+    """ Build the statement run by a query method, see QUERIES """
+    if method == 'get_row' and type(args.get('query')) is str:
+        return LIKE_QUERY.format(**args)
+    return QUERIES[method].format(**args)
+
+
+def _format_rows(rows, columns, result, arrays=None):
+    """ Convert fetched rows to a result format, see RESULT_FORMATS
+
+    BLOBs of array columns (see ArrayColumn) become NumPy arrays, stacked into a single
+    (rows, *shape) field by the 'numpy' format.
+    """
+    if result == 'numpy':
+        return _structured_array(columns, _column_arrays(rows, columns, arrays))
+    rows = _convert_arrays(rows, columns, arrays)
+    if result == 'dataframe':
+        return pd.DataFrame(rows, columns=columns)
+    if result == 'tuples':
+        return rows
+    if result == 'dicts':
+        return [dict(zip(columns, row)) for row in rows]
+    # Arrow tables are built a column at a time.
+    values = list(zip(*rows)) if len(rows) > 0 else [()] * len(columns)
+    try:
+        return pa.Table.from_arrays([pa.array(list(v)) for v in values], names=columns)
+    except ImportError as e:
+        log.error("Cannot return rows as an arrow table, is pyarrow installed? Exception: {}".format(e))
+        return None
+
+
+def _convert_arrays(rows, columns, arrays):
+    """ Replace the BLOBs of array columns in fetched rows with array views """
+    converters = [(i, arrays[column].from_blob) for i, column in enumerate(columns) if column in (arrays or ())]
+    if len(converters) == 0:
+        return rows
+    converted = []
+    for row in rows:
+        row = list(row)
+        for i, from_blob in converters:
+            row[i] = from_blob(row[i])
+        converted.append(tuple(row))
+    return converted
+
+
+def _column_arrays(rows, columns, arrays=None):
+    """ Convert fetched rows to a NumPy array per column, array columns are stacked if they can be """
+    if len(rows) == 0:
+        return [np.empty((0, ) + arrays[column].shape, dtype=arrays[column].dtype)
+                if column in (arrays or ()) and arrays[column].shape is not None else np.array([], dtype=object)
+                for column in columns]
+    values = []
+    for column, column_values in zip(columns, zip(*rows)):
+        if column in (arrays or ()):
+            stacked = arrays[column].stack(column_values)
+            if stacked is None:
+                stacked = np.empty(len(column_values), dtype=object)
+                stacked[:] = [arrays[column].from_blob(blob) for blob in column_values]
+            values.append(stacked)
+        else:
+            values.append(np.array(column_values))
+    return values
+
+
+def _structured_array(columns, arrays):
+    """ Join an array per column into a NumPy structured array """
+    array = np.empty(len(arrays[0]) if len(arrays) > 0 else 0,
+                     dtype=[(c, a.dtype, a.shape[1:]) for c, a in zip(columns, arrays)])
+    for column, values in zip(columns, arrays):
+        array[column] = values
+    return array
+
+
+def _connection_uri(path, mode):
+    """ Build the URI opening a database file in a read only mode, see MODES """
+    uri = 'file:{}?mode=ro'.format(quote(os.path.abspath(path)))
+    return uri + '&immutable=1' if mode == 'immutable' else uri
+
+
+def _read_partition(path, mode, statement, parameters, result, arrays):
+    """ Read a range of rows in a worker process, using its own read-only connection
+
+    Rows are converted in the worker, so only dataframes or column arrays are sent back.
+
+    Returns:
+    (columns, rows, count): The column names, the converted rows and the number of rows.
+    """
+    con = sq.connect(_connection_uri(path, mode), uri=True)
+    try:
+        cur = con.execute(statement, parameters)
+        rows = cur.fetchall()
+        columns = [d[0] for d in cur.description]
+    finally:
+        con.close()
+    if result == 'numpy':
+        return columns, _column_arrays(rows, columns, arrays), len(rows)
+    return columns, _format_rows(rows, columns, result, arrays), len(rows)
@@ -1,13 +1,15 @@
-from dateutil import tz
-from pyrfc3339 import generate, parse
+from dbops._lazy import LazyModule
 from datetime import datetime
 
+tz = LazyModule('dateutil.tz')
+pyrfc3339 = LazyModule('pyrfc3339')
+
 
 def rfc3339_to_unix(rfc3339):
     """ Convert a RFC3339 format timestamp to a unix timestamp """
-    return int(parse(rfc3339).astimezone(tz.tzlocal()).strftime('%s'))
+    return int(pyrfc3339.parse(rfc3339).astimezone(tz.tzlocal()).strftime('%s'))
 
 
 def unix_to_rfc3339(unix):
     """ Convert a Unix timestamp to a RFC3339 timesatmp"""
-    return generate(datetime.fromtimestamp(unix).replace(tzinfo=tz.tzlocal()))
+    return pyrfc3339.generate(datetime.fromtimestamp(unix).replace(tzinfo=tz.tzlocal()))
@@ -0,0 +1,62 @@
+import unittest
+import logging
+import numpy as np
+from dbops.arraycolumn import ArrayColumn, ARRAY
+
+logging.disable(logging.CRITICAL)
+
+
+class ArrayColumnTesting(unittest.TestCase):
+    def test_declared_type_round_trip(self):
+        self.assertEqual(ARRAY('float32', 1024), '"ARRAY(float32, 1024)"')
+        self.assertEqual(ARRAY('int16', (2, 512), 'zlib'), '"ARRAY(int16, (2, 512), zlib)"')
+        for declared in ['ARRAY(float32, 1024)', 'ARRAY(int16, (2, 512), zlib)', 'ARRAY(float64, None)']:
+            self.assertEqual(str(ArrayColumn.parse(declared)), declared)
+        self.assertEqual(ArrayColumn.parse('array(float64)'), ArrayColumn('float64'))
+
+    def test_parse_other_types(self):
+        for declared in ['', 'REAL', 'INTEGER', 'ARRAY', 'ARRAY(float32, 4, lz4)', 'ARRAY(notatype, 4)',
+                         'ARRAY(object, 4)']:
+            self.assertIs(ArrayColumn.parse(declared), None)
+
+    def test_blobs_are_little_endian_and_read_without_copying(self):
+        column = ArrayColumn('int32', 3)
+        blob = column.to_blob(np.array([1, 2, 256], dtype='>i8'))
+        self.assertEqual(blob, b'\x01\x00\x00\x00\x02\x00\x00\x00\x00\x01\x00\x00')
+        array = column.from_blob(blob)
+        np.testing.assert_array_equal(array, [1, 2, 256])
+        self.assertIs(array.flags.owndata, False)
+        self.assertIs(array.flags.writeable, False)
+        self.assertIs(column.from_blob(None), None)
+
+    def test_shape_is_checked(self):
+        column = ArrayColumn('float32', (2, 2))
+        np.testing.assert_array_equal(column.from_blob(column.to_blob([[1, 2], [3, 4]])), [[1, 2], [3, 4]])
+        with self.assertRaises(ValueError):
+            column.to_blob([1, 2, 3, 4])
+        with self.assertRaises(ValueError):
+            ArrayColumn('float32').to_blob([[1.0]])
+        self.assertEqual(ArrayColumn('float32').from_blob(ArrayColumn('float32').to_blob([1, 2, 3])).shape, (3, ))
+
+    def test_compression(self):
+        column = ArrayColumn('float64', 1000, 'zlib')
+        blob = column.to_blob(np.zeros(1000))
+        self.assertLess(len(blob), 8000)
+        np.testing.assert_array_equal(column.from_blob(blob), np.zeros(1000))
+        with self.assertRaises(ValueError):
+            ArrayColumn('float64', 1000, 'lz4')
+
+    def test_stack(self):
+        for compression in (None, 'zlib'):
+            column = ArrayColumn('int16', (2, 3), compression)
+            blobs = [column.to_blob(np.full((2, 3), i)) for i in range(4)]
+            stacked = column.stack(blobs)
+            self.assertEqual(stacked.shape, (4, 2, 3))
+            np.testing.assert_array_equal(stacked[:, 0, 0], [0, 1, 2, 3])
+            self.assertEqual(column.stack([]).shape, (0, 2, 3))
+            self.assertIs(column.stack(blobs + [None]), None)
+        self.assertIs(ArrayColumn('int16').stack(blobs), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
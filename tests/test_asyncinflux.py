@@ -0,0 +1,106 @@
+import unittest
+import logging
+import asyncio
+import time
+import pandas as pd
+from dbops.asyncinflux import AsyncInfluxHelper, _read_response
+from dbops.fakeinflux import FakeInfluxServer
+
+logging.disable(logging.CRITICAL)
+test_db_name = 'test_db'
+
+
+class AsyncInfluxHelperTesting(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeInfluxServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def run_with_db(self, coroutine, **kwargs):
+        async def run():
+            async with AsyncInfluxHelper(test_db_name, port=self.server.port, **kwargs) as db:
+                return await coroutine(db)
+        return asyncio.run(asyncio.wait_for(run(), 10))
+
+    def test_connect_creates_database(self):
+        self.assertEqual(self.run_with_db(lambda db: asyncio.sleep(0, db.exists())), True)
+        self.assertEqual(self.server.get_points('Environment', test_db_name), [])
+
+    def test_connect_to_missing_server(self):
+        port = self.server.port
+        self.server.stop()
+        db = AsyncInfluxHelper(test_db_name, port=port)
+        self.assertEqual(asyncio.run(db.connect()), False)
+        self.assertEqual(asyncio.run(db.insert('Environment', {'value': 1.0}, ['value'], [])), False)
+        self.assertEqual(asyncio.run(db.query_range('Environment', ['value'], 0, 1)), None)
+
+    def test_insert_dict_and_get_last_time_entry(self):
+        async def run(db):
+            entry = {'timestamp': 1585848415, 'temperature': 23.3, 'room': 'kitchen'}
+            self.assertEqual(await db.insert('Environment', entry, ['temperature'], ['room'], use_timestamp=True), True)
+            return await db.get_last_time_entry('Environment', 'temperature', 'room', 'kitchen', as_unix=True)
+        self.assertEqual(self.run_with_db(run), {'time': 1585848415, 'last': 23.3})
+
+    def test_insert_dataframe_and_query_range(self):
+        async def run(db):
+            df = pd.DataFrame({'timestamp': [10, 20, 30], 'temperature': [1.0, 2.0, 3.0], 'room': ['a', 'b', 'a']})
+            await db.insert('Environment', df, ['temperature'], ['room'], use_timestamp=True)
+            return await db.query_range('Environment', ['temperature', 'room'], 10, 25)
+        df = self.run_with_db(run)
+        self.assertEqual(list(df['timestamp']), [10, 20])
+        self.assertEqual(list(df['room']), ['a', 'b'])
+
+    def test_query_range_empty_and_invalid(self):
+        async def run(db):
+            return (await db.query_range('Environment', ['temperature'], 0, 10),
+                    await db.query_range('Environment', 'temperature', 0, 10),
+                    await db.get_last_time_entry('Environment', 'temperature'))
+        empty, invalid, last = self.run_with_db(run)
+        self.assertEqual(list(empty.columns), ['timestamp', 'temperature'])
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(invalid, None)
+        self.assertEqual(last, None)
+
+    def test_concurrent_requests_are_limited(self):
+        self.server.latency = 0.1
+
+        async def run(db):
+            start = time.monotonic()
+            results = await asyncio.gather(*(db.insert('Environment', {'timestamp': i, 'value': float(i)}, ['value'],
+                                                       [], use_timestamp=True) for i in range(8)))
+            return results, time.monotonic() - start
+        results, elapsed = self.run_with_db(run, max_requests=4)
+        self.assertEqual(results, [True] * 8)
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual(len(self.server.get_points('Environment', test_db_name)), 8)
+
+    def test_failed_write_returns_false(self):
+        async def run(db):
+            self.server.fail_next(1)
+            failed = await db.insert('Environment', {'value': 1.0}, ['value'], [])
+            return failed, await db.insert('Environment', {'value': 1.0}, ['value'], [])
+        self.assertEqual(self.run_with_db(run), (False, True))
+
+    def test_timeout(self):
+        async def run(db):
+            self.server.latency = 0.5
+            return await db.insert('Environment', {'value': 1.0}, ['value'], [])
+        self.assertEqual(self.run_with_db(run, timeout=0.1), False)
+
+    def test_responses_without_body_do_not_wait_for_close(self):
+        async def read(response, method='POST'):
+            reader = asyncio.StreamReader()
+            reader.feed_data(response)
+            return await asyncio.wait_for(_read_response(reader, method), 1)
+        self.assertEqual(asyncio.run(read(b'HTTP/1.1 204 No Content\r\nX-Influxdb-Version: 1.8.10\r\n\r\n')),
+                         (204, b'', True))
+        self.assertEqual(asyncio.run(read(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n', 'HEAD')), (200, b'', True))
+
+    def test_connection_is_reused_after_204(self):
+        async def run(db):
+            for value in range(3):
+                self.assertEqual(await db.insert('Environment', {'value': float(value)}, ['value'], []), True)
+        self.run_with_db(run, timeout=1)
+        self.assertEqual(len(self.server.get_points('Environment', test_db_name)), 3)
@@ -0,0 +1,153 @@
+import unittest
+import logging
+import threading
+import os
+import pandas as pd
+from dbops.sqhelper import SQHelper
+from dbops.influxhelper import InfluxHelper
+from dbops.fakeinflux import FakeInfluxServer
+from dbops.bridge import SQInfluxBridge, InfluxSQCache
+
+logging.disable(logging.CRITICAL)
+test_db_name = "test_bridge_db.sql"
+test_influx_name = 'test_db'
+
+
+class SQInfluxBridgeTesting(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeInfluxServer().start()
+        self.sq = SQHelper(test_db_name)
+        self.sq.create_table('Environment', {'timestamp': 'INTEGER', 'temperature': 'REAL', 'room': 'TEXT'})
+        self.influx = InfluxHelper(test_influx_name, port=self.server.port, retries=1)
+        self.bridge = SQInfluxBridge(self.sq, self.influx, chunksize=2)
+
+    def tearDown(self):
+        self.server.stop()
+        os.remove(test_db_name)
+
+    def insert_rows(self, timestamps):
+        for t in timestamps:
+            self.sq.insert('Environment', {'timestamp': t, 'temperature': float(t), 'room': 'kitchen'})
+
+    def replicated_times(self):
+        return [p['time'] // 10**9 for p in self.server.get_points('Environment', test_influx_name)]
+
+    def test_add_table_without_timestamp_returns_false(self):
+        self.sq.create_table('no_time', {'value': 'REAL'})
+        self.assertEqual(self.bridge.add_table('no_time'), False)
+        self.assertEqual(self.bridge.add_table('missing'), False)
+
+    def test_sync_replicates_all_rows_in_chunks(self):
+        self.insert_rows([1, 2, 3, 4, 5])
+        self.bridge.add_table('Environment', tag_keys=['room'])
+        self.assertEqual(self.bridge.sync(), {'Environment': 5})
+        self.assertEqual(self.replicated_times(), [1, 2, 3, 4, 5])
+        self.assertEqual(self.server.request_count['write'], 3)
+        point = self.server.get_points('Environment', test_influx_name)[0]
+        self.assertEqual(point['tags'], {'room': 'kitchen'})
+        self.assertEqual(point['fields'], {'temperature': 1.0})
+
+    def test_sync_only_sends_new_rows(self):
+        self.insert_rows([1, 2, 3])
+        self.bridge.add_table('Environment', tag_keys=['room'])
+        self.bridge.sync()
+        self.assertEqual(self.bridge.sync(), {'Environment': 0})
+        self.insert_rows([4])
+        self.assertEqual(self.bridge.sync(), {'Environment': 1})
+        self.assertEqual(self.server.points_written, 4)
+
+    def test_checkpoint_is_stored_in_sqlite_file(self):
+        self.insert_rows([1, 2, 3])
+        self.bridge.add_table('Environment')
+        self.bridge.sync()
+        self.assertEqual(self.bridge.get_checkpoint('Environment'), 3)
+        bridge = SQInfluxBridge(SQHelper(test_db_name), self.influx)
+        bridge.add_table('Environment')
+        self.assertEqual(bridge.sync(), {'Environment': 0})
+        bridge.reset_checkpoint('Environment')
+        self.assertEqual(bridge.sync(), {'Environment': 3})
+
+    def test_failed_write_does_not_advance_checkpoint(self):
+        self.insert_rows([1, 2, 3])
+        self.bridge.add_table('Environment')
+        self.server.fail_next(1)
+        self.assertEqual(self.bridge.sync(), {'Environment': 0})
+        self.assertEqual(self.bridge.get_checkpoint('Environment'), None)
+        self.assertEqual(self.bridge.sync(), {'Environment': 3})
+        self.assertEqual(self.replicated_times(), [1, 2, 3])
+
+    def test_timestamp_key_does_not_split_equal_timestamps(self):
+        self.insert_rows([1, 2, 2, 2, 3])
+        self.bridge.add_table('Environment', key='timestamp')
+        self.assertEqual(self.bridge.sync(), {'Environment': 5})
+        self.assertEqual(self.bridge.get_checkpoint('Environment'), 3)
+
+    def test_run_until_stopped(self):
+        self.insert_rows([1, 2, 3])
+        self.bridge.add_table('Environment')
+        timer = threading.Timer(0.2, self.bridge.stop)
+        timer.start()
+        self.bridge.run(interval=0.05)
+        self.assertEqual(self.replicated_times(), [1, 2, 3])
+
+
+class InfluxSQCacheTesting(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeInfluxServer().start()
+        self.influx = InfluxHelper(test_influx_name, port=self.server.port, retries=1)
+        self.sq = SQHelper(test_db_name)
+        self.cache = InfluxSQCache(self.influx, self.sq, chunksize=2)
+        data = pd.DataFrame({
+            'timestamp': [10, 20, 30, 40, 50],
+            'temperature': [1.0, 2.0, 3.0, 4.0, 5.0],
+            'room': ['kitchen', 'kitchen', 'bedroom', 'kitchen', 'bedroom']
+        })
+        self.influx.insert('Environment', data, field_keys=['temperature'], tag_keys=['room'], use_timestamp=True)
+
+    def tearDown(self):
+        self.server.stop()
+        os.remove(test_db_name)
+
+    def test_export_creates_table_from_schema(self):
+        self.assertEqual(self.cache.export('Environment', 10, 50), 5)
+        self.assertEqual(self.sq.get_column_names('Environment'), ['room', 'temperature', 'timestamp'])
+        df = self.sq.table_to_df('Environment')
+        self.assertEqual(list(df['timestamp']), [10, 20, 30, 40, 50])
+        self.assertEqual(list(df['room']), ['kitchen', 'kitchen', 'bedroom', 'kitchen', 'bedroom'])
+        self.assertEqual(self.cache.get_span('Environment'), (10, 50))
+
+    def test_export_missing_measurement_returns_none(self):
+        self.assertEqual(self.cache.export('missing', 10, 50), None)
+        self.assertEqual(self.cache.get_span('missing'), None)
+
+    def test_export_again_replaces_rows(self):
+        self.cache.export('Environment', 10, 50)
+        self.assertEqual(self.cache.export('Environment', 20, 30), 2)
+        self.assertEqual(len(self.sq.table_to_df('Environment')), 5)
+
+    def test_export_missing_only_reads_outside_span(self):
+        self.cache.export('Environment', 20, 30)
+        self.assertEqual(self.cache.export('Environment', 10, 50, missing_only=True), 3)
+        self.assertEqual(self.cache.get_span('Environment'), (10, 50))
+        self.assertEqual(sorted(self.sq.table_to_df('Environment')['timestamp']), [10, 20, 30, 40, 50])
+        self.assertEqual(self.cache.export('Environment', 10, 50, missing_only=True), 0)
+
+    def test_export_fills_gap_to_stored_span(self):
+        self.cache.export('Environment', 10, 10)
+        self.assertEqual(self.cache.export('Environment', 50, 50), 4)
+        self.assertEqual(self.cache.get_span('Environment'), (10, 50))
+
+    def test_failed_export_changes_nothing(self):
+        self.cache.export('Environment', 10, 20)
+        self.server.failure_rate = 1
+        self.assertEqual(self.cache.export('Environment', 10, 50), None)
+        self.server.failure_rate = 0
+        self.assertEqual(self.cache.get_span('Environment'), (10, 20))
+        self.assertEqual(list(self.sq.table_to_df('Environment')['timestamp']), [10, 20])
+
+    def test_query_range_only_fetches_once(self):
+        df = self.cache.query_range('Environment', 20, 40)
+        self.assertEqual(list(df['temperature']), [2.0, 3.0, 4.0])
+        self.server.stop()
+        df = self.cache.query_range('Environment', 30, 40)
+        self.assertEqual(list(df['timestamp']), [30, 40])
@@ -0,0 +1,84 @@
+import unittest
+import logging
+import pandas as pd
+from dbops.deadband import DeadbandFilter
+
+logging.disable(logging.CRITICAL)
+
+
+class DeadbandFilterTesting(unittest.TestCase):
+    def test_absolute_deadband(self):
+        deadband = DeadbandFilter({'value': 0.5})
+        kept = [deadband.filter({'timestamp': t, 'value': v}) is not None
+                for t, v in enumerate([1.0, 1.4, 1.5, 1.6, 2.0, 1.0])]
+        self.assertEqual(kept, [True, False, False, True, False, True])
+
+    def test_relative_deadband(self):
+        deadband = DeadbandFilter({'value': {'relative': 0.1}})
+        kept = [deadband.filter({'timestamp': t, 'value': v}) is not None
+                for t, v in enumerate([100.0, 109.0, 111.0, 120.0, 125.0])]
+        self.assertEqual(kept, [True, False, True, False, True])
+
+    def test_absolute_and_relative_deadband_drop_within_either(self):
+        deadband = DeadbandFilter({'value': {'absolute': 1, 'relative': 0.1}})
+        kept = [deadband.filter({'value': v}) is not None for v in [100.0, 105.0, 120.0, 120.9]]
+        self.assertEqual(kept, [True, False, True, False])
+
+    def test_change_only_with_zero_deadband_and_strings(self):
+        deadband = DeadbandFilter({'value': 0, 'state': 0})
+        entries = [{'value': 1, 'state': 'on'}, {'value': 1, 'state': 'on'}, {'value': 1, 'state': 'off'},
+                   {'value': 2, 'state': 'off'}]
+        kept = [deadband.filter(e) is not None for e in entries]
+        self.assertEqual(kept, [True, False, True, True])
+
+    def test_heartbeat_forces_write(self):
+        deadband = DeadbandFilter({'value': 0.5}, heartbeat=10)
+        kept = [deadband.filter({'timestamp': t, 'value': 1.0}) is not None for t in [0, 5, 9, 10, 15, 20]]
+        self.assertEqual(kept, [True, False, False, True, False, True])
+
+    def test_series_are_filtered_separately(self):
+        deadband = DeadbandFilter({'value': 0.5})
+        self.assertIsNotNone(deadband.filter({'value': 1.0, 'room': 'kitchen'}, ['room']))
+        self.assertIsNotNone(deadband.filter({'value': 1.0, 'room': 'hall'}, ['room']))
+        self.assertIsNone(deadband.filter({'value': 1.2, 'room': 'kitchen'}, ['room']))
+
+    def test_fields_without_deadband_are_always_written(self):
+        deadband = DeadbandFilter({'value': 0.5})
+        self.assertIsNotNone(deadband.filter({'value': 1.0, 'other': 1}))
+        self.assertIsNotNone(deadband.filter({'value': 1.0, 'other': 1}))
+        self.assertIsNone(deadband.filter({'value': 1.0, 'other': None}))
+        self.assertIsNone(deadband.filter({'value': 1.0, 'other': 1}, field_keys=['value']))
+
+    def test_missing_values_are_not_a_change(self):
+        deadband = DeadbandFilter({'value': 0.5, 'humidity': 1})
+        deadband.filter({'value': 1.0, 'humidity': 50.0})
+        self.assertIsNone(deadband.filter({'value': float('nan'), 'humidity': 50.5}))
+        self.assertIsNotNone(deadband.filter({'value': 1.6, 'humidity': None}))
+
+    def test_dataframe_rows_are_filtered_in_order(self):
+        deadband = DeadbandFilter({'value': 0.5}, heartbeat=60)
+        df = pd.DataFrame({
+            'timestamp': [0, 1, 2, 3, 60, 61],
+            'value': [1.0, 1.0, 1.0, 1.0, 1.0, 2.0],
+            'room': ['kitchen', 'kitchen', 'hall', 'hall', 'kitchen', 'kitchen']
+        })
+        self.assertEqual(list(deadband.filter(df, ['room']).index), [0, 2, 4, 5])
+        deadband.reset()
+        self.assertEqual(list(deadband.filter(df, ['room'], use_timestamp=False).index), [0, 2, 5])
+
+    def test_rollback_forgets_entries_kept_since_begin(self):
+        deadband = DeadbandFilter({'value': 0.5})
+        deadband.filter({'sensor': 'a', 'value': 1.0}, ['sensor'])
+        deadband.begin()
+        self.assertIsNot(deadband.filter({'sensor': 'a', 'value': 2.0}, ['sensor']), None)
+        self.assertIsNot(deadband.filter({'sensor': 'b', 'value': 2.0}, ['sensor']), None)
+        deadband.rollback()
+        # The failed write is retried, and the value before it is remembered again.
+        self.assertIsNot(deadband.filter({'sensor': 'a', 'value': 2.0}, ['sensor']), None)
+        self.assertIsNot(deadband.filter({'sensor': 'b', 'value': 2.0}, ['sensor']), None)
+        self.assertIs(deadband.filter({'sensor': 'a', 'value': 2.2}, ['sensor']), None)
+        deadband.begin()
+        deadband.filter({'sensor': 'a', 'value': 3.0}, ['sensor'])
+        deadband.commit()
+        deadband.rollback()
+        self.assertIs(deadband.filter({'sensor': 'a', 'value': 3.0}, ['sensor']), None)
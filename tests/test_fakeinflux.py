@@ -0,0 +1,201 @@
+import unittest
+import logging
+import socket
+import time
+import gzip
+import json
+import requests
+from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBServerError, InfluxDBClientError
+from dbops.fakeinflux import FakeInfluxServer, parse_lines
+
+logging.disable(logging.CRITICAL)
+test_db_name = 'test_db'
+
+
+class FakeInfluxTesting(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeInfluxServer(seed=1).start()
+        self.client = InfluxDBClient(port=self.server.port, database=test_db_name, retries=1)
+        self.client.create_database(test_db_name)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def write_lines(self, lines, precision='s'):
+        self.client.write_points(lines, protocol='line', time_precision=precision)
+
+    def test_ping_returns_version(self):
+        self.assertEqual(self.client.ping(), '1.8.0-dbops-fake')
+
+    def test_parse_line_protocol_with_escapes_and_types(self):
+        line = r'my\ meas,room=living\,room,house=a\=b str="say \"hi\"",int=5i,flt=1.5,flag=t 1585848415'
+        points = parse_lines(line, 's')
+        self.assertEqual(points, [('my meas', (('house', 'a=b'), ('room', 'living,room')), {
+            'str': 'say "hi"',
+            'int': 5,
+            'flt': 1.5,
+            'flag': True
+        }, 1585848415000000000)])
+
+    def test_write_line_protocol_and_query(self):
+        self.write_lines(['Environment,room=kitchen temperature=23.3 1585848415',
+                          'Environment,room=bedroom temperature=22.1 1585848416'])
+        points = list(self.client.query('SELECT temperature, room FROM Environment', epoch='s').get_points())
+        self.assertEqual(points, [{
+            'time': 1585848415,
+            'temperature': 23.3,
+            'room': 'kitchen'
+        }, {
+            'time': 1585848416,
+            'temperature': 22.1,
+            'room': 'bedroom'
+        }])
+        self.assertEqual(self.server.points_written, 2)
+
+    def test_write_json_points(self):
+        body = json.dumps({'points': [{'measurement': 'Environment', 'fields': {'temperature': 1.0}, 'time': 10}],
+                           'tags': {'room': 'kitchen'}})
+        response = requests.post(self.server.url + '/write', params={'db': test_db_name, 'precision': 's'},
+                                 data=body, headers={'Content-Type': 'application/json'})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.server.get_points('Environment'), [{
+            'time': 10 * 10**9,
+            'tags': {'room': 'kitchen'},
+            'fields': {'temperature': 1.0}
+        }])
+
+    def test_write_gzip_compressed_lines(self):
+        client = InfluxDBClient(port=self.server.port, database=test_db_name, gzip=True)
+        client.write_points(['Environment temperature=1.0 1'], protocol='line')
+        self.assertEqual(len(self.server.get_points('Environment')), 1)
+        response = requests.post(self.server.url + '/write', params={'db': test_db_name},
+                                 data=gzip.compress(b'Environment temperature=2.0 2\n'),
+                                 headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(len(self.server.get_points('Environment')), 2)
+
+    def test_write_to_missing_database_fails(self):
+        response = requests.post(self.server.url + '/write', params={'db': 'missing'}, data=b'm value=1 1\n')
+        self.assertEqual(response.status_code, 404)
+
+    def test_write_field_type_conflict_fails(self):
+        self.write_lines(['Environment temperature=1.0 1'])
+        with self.assertRaises(InfluxDBClientError):
+            self.write_lines(['Environment temperature="warm" 2'])
+
+    def test_chunked_query_response(self):
+        self.write_lines(['Environment temperature={} {}'.format(i, i) for i in range(5)])
+        response = requests.get(self.server.url + '/query',
+                                params={'db': test_db_name, 'q': 'SELECT temperature FROM Environment',
+                                        'chunked': 'true', 'chunk_size': 2, 'epoch': 's'},
+                                stream=True)
+        chunks = [json.loads(line) for line in response.iter_lines() if line]
+        self.assertEqual([len(c['results'][0]['series'][0]['values']) for c in chunks], [2, 2, 1])
+        self.assertEqual([c['results'][0].get('partial', False) for c in chunks], [True, True, False])
+
+    def test_time_range_and_tag_filter(self):
+        self.write_lines(['Environment,room=kitchen temperature=1 1', 'Environment,room=bedroom temperature=2 2',
+                          'Environment,room=kitchen temperature=3 3'])
+        query = "SELECT temperature FROM Environment WHERE time >= 2s AND time <= 3s AND (room = 'kitchen' OR " \
+                "room = 'hall')"
+        points = list(self.client.query(query, epoch='s').get_points())
+        self.assertEqual(points, [{'time': 3, 'temperature': 3.0}])
+
+    def test_last_grouped_by_tag(self):
+        self.write_lines(['Environment,room=kitchen temperature=1 1', 'Environment,room=bedroom temperature=2 2',
+                          'Environment,room=kitchen temperature=3 3'])
+        result = self.client.query('SELECT last(temperature) FROM Environment GROUP BY room', epoch='s')
+        self.assertEqual(list(result.get_points(tags={'room': 'kitchen'})), [{'time': 3, 'last': 3.0}])
+        self.assertEqual(list(result.get_points(tags={'room': 'bedroom'})), [{'time': 2, 'last': 2.0}])
+
+    def test_group_by_time_with_fill(self):
+        self.write_lines(['Environment temperature=1 0', 'Environment temperature=3 30',
+                          'Environment temperature=5 120'])
+        query = 'SELECT mean(temperature) FROM Environment WHERE time >= 0s AND time < 180s GROUP BY time(1m) fill({})'
+        means = [p['mean'] for p in self.client.query(query.format('null'), epoch='s').get_points()]
+        self.assertEqual(means, [2.0, None, 5.0])
+        means = [p['mean'] for p in self.client.query(query.format('previous'), epoch='s').get_points()]
+        self.assertEqual(means, [2.0, 2.0, 5.0])
+        means = [p['mean'] for p in self.client.query(query.format('none'), epoch='s').get_points()]
+        self.assertEqual(means, [2.0, 5.0])
+
+    def test_show_measurements_tag_and_field_keys(self):
+        self.write_lines(['Environment,room=kitchen temperature=1,count=2i 1'])
+        self.assertEqual(self.client.get_list_measurements(), [{'name': 'Environment'}])
+        tag_keys = list(self.client.query('SHOW TAG KEYS FROM Environment').get_points())
+        self.assertEqual(tag_keys, [{'tagKey': 'room'}])
+        field_keys = list(self.client.query('SHOW FIELD KEYS FROM Environment').get_points())
+        self.assertEqual(field_keys, [{
+            'fieldKey': 'count',
+            'fieldType': 'integer'
+        }, {
+            'fieldKey': 'temperature',
+            'fieldType': 'float'
+        }])
+
+    def test_continuous_query_writes_into_retention_policy(self):
+        self.client.create_retention_policy('long', 'INF', 1)
+        self.client.create_continuous_query(
+            'cq_mean', 'SELECT mean(temperature) INTO long.Environment_1m FROM Environment GROUP BY time(1m)')
+        self.write_lines(['Environment temperature=1 0', 'Environment temperature=3 30'])
+        self.assertEqual(self.server.run_continuous_queries(now=120), 1)
+        points = list(self.client.query('SELECT mean FROM long.Environment_1m', epoch='s').get_points())
+        self.assertEqual(points, [{'time': 0, 'mean': 2.0}])
+
+    def test_writing_queries_require_post(self):
+        self.write_lines(['Environment temperature=1 0'])
+        for query in ['SELECT mean(temperature) INTO Environment_1m FROM Environment GROUP BY time(1m)',
+                      'DROP MEASUREMENT Environment']:
+            # Sent directly, the influxdb client switches SELECT INTO to POST itself.
+            response = requests.get(self.server.url + '/query', params={'db': test_db_name, 'q': query})
+            self.assertEqual(response.status_code, 405)
+        self.client.query('SELECT mean(temperature) INTO Environment_1m FROM Environment GROUP BY time(1m)',
+                          method='POST')
+        self.assertEqual(len(self.server.get_points('Environment_1m')), 1)
+
+    def test_bad_query_raises_client_error(self):
+        with self.assertRaises(InfluxDBClientError):
+            self.client.query('SELEC temperature FROM Environment')
+
+    def test_query_on_missing_database_returns_statement_error(self):
+        with self.assertRaises(InfluxDBClientError):
+            self.client.query('SELECT temperature FROM Environment', database='missing')
+
+    def test_fail_next_request(self):
+        self.server.fail_next(1, status=503)
+        with self.assertRaises(InfluxDBServerError):
+            self.client.query('SHOW DATABASES')
+        self.assertEqual(self.client.get_list_database(), [{'name': test_db_name}])
+
+    def test_failure_rate_fails_requests(self):
+        self.server.failure_rate = 1
+        with self.assertRaises(InfluxDBServerError):
+            self.client.query('SHOW DATABASES')
+        self.server.failure_rate = 0
+        self.assertEqual(self.client.get_list_database(), [{'name': test_db_name}])
+
+    def test_latency_delays_requests(self):
+        self.server.latency = 0.05
+        start = time.monotonic()
+        self.client.ping()
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_request_count(self):
+        self.server.reset()
+        self.client.create_database(test_db_name)
+        self.write_lines(['Environment temperature=1 0'])
+        self.assertEqual(self.server.request_count, {'query': 1, 'write': 1})
+
+    def test_udp_listener(self):
+        server = FakeInfluxServer(udp_port=0, udp_database=test_db_name).start()
+        server.write_lines('', test_db_name)
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender.sendto(b'Environment temperature=1 1\n', ('localhost', server.udp_port))
+        sender.close()
+        deadline = time.monotonic() + 5
+        while server.points_written == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        server.stop()
+        self.assertEqual(len(server.get_points('Environment', test_db_name)), 1)
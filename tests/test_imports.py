@@ -0,0 +1,42 @@
+import unittest
+import subprocess
+import sys
+import os
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+heavy = ('pandas', 'numpy', 'influxdb', 'dateutil', 'pyrfc3339')
+
+
+def loaded_after(code):
+    """ Run code in a fresh interpreter, returning the heavy dependencies it loaded """
+    probe = code + "\nimport sys\nprint(','.join(m for m in {!r} if m in sys.modules))".format(heavy)
+    output = subprocess.run([sys.executable, '-c', probe], cwd=root, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout.strip()
+    return [m for m in output.split(',') if m]
+
+
+class LazyImportTesting(unittest.TestCase):
+    def test_modules_do_not_load_heavy_dependencies(self):
+        self.assertEqual(loaded_after("import dbops.sqhelper, dbops.influxhelper, dbops.outbox, dbops.timeconverter, "
+                                      "dbops.asyncinflux, dbops.bridge"), [])
+
+    def test_sqhelper_lists_and_dicts_do_not_load_pandas(self):
+        code = "\n".join([
+            "from dbops.sqhelper import SQHelper",
+            "db = SQHelper(':memory:')",
+            "db.create_table('t', {'timestamp': 'NUMERIC', 'value': 'REAL'})",
+            "assert db.insert('t', [1, 2.0]) and db.insert('t', {'timestamp': 2, 'value': 3.0})",
+            "assert db.get_last_time_entry('t') == {'timestamp': 2, 'value': 3.0}"])
+        self.assertEqual(loaded_after(code), [])
+
+    def test_dataframe_paths_load_pandas(self):
+        code = "\n".join([
+            "from dbops.sqhelper import SQHelper",
+            "db = SQHelper(':memory:')",
+            "db.create_table('t', {'timestamp': 'NUMERIC', 'value': 'REAL'})",
+            "assert len(db.table_to_df('t')) == 0"])
+        self.assertIn('pandas', loaded_after(code))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,22 +1,44 @@
 import unittest
+import gzip
+import tempfile
 import logging
+import socket
+import os
 from dbops.influxhelper import InfluxHelper
+from dbops.fakeinflux import FakeInfluxServer
 import pandas as pd
 
 logging.disable(logging.CRITICAL)
 test_db_name = 'test_db'
 bad_db_name = None
 
+# Set DBOPS_LIVE_INFLUX to run against an influxd on localhost:8086 instead of the in-process stand-in.
+live_influx = os.environ.get('DBOPS_LIVE_INFLUX') is not None
+test_port = 8086
+server = None
+
+
+def setUpModule():
+    global server, test_port
+    if not live_influx:
+        server = FakeInfluxServer().start()
+        test_port = server.port
+
+
+def tearDownModule():
+    if server is not None:
+        server.stop()
+
 
 class SQHelperTesting(unittest.TestCase):
     def setUp(self):
-        self.db = InfluxHelper(test_db_name)
+        self.db = InfluxHelper(test_db_name, port=test_port)
 
     def tearDown(self):
         self.db.remove_database(test_db_name)
 
     def create_bad_db(self):
-        self.db = InfluxHelper(bad_db_name)
+        self.db = InfluxHelper(bad_db_name, port=test_port)
 
     def test_get_list_of_all_databases(self):
         db_list = self.db.get_database_names()
@@ -160,6 +182,14 @@ class SQHelperTesting(unittest.TestCase):
         tags = ['room', 'house']
         return self.db.insert(measurement, df, field_keys=fields, tag_keys=tags, use_timestamp=use_time)
 
+    def test_insert_integer_dict_then_dataframe(self):
+        self.assertEqual(self.db.insert('Counter', {'timestamp': 1585848415, 'count': 1, 'room': 'kitchen'},
+                                        ['count'], ['room'], use_timestamp=True), True)
+        df = pd.DataFrame({'timestamp': [1585848416, 1585848417], 'count': [2, 3], 'ratio': [0.5, 1.0],
+                           'on': [True, False], 'room': ['kitchen', 'bedroom']})
+        self.assertEqual(self.db.insert('Counter', df, ['count', 'ratio', 'on'], ['room'], use_timestamp=True), True)
+        self.assertEqual(self.db.get_field_keys('Counter'), {'count': 'integer', 'ratio': 'float', 'on': 'boolean'})
+
     def test_insert_data_bad_dataframe(self):
         data = [{'timestamp': 1585848415, 'temperature': 23.3, 'humidity': 12.2, 'room': 'kitchen', 'house': 'home'}]
         df = pd.DataFrame(data)
@@ -215,3 +245,352 @@ class SQHelperTesting(unittest.TestCase):
         self.insert_dataframe_two_entries()
         success = self.db.remove_measurement(measurement)
         self.assertEqual(success, False)
+
+    def test_query_range_returns_dataframe(self):
+        self.insert_dataframe_two_entries(use_time=True)
+        df = self.db.query_range('Environment', ['temperature', 'humidity'], 1585848415, 1585848416)
+        self.assertEqual(list(df.columns), ['timestamp', 'temperature', 'humidity'])
+        self.assertEqual(list(df['timestamp']), [1585848415, 1585848416])
+        self.assertEqual(list(df['humidity']), [12.2, 13.4])
+
+    def test_query_range_is_inclusive_and_bounded(self):
+        self.insert_dataframe_two_entries(use_time=True)
+        df = self.db.query_range('Environment', ['temperature'], 1585848416, 1585848500)
+        self.assertEqual(list(df['temperature']), [22.1])
+
+    def test_query_range_with_tag_filter(self):
+        self.insert_dataframe_two_entries(use_time=True)
+        df = self.db.query_range('Environment', ['temperature', 'room'], 0, 1585848500, tags={'room': 'kitchen'})
+        self.assertEqual(list(df['room']), ['kitchen'])
+        df = self.db.query_range('Environment', ['temperature'], 0, 1585848500, tags={'room': ['kitchen', 'bedroom']})
+        self.assertEqual(len(df), 2)
+
+    def test_query_range_with_chunksize_yields_dataframes(self):
+        self.insert_dataframe_two_entries(use_time=True)
+        chunks = list(self.db.query_range('Environment', ['temperature'], 0, 1585848500, chunksize=1))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual([len(c) for c in chunks], [1, 1])
+
+    def test_query_range_empty_measurement_returns_empty_dataframe(self):
+        df = self.db.query_range('Environment', ['temperature'], 0, 1585848500)
+        self.assertEqual(len(df), 0)
+        self.assertEqual(list(df.columns), ['timestamp', 'temperature'])
+
+    def test_query_range_compact_types(self):
+        self.insert_dataframe_two_entries(use_time=True)
+        df = self.db.query_range('Environment', ['temperature', 'room'], 0, 1585848500, compact=True)
+        self.assertEqual(df['temperature'].dtype, 'float32')
+        self.assertEqual(df['room'].dtype, 'category')
+        self.assertEqual(df['timestamp'].dtype, 'int64')
+        self.assertEqual(list(df['room']), ['kitchen', 'bedroom'])
+
+    @unittest.skipIf(live_influx, 'Counts requests to the fake server')
+    def test_query_range_compact_does_not_list_tag_keys(self):
+        self.insert_dataframe_two_entries(use_time=True)
+        queries = server.request_count['query']
+        df = self.db.query_range('Environment', ['temperature', 'room'], 0, 1585848500, compact=True)
+        self.assertEqual(df['room'].dtype, 'category')
+        self.assertEqual(server.request_count['query'] - queries, 1)
+
+    def test_query_range_time_index(self):
+        self.insert_dataframe_two_entries(use_time=True)
+        df = self.db.query_range('Environment', ['temperature'], 0, 1585848500, time_index='epoch')
+        self.assertEqual(list(df.columns), ['temperature'])
+        self.assertEqual(df.index.name, 'timestamp')
+        self.assertEqual(list(df.index), [1585848415, 1585848416])
+        df = self.db.query_range('Environment', ['temperature'], 0, 1585848500, time_index='datetime')
+        self.assertEqual(str(df.index.tz), 'UTC')
+        self.assertEqual(df.index[0], pd.Timestamp('2020-04-02 17:26:55', tz='UTC'))
+        chunks = list(self.db.query_range('Environment', ['temperature'], 0, 1585848500, chunksize=1,
+                                          time_index='epoch', compact=True))
+        self.assertEqual([list(c.index) for c in chunks], [[1585848415], [1585848416]])
+        self.assertIs(self.db.query_range('Environment', ['temperature'], 0, 1585848500, time_index='ms'), None)
+
+    def test_query_range_empty_with_time_index(self):
+        df = self.db.query_range('Environment', ['temperature'], 0, 1585848500, compact=True, time_index='datetime')
+        self.assertEqual(len(df), 0)
+        self.assertEqual(list(df.columns), ['temperature'])
+        self.assertEqual(str(df.index.tz), 'UTC')
+
+    def test_query_range_bad_fields_returns_none(self):
+        self.assertIs(self.db.query_range('Environment', 'temperature', 0, 1585848500), None)
+
+    def test_query_range_no_database_returns_none(self):
+        self.create_bad_db()
+        self.assertIs(self.db.query_range('Environment', ['temperature'], 0, 1585848500), None)
+
+    def test_get_last_time_entries_grouped_by_tag(self):
+        self.insert_dataframe_two_entries(use_time=True)
+        df = self.db.get_last_time_entries('Environment', ['temperature', 'humidity'], 'room', as_unix=True)
+        self.assertEqual(sorted(df.index), ['bedroom', 'kitchen'])
+        self.assertEqual(df.loc['kitchen', 'temperature'], 23.3)
+        self.assertEqual(df.loc['bedroom', 'humidity'], 13.4)
+        self.assertEqual(df.loc['bedroom', 'time'], 1585848416)
+
+    def test_get_last_time_entries_filtered_by_tag_values(self):
+        self.insert_dataframe_two_entries(use_time=True)
+        df = self.db.get_last_time_entries('Environment', ['temperature'], 'room', tag_values=['kitchen'])
+        self.assertEqual(list(df.index), ['kitchen'])
+        self.assertEqual(df.loc['kitchen', 'time'], '2020-04-02T17:26:55Z')
+
+    def test_get_last_time_entries_compares_fractional_seconds(self):
+        self.db.client.write_points(['Environment,room=kitchen temperature=1 1585848415000000000',
+                                     'Environment,room=kitchen humidity=2 1585848415500000000'], protocol='line')
+        df = self.db.get_last_time_entries('Environment', ['temperature', 'humidity'], 'room')
+        self.assertEqual(df.loc['kitchen', 'time'], '2020-04-02T17:26:55.5Z')
+        df = self.db.get_last_time_entries('Environment', ['humidity', 'temperature'], 'room')
+        self.assertEqual(df.loc['kitchen', 'time'], '2020-04-02T17:26:55.5Z')
+
+    def test_get_last_time_entries_empty_measurement(self):
+        df = self.db.get_last_time_entries('Environment', ['temperature'], 'room')
+        self.assertEqual(len(df), 0)
+
+    def test_get_last_time_entries_no_database_returns_none(self):
+        self.create_bad_db()
+        self.assertIs(self.db.get_last_time_entries('Environment', ['temperature'], 'room'), None)
+
+    def test_get_tag_and_field_keys(self):
+        self.insert_dataframe_two_entries()
+        self.assertEqual(sorted(self.db.get_tag_keys('Environment')), ['house', 'room'])
+        self.assertEqual(self.db.get_field_keys('Environment'), {'humidity': 'float', 'temperature': 'float'})
+
+    def test_metadata_cache_is_updated_by_own_writes_and_removals(self):
+        self.db = InfluxHelper(test_db_name, port=test_port, metadata_ttl=60)
+        self.assertEqual(self.db.get_measurement_names(), [])
+        self.insert_dataframe_two_entries()
+        self.assertEqual(self.db.get_measurement_names(), ['Environment'])
+        self.assertEqual(self.db.remove_measurement('Environment'), True)
+        self.assertEqual(self.db.get_measurement_names(), [])
+
+    def test_metadata_cache_hides_external_changes_until_refreshed(self):
+        self.db = InfluxHelper(test_db_name, port=test_port, metadata_ttl=60)
+        self.assertEqual(self.db.get_measurement_names(), [])
+        other = InfluxHelper(test_db_name, port=test_port)
+        data = {'temperature': 23.3, 'room': 'kitchen'}
+        other.insert('Environment', data, field_keys=['temperature'], tag_keys=['room'])
+        self.assertEqual(self.db.get_measurement_names(), [])
+        self.db.refresh_metadata()
+        self.assertEqual(self.db.get_measurement_names(), ['Environment'])
+
+    def test_connection_options_are_used_by_client(self):
+        self.db = InfluxHelper(test_db_name, host='localhost', port=test_port, gzip=True, timeout=5)
+        self.assertEqual(self.db.exists(), True)
+        self.assertEqual(self.db.client._gzip, True)
+        self.assertEqual(self.insert_single_good_entry(), True)
+
+    def test_unknown_transport_is_not_useable(self):
+        self.db = InfluxHelper(test_db_name, port=test_port, transport='carrier_pigeon')
+        self.assertEqual(self.db.exists(), False)
+
+    def test_udp_transport_sends_lines_to_udp_listener(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        listener.bind(('localhost', 0))
+        listener.settimeout(5)
+        self.db = InfluxHelper(test_db_name, port=test_port, transport='udp', udp_port=listener.getsockname()[1])
+        success = self.insert_single_good_entry(use_time=True)
+        packet = listener.recv(65535).decode('utf-8')
+        listener.close()
+        self.assertEqual(success, True)
+        expected = 'Environment,house=home,room=kitchen humidity=12.2,temperature=23.3 1585848415000000000\n'
+        self.assertEqual(packet, expected)
+
+    def insert_minute_of_entries(self):
+        data = pd.DataFrame({
+            'timestamp': [1585848000, 1585848030, 1585848060, 1585848180],
+            'temperature': [20.0, 22.0, 24.0, 30.0],
+            'room': ['kitchen'] * 4
+        })
+        return self.db.insert('Environment', data, field_keys=['temperature'], tag_keys=['room'], use_timestamp=True)
+
+    def test_query_aggregated_mean_every_minute(self):
+        self.insert_minute_of_entries()
+        df = self.db.query_aggregated('Environment', ['temperature'], 1585848000, 1585848239, every='1m')
+        self.assertEqual(list(df['timestamp']), [1585848000, 1585848060, 1585848120, 1585848180])
+        self.assertEqual(list(df['temperature'].fillna(-1)), [21.0, 24.0, -1, 30.0])
+
+    def test_query_aggregated_with_fill_and_function(self):
+        self.insert_minute_of_entries()
+        df = self.db.query_aggregated('Environment', ['temperature'], 1585848000, 1585848239, every='1m', fn='max',
+                                      fill='none')
+        self.assertEqual(list(df['temperature']), [22.0, 24.0, 30.0])
+        df = self.db.query_aggregated('Environment', ['temperature'], 1585848000, 1585848239, every='1m',
+                                      fill='previous')
+        self.assertEqual(list(df['temperature']), [21.0, 24.0, 24.0, 30.0])
+
+    def test_query_aggregated_no_database_returns_none(self):
+        self.create_bad_db()
+        self.assertIs(self.db.query_aggregated('Environment', ['temperature'], 0, 1), None)
+
+    def test_create_downsample_with_backfill(self):
+        self.insert_minute_of_entries()
+        success = self.db.create_downsample('Environment', '1m', 'mean', 'one_year', duration='52w', backfill=True)
+        self.assertEqual(success, True)
+        df = self.db.query_range('one_year.Environment', ['temperature', 'room'], 1585848000, 1585848239)
+        self.assertEqual(list(df['temperature']), [21.0, 24.0, 30.0])
+        self.assertEqual(list(df['room']), ['kitchen'] * 3)
+
+    def test_create_downsample_twice_and_remove(self):
+        self.insert_minute_of_entries()
+        self.assertEqual(self.db.create_downsample('Environment', '1m', 'mean', 'one_year'), True)
+        self.assertEqual(self.db.create_downsample('Environment', '1m', 'mean', 'one_year'), True)
+        self.assertEqual(self.db.remove_downsample('Environment', '1m', 'mean', 'one_year'), True)
+        self.assertEqual(self.db.remove_downsample('Environment', '1m', 'mean', 'one_year'), False)
+
+    def test_create_downsample_without_fields_returns_false(self):
+        self.assertEqual(self.db.create_downsample('Environment', '1m', 'mean', 'one_year'), False)
+
+    def test_insert_with_deadband_drops_unchanged_entries(self):
+        self.db.set_deadband('Environment', {'temperature': 0.5}, heartbeat=120)
+        data = pd.DataFrame({
+            'timestamp': [1585848000, 1585848030, 1585848060, 1585848120, 1585848130],
+            'temperature': [20.0, 20.2, 20.2, 20.2, 21.0],
+            'room': ['kitchen', 'kitchen', 'hall', 'kitchen', 'kitchen']
+        })
+        self.assertEqual(self.db.insert('Environment', data, ['temperature'], ['room'], use_timestamp=True), True)
+        entry = {'timestamp': 1585848140, 'temperature': 21.1, 'room': 'kitchen'}
+        self.assertEqual(self.db.insert('Environment', entry, ['temperature'], ['room'], use_timestamp=True), True)
+        df = self.db.query_range('Environment', ['temperature', 'room'], 1585848000, 1585848200)
+        self.assertEqual(list(df['timestamp']), [1585848000, 1585848060, 1585848120, 1585848130])
+
+    @unittest.skipIf(live_influx, 'Fails requests made to the fake server')
+    def test_insert_with_deadband_retries_failed_write(self):
+        self.db.set_deadband('Environment', {'temperature': 0.5})
+        entry = {'timestamp': 1585848000, 'temperature': 20.0, 'room': 'kitchen'}
+        server.fail_next(1)
+        self.assertEqual(self.db.insert('Environment', entry, ['temperature'], ['room'], use_timestamp=True), False)
+        self.assertEqual(self.db.insert('Environment', entry, ['temperature'], ['room'], use_timestamp=True), True)
+        server.fail_next(1)
+        self.assertEqual(self.db.insert_many([('Environment', dict(entry, timestamp=1585848010, temperature=22.0),
+                                               ['temperature'], ['room'])], use_timestamp=True), {'Environment': False})
+        self.assertEqual(self.db.insert_many([('Environment', dict(entry, timestamp=1585848010, temperature=22.0),
+                                               ['temperature'], ['room'])], use_timestamp=True), {'Environment': True})
+        df = self.db.query_range('Environment', ['temperature'], 1585848000, 1585848010)
+        self.assertEqual(list(df['temperature']), [20.0, 22.0])
+
+    def test_insert_many_measurements(self):
+        entries = [('Environment', {'timestamp': 1585848000, 'temperature': 20.0, 'room': 'kitchen'}, ['temperature'],
+                    ['room']),
+                   ('Power', pd.DataFrame({'timestamp': [1585848000, 1585848010], 'watts': [100.0, 120.0]}), ['watts'],
+                    []),
+                   ('Environment', {'timestamp': 1585848010, 'temperature': 21.0, 'room': 'kitchen'}, ['temperature'],
+                    ['room'])]
+        results = self.db.insert_many(entries, use_timestamp=True)
+        self.assertEqual(results, {'Environment': True, 'Power': True})
+        df = self.db.query_range('Environment', ['temperature'], 1585848000, 1585848010)
+        self.assertEqual(list(df['temperature']), [20.0, 21.0])
+        df = self.db.query_range('Power', ['watts'], 1585848000, 1585848010)
+        self.assertEqual(list(df['watts']), [100.0, 120.0])
+
+    def test_insert_many_reports_bad_entries(self):
+        entries = [('Environment', {'timestamp': 1585848000, 'temperature': 20.0}, ['temperature'], []),
+                   ('Power', {'timestamp': 1585848000, 'watts': 100.0}, 'watts', []),
+                   ('Other', [1, 2], ['value'], [])]
+        results = self.db.insert_many(entries, use_timestamp=True)
+        self.assertEqual(results, {'Environment': True, 'Power': False, 'Other': False})
+
+    @unittest.skipIf(live_influx, 'Counts requests made to the fake server')
+    def test_insert_many_splits_payloads(self):
+        server.reset()
+        self.db = InfluxHelper(test_db_name, port=test_port)
+        entries = [('m{}'.format(i), {'timestamp': i, 'value': float(i)}, ['value'], []) for i in range(10)]
+        self.assertEqual(self.db.insert_many(entries, use_timestamp=True), {'m{}'.format(i): True for i in range(10)})
+        self.assertEqual(server.request_count['write'], 1)
+        self.db.insert_many(entries, use_timestamp=True, max_payload=60)
+        self.assertEqual(server.request_count['write'], 6)
+        self.assertEqual(server.points_written, 20)
+
+    def test_insert_many_without_timestamps_uses_one_time(self):
+        entries = [('Environment', {'temperature': 20.0}, ['temperature'], []),
+                   ('Power', {'watts': 100.0}, ['watts'], [])]
+        self.assertEqual(self.db.insert_many(entries, max_payload=10), {'Environment': True, 'Power': True})
+        environment = self.db.get_last_time_entry('Environment', 'temperature', as_unix=True)
+        power = self.db.get_last_time_entry('Power', 'watts', as_unix=True)
+        self.assertEqual(environment['last'], 20.0)
+        self.assertEqual(environment['time'], power['time'])
+
+    def test_insert_many_bad_database(self):
+        self.create_bad_db()
+        entries = [('Environment', {'temperature': 20.0}, ['temperature'], [])]
+        self.assertEqual(self.db.insert_many(entries), {'Environment': False})
+
+    @unittest.skipIf(live_influx, 'Counts requests made to the fake server')
+    def test_query_cache_serves_repeated_reads(self):
+        self.db = InfluxHelper(test_db_name, port=test_port, query_cache_ttl=60)
+        self.insert_minute_of_entries()
+        queries = server.request_count['query']
+        for i in range(3):
+            df = self.db.query_range('Environment', ['temperature'], 1585848000, 1585848239)
+            entry = self.db.get_last_time_entry('Environment', 'temperature', as_unix=True)
+        self.assertEqual(list(df['temperature']), [20.0, 22.0, 24.0, 30.0])
+        self.assertEqual(entry['last'], 30.0)
+        self.assertEqual(server.request_count['query'] - queries, 2)
+
+    def test_query_cache_invalidated_by_own_writes(self):
+        self.db = InfluxHelper(test_db_name, port=test_port, query_cache_ttl=60)
+        self.insert_minute_of_entries()
+        self.assertEqual(self.db.get_last_time_entry('Environment', 'temperature', as_unix=True)['last'], 30.0)
+        entry = {'timestamp': 1585848240, 'temperature': 31.0, 'room': 'kitchen'}
+        self.db.insert('Environment', entry, ['temperature'], ['room'], use_timestamp=True)
+        self.assertEqual(self.db.get_last_time_entry('Environment', 'temperature', as_unix=True)['last'], 31.0)
+
+    def test_query_cache_ttl_per_method(self):
+        self.db = InfluxHelper(test_db_name, port=test_port, query_cache_ttl={'query_range': 60})
+        self.insert_minute_of_entries()
+        self.db.query_range('Environment', ['temperature'], 1585848000, 1585848239)
+        self.db.get_last_time_entry('Environment', 'temperature')
+        self.assertEqual(len(self.db.query_cache), 1)
+
+    def test_import_line_protocol_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'backfill.lp')
+            with open(path, 'w') as f:
+                f.write('# comment\n\n')
+                lines = ['Environment,room=kitchen temperature={},count={}i {}'.format(i, i, 1585848000 + i)
+                         for i in range(25)]
+                f.write('\n'.join(lines))
+                f.write('\nEnvironment temperature= 1\nnot line protocol\n')
+            counts = self.db.import_file(path, batch_size=10, precision='s', workers=2)
+        self.assertEqual(counts, {'written': 25, 'rejected': 2, 'failed': 0})
+        df = self.db.query_range('Environment', ['temperature', 'count', 'room'], 1585848000, 1585848100)
+        self.assertEqual(list(df['temperature']), [float(i) for i in range(25)])
+        self.assertEqual(self.db.get_field_keys('Environment'), {'count': 'integer', 'temperature': 'float'})
+
+    def test_import_gzip_csv_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'backfill.csv.gz')
+            with gzip.open(path, 'wt') as f:
+                f.write('timestamp,room,temperature,state\n')
+                f.write('1585848000,kitchen,20.5,on\n1585848010,hall,21,\nbad,hall,1,on\n1585848020,hall,,\n')
+            counts = self.db.import_file(path, format='csv', measurement='Environment', tag_keys=['room'])
+        self.assertEqual(counts, {'written': 2, 'rejected': 2, 'failed': 0})
+        df = self.db.query_range('Environment', ['temperature', 'state', 'room'], 1585848000, 1585848100)
+        self.assertEqual(list(df['temperature']), [20.5, 21.0])
+        self.assertEqual(list(df['room']), ['kitchen', 'hall'])
+
+    def test_import_missing_file_or_bad_format(self):
+        self.assertEqual(self.db.import_file('missing.lp'), None)
+        self.assertEqual(self.db.import_file('missing.lp', format='json'), None)
+
+    def test_export_and_import_round_trip(self):
+        entries = pd.DataFrame({
+            'timestamp': [1585848000, 1585848010, 1585848020],
+            'temperature': [20.5, 21.0, 22.0],
+            'room': ['kitchen', 'hall', 'living room'],
+            'label': ['a "b"', 'c', 'd']
+        })
+        self.db.insert('Environment', entries, ['temperature', 'label'], ['room'], use_timestamp=True)
+        self.db.insert('Environment', {'timestamp': 1585848030, 'count': 3, 'room': 'hall'}, ['count'], ['room'],
+                       use_timestamp=True)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.lp.gz')
+            self.assertEqual(self.db.export_to_file('Environment', 1585848000, 1585848030, path, chunksize=2), 4)
+            with gzip.open(path, 'rt') as f:
+                lines = f.read().splitlines()
+            self.assertEqual(lines[0],
+                             'Environment,room=kitchen label="a \\"b\\"",temperature=20.5 1585848000000000000')
+            self.assertEqual(lines[3], 'Environment,room=hall count=3i 1585848030000000000')
+            self.db.remove_measurement('Environment')
+            self.assertEqual(self.db.import_file(path), {'written': 4, 'rejected': 0, 'failed': 0})
+        df = self.db.query_range('Environment', ['temperature', 'label', 'room'], 1585848000, 1585848020)
+        self.assertEqual(list(df['label']), ['a "b"', 'c', 'd'])
+        self.assertEqual(list(df['room']), ['kitchen', 'hall', 'living room'])
@@ -0,0 +1,198 @@
+import unittest
+import logging
+import os
+import pandas as pd
+from contextlib import contextmanager
+from dbops.instrumentation import Instrumentation, current_call, NULL_CALL
+from dbops.sqhelper import SQHelper
+from dbops.influxhelper import InfluxHelper
+from dbops.fakeinflux import FakeInfluxServer
+
+logging.disable(logging.CRITICAL)
+test_db_name = "test_instrumentation.sql"
+test_prom_name = "test_instrumentation.prom"
+test_influx_name = 'test_db'
+
+
+class FakeSpan():
+    def __init__(self, name):
+        self.name = name
+        self.attributes = dict()
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class FakeTracer():
+    def __init__(self):
+        self.spans = []
+
+    @contextmanager
+    def start_as_current_span(self, name):
+        span = FakeSpan(name)
+        yield span
+        self.spans.append(span)
+
+
+class InstrumentationTesting(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists(test_prom_name):
+            os.remove(test_prom_name)
+
+    def test_calls_are_recorded(self):
+        instrumentation = Instrumentation(buckets=(0.001, 10))
+        with instrumentation.call('Helper.method') as call:
+            self.assertIs(instrumentation.current(), call)
+            call.add(rows_in=3, statements=1)
+            with call.phase('execute'):
+                pass
+        with self.assertRaises(ValueError):
+            with instrumentation.call('Helper.method'):
+                raise ValueError()
+        self.assertIs(instrumentation.current(), NULL_CALL)
+
+        stats = instrumentation.get_stats()['Helper.method']
+        self.assertEqual(stats['calls'], 2)
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['rows_in'], 3)
+        self.assertEqual(stats['statements'], 1)
+        self.assertEqual(list(stats['histogram'].values()), [2, 2, 2])
+        self.assertEqual(list(stats['phases']), ['execute'])
+        instrumentation.reset()
+        self.assertEqual(instrumentation.get_stats(), {})
+
+    def test_callback_and_spans(self):
+        events = []
+        tracer = FakeTracer()
+        instrumentation = Instrumentation(callback=events.append, tracer=tracer)
+        with instrumentation.call('Helper.method') as call:
+            call.add(bytes_sent=10)
+        self.assertEqual(events[0]['name'], 'Helper.method')
+        self.assertEqual(events[0]['bytes_sent'], 10)
+        self.assertEqual(events[0]['error'], False)
+        self.assertEqual(tracer.spans[0].name, 'Helper.method')
+        self.assertEqual(tracer.spans[0].attributes['dbops.bytes_sent'], 10)
+
+    def test_failing_callback_is_ignored(self):
+        instrumentation = Instrumentation(callback=lambda event: 1 / 0)
+        with instrumentation.call('Helper.method'):
+            pass
+        self.assertEqual(instrumentation.get_stats()['Helper.method']['calls'], 1)
+
+    def test_write_prometheus(self):
+        instrumentation = Instrumentation(buckets=(0.5, ))
+        with instrumentation.call('SQHelper.insert') as call:
+            call.add(rows_in=2)
+            with call.phase('commit'):
+                pass
+        self.assertEqual(instrumentation.write_prometheus(test_prom_name), True)
+        with open(test_prom_name) as f:
+            text = f.read()
+        self.assertIn('# TYPE dbops_call_duration_seconds histogram', text)
+        self.assertIn('dbops_call_duration_seconds_bucket{call="SQHelper.insert",le="0.5"} 1', text)
+        self.assertIn('dbops_call_duration_seconds_bucket{call="SQHelper.insert",le="+Inf"} 1', text)
+        self.assertIn('dbops_call_duration_seconds_count{call="SQHelper.insert"} 1', text)
+        self.assertIn('dbops_rows_in_total{call="SQHelper.insert"} 2', text)
+        self.assertIn('dbops_phase_seconds_total{call="SQHelper.insert",phase="commit"}', text)
+        self.assertEqual(instrumentation.write_prometheus(os.path.join('missing', test_prom_name)), False)
+
+    def test_disabled_records_nothing(self):
+        call = current_call(None)
+        self.assertIs(call, NULL_CALL)
+        with call.phase('execute'):
+            call.add(rows_in=1)
+
+
+class SQHelperInstrumentationTesting(unittest.TestCase):
+    def setUp(self):
+        self.instrumentation = Instrumentation()
+        self.db = SQHelper(test_db_name, instrumentation=self.instrumentation)
+        self.db.create_table('Temperature', {'timestamp': 'NUMERIC', 'value': 'REAL'})
+
+    def tearDown(self):
+        self.db.con.close()
+        if os.path.exists(test_db_name):
+            os.remove(test_db_name)
+
+    def test_insert_records_phases_and_counters(self):
+        self.db.insert('Temperature', pd.DataFrame({'timestamp': [1, 2, 3], 'value': [1.0, 2.0, 3.0]}))
+        self.db.insert('Temperature', {'timestamp': 4, 'value': 4.0})
+        self.assertEqual(self.db.insert('Missing', [1, 2]), False)
+        stats = self.instrumentation.get_stats()['SQHelper.insert']
+        self.assertEqual(stats['calls'], 3)
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['rows_in'], 4)
+        self.assertEqual(stats['statements'], 2)
+        self.assertEqual(stats['commits'], 2)
+        self.assertEqual(sorted(stats['phases']), ['commit', 'convert', 'execute'])
+
+    def test_reads_record_rows_out(self):
+        self.db.insert('Temperature', pd.DataFrame({'timestamp': [1, 2, 3], 'value': [1.0, 2.0, 3.0]}))
+        self.db.table_to_df('Temperature')
+        self.db.get_row_range('Temperature', 'timestamp', 2, 3)
+        self.db.get_last_time_entry('Temperature')
+        self.assertIs(self.db.table_to_df('Missing'), None)
+        stats = self.instrumentation.get_stats()
+        self.assertEqual(stats['SQHelper.table_to_df']['rows_out'], 3)
+        self.assertEqual(stats['SQHelper.table_to_df']['errors'], 1)
+        self.assertEqual(stats['SQHelper.get_row_range']['rows_out'], 2)
+        self.assertEqual(stats['SQHelper.get_last_time_entry']['rows_out'], 1)
+
+    def test_table_changes_and_last_rows_are_recorded(self):
+        self.db.insert('Temperature', pd.DataFrame({'timestamp': [1, 2, 3], 'value': [1.0, 2.0, 3.0]}))
+        self.db.get_last_rows('Temperature', 2)
+        self.assertIs(self.db.get_last_rows('Missing', 2), None)
+        self.assertEqual(self.db.remove_row_range('Temperature', 'timestamp', 1, 2), True)
+        self.assertEqual(self.db.remove_row_range('Temperature', 'missing', 1, 2), False)
+        self.assertEqual(self.db.create_table('Bad Name', {'value': 'REAL'}), [])
+        stats = self.instrumentation.get_stats()
+        self.assertEqual(stats['SQHelper.get_last_rows']['rows_out'], 2)
+        self.assertEqual(stats['SQHelper.get_last_rows']['errors'], 1)
+        self.assertEqual(stats['SQHelper.get_last_rows']['statements'], 2)
+        self.assertEqual(stats['SQHelper.remove_row_range']['calls'], 2)
+        self.assertEqual(stats['SQHelper.remove_row_range']['errors'], 1)
+        self.assertEqual(stats['SQHelper.create_table']['calls'], 2)
+        self.assertEqual(stats['SQHelper.create_table']['errors'], 1)
+        self.assertEqual(stats['SQHelper.create_table']['rows_out'], 0)
+
+
+class InfluxHelperInstrumentationTesting(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeInfluxServer().start()
+        self.instrumentation = Instrumentation()
+        self.db = InfluxHelper(test_influx_name, port=self.server.port, instrumentation=self.instrumentation)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_insert_records_bytes_and_requests(self):
+        df = pd.DataFrame({'timestamp': [1, 2], 'temperature': [1.0, 2.0], 'room': ['kitchen', 'bedroom']})
+        self.db.insert('Environment', df, ['temperature'], ['room'], use_timestamp=True)
+        self.db.insert('Environment', {'timestamp': 3, 'temperature': 3.0, 'room': 'hall'}, ['temperature'], ['room'],
+                       use_timestamp=True)
+        stats = self.instrumentation.get_stats()['InfluxHelper.insert']
+        self.assertEqual(stats['calls'], 2)
+        self.assertEqual(stats['rows_in'], 3)
+        self.assertEqual(stats['statements'], 2)
+        self.assertGreater(stats['bytes_sent'], 0)
+        self.assertEqual(sorted(stats['phases']), ['convert', 'write'])
+
+    def test_query_records_rows_out(self):
+        df = pd.DataFrame({'timestamp': [1, 2], 'temperature': [1.0, 2.0]})
+        self.db.insert('Environment', df, ['temperature'], [], use_timestamp=True)
+        self.db.query_range('Environment', ['temperature'], 0, 10)
+        stats = self.instrumentation.get_stats()['InfluxHelper.query_range']
+        self.assertEqual(stats['rows_out'], 2)
+        self.assertEqual(stats['statements'], 1)
+
+    def test_insert_many_failures_are_per_measurement(self):
+        result = self.db.insert_many([('Environment', {'timestamp': 1, 'temperature': 1.0}, ['temperature'], [])],
+                                     use_timestamp=True)
+        self.assertEqual(result, {'Environment': True})
+        stats = self.instrumentation.get_stats()['InfluxHelper.insert_many']
+        self.assertEqual(stats['calls'], 1)
+        self.assertEqual(stats['errors'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import unittest
+import logging
+import os
+import time
+import pandas as pd
+from influxdb.exceptions import InfluxDBClientError
+from dbops.outbox import InfluxOutbox, REJECTED_TABLE
+from dbops.sqhelper import SQHelper
+from dbops.influxhelper import InfluxHelper
+from dbops.fakeinflux import FakeInfluxServer
+
+logging.disable(logging.CRITICAL)
+test_spool_name = "test_spool.sql"
+test_influx_name = 'test_db'
+
+
+class InfluxOutboxTesting(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.fail = False
+        self.outbox = InfluxOutbox(test_spool_name, self.write, batch_size=2, interval=0.01)
+
+    def tearDown(self):
+        self.outbox.stop()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(test_spool_name + suffix):
+                os.remove(test_spool_name + suffix)
+
+    def write(self, lines):
+        if self.fail:
+            raise ConnectionError('Server down')
+        self.sent.append(lines)
+        return True
+
+    def test_append_without_drainer_is_kept(self):
+        self.assertEqual(self.outbox.append(['a value=1 1', 'a value=2 2', 'a value=3 3']), True)
+        stats = self.outbox.get_stats()
+        self.assertEqual(stats['size'], 3)
+        self.assertGreaterEqual(stats['age'], 0)
+        self.assertEqual(self.outbox.flush(timeout=0.1), False)
+
+    def test_drainer_sends_in_batches(self):
+        self.outbox.append(['a value=1 1', 'a value=2 2', 'a value=3 3'])
+        self.outbox.start()
+        self.assertEqual(self.outbox.flush(timeout=5), True)
+        self.assertEqual(self.sent, [['a value=1 1', 'a value=2 2'], ['a value=3 3']])
+        stats = self.outbox.get_stats()
+        self.assertEqual(stats['size'], 0)
+        self.assertEqual(stats['age'], 0)
+        self.assertEqual(stats['drained'], 3)
+        self.assertGreater(stats['drain_rate'], 0)
+
+    def test_failed_writes_are_retried(self):
+        self.fail = True
+        self.outbox.start()
+        self.outbox.append(['a value=1 1'])
+        deadline = time.monotonic() + 5
+        while self.outbox.get_stats()['failures'] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.outbox.get_stats()['size'], 1)
+        self.fail = False
+        self.assertEqual(self.outbox.flush(timeout=5), True)
+        self.assertEqual(self.sent, [['a value=1 1']])
+        self.assertEqual(self.outbox.get_stats()['failures'], 0)
+
+    def test_spool_survives_restart(self):
+        self.outbox.append(['a value=1 1'])
+        self.outbox = InfluxOutbox(test_spool_name, self.write, interval=0.01)
+        self.outbox.start()
+        self.assertEqual(self.outbox.flush(timeout=5), True)
+        self.assertEqual(self.sent, [['a value=1 1']])
+
+    def test_rejected_lines_are_set_aside(self):
+        def write(lines):
+            if any('poison' in line for line in lines):
+                raise InfluxDBClientError('field type conflict', 400)
+            self.sent.append(lines)
+            return True
+        self.outbox = InfluxOutbox(test_spool_name, write, batch_size=4, interval=0.01)
+        self.outbox.append(['a value=1 1', 'a value="poison" 2', 'a value=3 3', 'a value=4 4', 'a value=5 5'])
+        self.outbox.start()
+        self.assertEqual(self.outbox.flush(timeout=5), True)
+        self.assertEqual(sum(self.sent, []), ['a value=1 1', 'a value=3 3', 'a value=4 4', 'a value=5 5'])
+        stats = self.outbox.get_stats()
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(stats['failures'], 0)
+        rejected = SQHelper(test_spool_name).table_to_df(REJECTED_TABLE)
+        self.assertEqual(rejected['line'].tolist(), ['a value="poison" 2'])
+        self.assertIn('field type conflict', rejected['error'][0])
+
+    def test_missing_database_is_retried(self):
+        self.outbox = InfluxOutbox(test_spool_name, self.missing_database, interval=0.01)
+        self.outbox.append(['a value=1 1'])
+        self.outbox.start()
+        self.assertEqual(self.outbox.flush(timeout=0.2), False)
+        self.assertEqual(self.outbox.get_stats()['rejected'], 0)
+
+    def missing_database(self, lines):
+        raise InfluxDBClientError('database not found', 404)
+
+
+class InfluxHelperOutboxTesting(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeInfluxServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(test_spool_name + suffix):
+                os.remove(test_spool_name + suffix)
+
+    def test_inserts_are_spooled_and_sent(self):
+        db = InfluxHelper(test_influx_name, port=self.server.port, outbox=test_spool_name)
+        data = {'timestamp': 1585848415, 'temperature': 23.3, 'count': 2, 'room': 'kitchen'}
+        self.assertEqual(db.insert('Environment', data, field_keys=['temperature', 'count'], tag_keys=['room'],
+                                   use_timestamp=True), True)
+        df = pd.DataFrame({'timestamp': [1585848416, 1585848417], 'temperature': [1.0, 2.0], 'room': ['hall'] * 2})
+        self.assertEqual(db.insert('Environment', df, field_keys=['temperature'], tag_keys=['room'],
+                                   use_timestamp=True), True)
+        self.assertEqual(db.outbox.flush(timeout=5), True)
+        db.outbox.stop()
+        points = self.server.get_points('Environment', test_influx_name)
+        self.assertEqual(points[0], {
+            'time': 1585848415 * 10**9,
+            'tags': {'room': 'kitchen'},
+            'fields': {'temperature': 23.3, 'count': 2}
+        })
+        self.assertEqual([p['fields']['temperature'] for p in points[1:]], [1.0, 2.0])
+
+    def test_entries_without_timestamp_use_spool_time(self):
+        db = InfluxHelper(test_influx_name, port=self.server.port, outbox=test_spool_name)
+        before = time.time_ns()
+        db.insert('Environment', {'temperature': 23.3}, field_keys=['temperature'], tag_keys=[])
+        db.outbox.flush(timeout=5)
+        db.outbox.stop()
+        point_time = self.server.get_points('Environment', test_influx_name)[0]['time']
+        self.assertGreaterEqual(point_time, before)
+        self.assertLessEqual(point_time, time.time_ns())
+
+    def test_inserts_are_kept_while_server_is_down(self):
+        port = self.server.port
+        self.server.stop()
+        db = InfluxHelper(test_influx_name, port=port, retries=1, outbox=test_spool_name)
+        self.assertEqual(db.exists(), True)
+        self.assertEqual(db.insert('Environment', {'timestamp': 1, 'temperature': 1.0}, field_keys=['temperature'],
+                                   tag_keys=[], use_timestamp=True), True)
+        self.assertEqual(db.outbox.flush(timeout=0.2), False)
+        db.outbox.stop()
+        self.assertEqual(db.outbox.get_stats()['size'], 1)
+
+        self.server = FakeInfluxServer().start()
+        db = InfluxHelper(test_influx_name, port=self.server.port, outbox=test_spool_name)
+        self.assertEqual(db.outbox.flush(timeout=5), True)
+        db.outbox.stop()
+        self.assertEqual(len(self.server.get_points('Environment', test_influx_name)), 1)
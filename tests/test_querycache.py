@@ -0,0 +1,84 @@
+import unittest
+import logging
+import threading
+import time
+from dbops.querycache import QueryCache
+
+logging.disable(logging.CRITICAL)
+
+
+class QueryCacheTesting(unittest.TestCase):
+    def setUp(self):
+        self.calls = 0
+
+    def load(self, result={'value': 1}, delay=0):
+        self.calls += 1
+        time.sleep(delay)
+        return result
+
+    def test_result_is_cached_until_ttl(self):
+        cache = QueryCache(ttl=0.05)
+        self.assertEqual(cache.get('q', 'm', self.load), {'value': 1})
+        self.assertEqual(cache.get('q', 'm', self.load), {'value': 1})
+        self.assertEqual(self.calls, 1)
+        time.sleep(0.06)
+        cache.get('q', 'm', self.load)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_results_are_copies(self):
+        cache = QueryCache()
+        cache.get('q', 'm', self.load)['value'] = 2
+        self.assertEqual(cache.get('q', 'm', self.load), {'value': 1})
+
+    def test_zero_ttl_and_none_results_are_not_cached(self):
+        cache = QueryCache()
+        cache.get('q', 'm', self.load, ttl=0)
+        cache.get('q', 'm', self.load, ttl=0)
+        cache.get('n', 'm', lambda: self.load(None))
+        cache.get('n', 'm', lambda: self.load(None))
+        self.assertEqual(self.calls, 4)
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = QueryCache(max_entries=2)
+        cache.get('a', 'm', self.load)
+        cache.get('b', 'm', self.load)
+        cache.get('a', 'm', self.load)
+        cache.get('c', 'm', self.load)
+        self.assertEqual(self.calls, 3)
+        cache.get('a', 'm', self.load)
+        self.assertEqual(self.calls, 3)
+        cache.get('b', 'm', self.load)
+        self.assertEqual(self.calls, 4)
+
+    def test_invalidate_measurement(self):
+        cache = QueryCache()
+        cache.get('a', 'Environment', self.load)
+        cache.get('b', 'one_year.Environment', self.load)
+        cache.get('c', 'Power', self.load)
+        cache.invalidate('Environment')
+        self.assertEqual(len(cache), 1)
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+    def test_concurrent_misses_are_coalesced(self):
+        cache = QueryCache()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get('q', 'm', lambda: self.load(delay=0.1))))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [{'value': 1}] * 5)
+
+    def test_result_loaded_during_invalidation_is_not_cached(self):
+        cache = QueryCache()
+        thread = threading.Thread(target=lambda: cache.get('q', 'm', lambda: self.load(delay=0.1)))
+        thread.start()
+        time.sleep(0.02)
+        cache.invalidate('m')
+        thread.join()
+        self.assertEqual(len(cache), 0)
@@ -1,10 +1,15 @@
 import unittest
+import importlib.util
 import logging
 import os
+import time
+import sqlite3 as sq
 import sys
 from io import StringIO
 from dbops.sqhelper import SQHelper
+from dbops.arraycolumn import ARRAY
 import pandas as pd
+import numpy as np
 
 test_db_name = "test_db.sql"
 
@@ -1094,6 +1099,288 @@ class SQHelperTesting(unittest.TestCase):
         data = [1234569, 83.3]
         self.db.insert(newtablename, data)
 
+    def test_insert_with_deadband_drops_unchanged_rows(self):
+        self.db.create_table('Environment', {'timestamp': 'NUMERIC', 'sensor': 'TEXT', 'value': 'REAL'})
+        self.db.set_deadband('Environment', {'value': 0.5}, heartbeat=60, series_keys=['sensor'])
+        self.assertIs(self.db.insert('Environment', {'timestamp': 0, 'sensor': 'a', 'value': 1.0}), True)
+        self.assertIs(self.db.insert('Environment', {'timestamp': 1, 'sensor': 'a', 'value': 1.2}), True)
+        self.assertIs(self.db.insert('Environment', ['b', 2, 1.2]), True)
+        self.assertIs(self.db.insert('Environment', ['b', 3, 1.3]), True)
+        df = pd.DataFrame({'timestamp': [4, 60, 64], 'sensor': ['a'] * 3, 'value': [2.0, 2.0, 2.1]})
+        self.assertIs(self.db.insert('Environment', df), True)
+        self.assertEqual(list(self.db.table_to_df('Environment')['timestamp']), [0, 2, 4, 64])
+
+    def test_insert_with_deadband_bulk_tuples(self):
+        self.db.create_table('Environment', {'timestamp': 'NUMERIC', 'value': 'REAL'})
+        self.db.set_deadband('Environment', {'value': 0.5})
+        self.assertIs(self.db.insert('Environment', [(1, 1.0), (2, 1.1), (3, 5.0)]), True)
+        self.assertIs(self.db.insert('Environment', [(4, 'a', 'b')]), False)
+        self.assertEqual(list(self.db.table_to_df('Environment')['timestamp']), [1, 3])
+
+    def test_insert_with_deadband_remembers_only_written_rows(self):
+        self.db.create_table('Environment', {'timestamp': 'NUMERIC', 'value': 'REAL'})
+        self.db.set_deadband('Environment', {'value': 0.5})
+        self.db.insert('Environment', {'timestamp': 0, 'value': 1.0})
+        self.db.con.execute("CREATE TRIGGER fail BEFORE INSERT ON Environment BEGIN SELECT RAISE(ABORT, 'full'); END")
+        with self.assertRaises(sq.IntegrityError):
+            self.db.insert('Environment', {'timestamp': 1, 'value': 2.0})
+        self.db.con.execute("DROP TRIGGER fail")
+        self.assertIs(self.db.insert('Environment', {'timestamp': 1, 'value': 2.0}), True)
+        self.assertEqual(list(self.db.table_to_df('Environment')['timestamp']), [0, 1])
+
+    def test_insert_after_deadband_removed(self):
+        self.db.create_table('Environment', {'timestamp': 'NUMERIC', 'value': 'REAL'})
+        self.db.set_deadband('Environment', {'value': 0.5})
+        self.db.insert('Environment', {'timestamp': 0, 'value': 1.0})
+        self.db.insert('Environment', {'timestamp': 1, 'value': 1.0})
+        self.db.set_deadband('Environment', None)
+        self.db.insert('Environment', {'timestamp': 2, 'value': 1.0})
+        self.assertEqual(list(self.db.table_to_df('Environment')['timestamp']), [0, 2])
+
+    def test_slow_queries_are_logged_with_plan(self):
+        db = SQHelper(test_db_name, slow_query_threshold=0)
+        db.create_table('Environment', {'timestamp': 'NUMERIC', 'value': 'REAL'})
+        with self.assertLogs('dbops.sqhelper', level='WARNING') as logs:
+            logging.disable(logging.NOTSET)
+            try:
+                db.insert('Environment', {'timestamp': 1, 'value': 1.0})
+                db.get_row_range('Environment', 'timestamp', 0, 10)
+            finally:
+                logging.disable(logging.CRITICAL)
+        self.assertIn('INSERT INTO Environment', logs.output[0])
+        self.assertIn('(1, 1.0)', logs.output[0])
+        self.assertIn('SELECT * FROM Environment WHERE timestamp BETWEEN 0 AND 10', logs.output[1])
+        self.assertIn('SCAN', logs.output[1])
+
+    def test_explain_shows_index_use(self):
+        self.db.create_table('Environment', {'timestamp': 'NUMERIC', 'value': 'REAL'})
+        plan = self.db.explain('get_row_range', table='Environment', column='timestamp', minimum=0, maximum=10)
+        self.assertTrue(plan[0].startswith('SCAN'))
+        self.db.con.execute("CREATE INDEX Environment_timestamp ON Environment (timestamp)")
+        plan = self.db.explain('get_row_range', table='Environment', column='timestamp', minimum=0, maximum=10)
+        self.assertIn('USING INDEX Environment_timestamp', plan[0])
+        self.assertIn('USING INDEX', self.db.explain('get_last_rows', table='Environment', maximum=5)[0])
+        self.assertIs(self.db.explain('get_row', table='Environment', column='missing', query='a'), None)
+        self.assertIs(self.db.explain('unknown', table='Environment'), None)
+        self.assertIs(self.db.explain('get_row_range', table='Environment'), None)
+
+    def create_result_table(self):
+        self.db.create_table('Environment', {'timestamp': 'NUMERIC', 'room': 'TEXT', 'value': 'REAL'})
+        self.db.insert('Environment', pd.DataFrame({'timestamp': [1, 2, 3], 'room': ['a', 'b', 'c'],
+                                                    'value': [1.5, 2.5, 3.5]}))
+
+    def test_result_formats(self):
+        self.create_result_table()
+        self.assertEqual(self.db.get_row_range('Environment', 'timestamp', 2, 3, result='tuples'),
+                         [('b', 2, 2.5), ('c', 3, 3.5)])
+        self.assertEqual(self.db.get_row('Environment', 'room', 'a', result='dicts'),
+                         [{'room': 'a', 'timestamp': 1, 'value': 1.5}])
+        array = self.db.table_to_df('Environment', result='numpy')
+        self.assertEqual(array.dtype.names, ('room', 'timestamp', 'value'))
+        self.assertEqual(array['timestamp'].dtype, 'int64')
+        self.assertEqual(list(array['value']), [1.5, 2.5, 3.5])
+        self.assertEqual(len(self.db.get_last_rows('Environment', 2, result='numpy')), 2)
+        self.assertEqual(self.db.get_row_range('Environment', 'timestamp', 5, 6, result='numpy').dtype.names,
+                         ('room', 'timestamp', 'value'))
+        self.assertIs(self.db.table_to_df('Environment', result='xml'), None)
+
+    def test_default_result_format(self):
+        self.create_result_table()
+        db = SQHelper(test_db_name, result='tuples')
+        self.assertEqual(db.get_last_rows('Environment', 1), [('c', 3, 3.5)])
+        self.assertEqual(type(db.get_last_rows('Environment', 1, result='dataframe')), pd.DataFrame)
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'), "pyarrow is not installed")
+    def test_arrow_result_format(self):
+        self.create_result_table()
+        table = self.db.table_to_df('Environment', result='arrow')
+        self.assertEqual(table.column_names, ['room', 'timestamp', 'value'])
+        self.assertEqual(table.num_rows, 3)
+
+    @unittest.skipIf(importlib.util.find_spec('pyarrow'), "pyarrow is installed")
+    def test_arrow_result_format_without_pyarrow(self):
+        self.create_result_table()
+        self.assertIs(self.db.table_to_df('Environment', result='arrow'), None)
+
+    def test_table_to_df_with_workers_matches_serial_read(self):
+        self.db.create_table('Environment', {'timestamp': 'NUMERIC', 'room': 'TEXT', 'value': 'REAL'})
+        self.db.insert('Environment', pd.DataFrame({'timestamp': range(10), 'room': list('abcdefghij'),
+                                                    'value': [i / 2 for i in range(10)]}))
+        self.db.remove_row_range('Environment', 'timestamp', 3, 4)
+        expected = self.db.table_to_df('Environment')
+        pd.testing.assert_frame_equal(self.db.table_to_df('Environment', workers=3), expected)
+        self.assertEqual(self.db.table_to_df('Environment', workers=3, result='tuples'),
+                         self.db.table_to_df('Environment', result='tuples'))
+        array = self.db.table_to_df('Environment', workers=3, result='numpy')
+        self.assertEqual(list(array['room']), list(expected['room']))
+        self.assertEqual(array['timestamp'].dtype, 'int64')
+
+    def test_table_to_df_with_workers_and_rowid_gap(self):
+        self.db.create_table('Environment', {'timestamp': 'INTEGER', 'value': 'REAL'})
+        self.db.insert('Environment', pd.DataFrame({'timestamp': range(100), 'value': [i / 2 for i in range(100)]}))
+        self.db.remove_row_range('Environment', 'timestamp', 20, 80)
+        expected = self.db.table_to_df('Environment')
+        pd.testing.assert_frame_equal(self.db.table_to_df('Environment', workers=4), expected)
+        array = self.db.table_to_df('Environment', result='numpy', workers=4)
+        self.assertEqual(array.dtype, self.db.table_to_df('Environment', result='numpy').dtype)
+        self.assertEqual(len(array), 39)
+
+    def test_table_to_df_with_workers_empty_and_missing_table(self):
+        self.db.create_table('Environment', {'timestamp': 'NUMERIC', 'value': 'REAL'})
+        self.assertEqual(len(self.db.table_to_df('Environment', workers=2)), 0)
+        self.assertIs(self.db.table_to_df('Missing', workers=2), None)
+
+    def test_insert_matches_dict_keys_to_columns_by_name(self):
+        self.db.create_table('Environment', "value REAL, timestamp INTEGER")
+        self.assertIs(self.db.insert('Environment', {'timestamp': 1, 'value': 1.5}), True)
+        self.assertIs(self.db.insert('Environment', pd.DataFrame({'timestamp': [2], 'value': [2.5]})), True)
+        self.assertIs(self.db.insert('Environment', [(3.5, 3), (4.5, 4)]), True)
+        self.assertIs(self.db.insert('Environment', {'timestamp': 5}), False)
+        self.assertIs(self.db.insert('Environment', [(6.5, 6), (7.5, )]), False)
+        rows = self.db.con.execute("SELECT * FROM Environment").fetchall()
+        self.assertEqual(rows, [(1.5, 1), (2.5, 2), (3.5, 3), (4.5, 4)])
+
+    def test_insert_uses_new_columns_after_table_is_recreated(self):
+        self.db.create_table('Environment', {'timestamp': 'INTEGER'})
+        self.assertIs(self.db.insert('Environment', {'timestamp': 1}), True)
+        self.db.remove_table('Environment')
+        self.db.create_table('Environment', {'timestamp': 'INTEGER', 'value': 'REAL'})
+        self.assertIs(self.db.insert('Environment', {'timestamp': 2, 'value': 2.0}), True)
+        # Changed by another connection, the failed insert looks the columns up again.
+        self.db.con.execute("ALTER TABLE Environment ADD COLUMN room TEXT")
+        self.assertIs(self.db.insert('Environment', [3, 3.0]), False)
+        self.assertIs(self.db.insert('Environment', [3, 3.0, 'hall']), True)
+        self.db.con.execute("ALTER TABLE Environment ADD COLUMN sensor TEXT")
+        self.assertIs(self.db.insert('Environment', {'timestamp': 4, 'value': 4.0, 'room': 'hall', 'sensor': 'a'}),
+                      True)
+        self.db.con.execute("ALTER TABLE Environment ADD COLUMN unit TEXT")
+        df = pd.DataFrame({'timestamp': [5], 'value': [5.0], 'room': ['hall'], 'sensor': ['a'], 'unit': ['C']})
+        self.assertIs(self.db.insert('Environment', df), True)
+        self.assertIs(self.db.insert('Environment', {'timestamp': 6}), False)
+        self.assertEqual(len(self.db.table_to_df('Environment')), 4)
+
+    def test_insert_with_coerce_types(self):
+        self.db.con.close()
+        self.db = SQHelper(test_db_name, coerce_types=True)
+        self.db.create_table('Environment', "timestamp INTEGER, value REAL, room TEXT, reading NUMERIC, raw")
+        self.assertIs(self.db.insert('Environment', [1.0, '2.5', 3, '4', b'x']), True)
+        self.assertIs(self.db.insert('Environment', {'timestamp': '5', 'value': None, 'room': 'hall',
+                                                     'reading': '6.5', 'raw': 7}), True)
+        self.assertIs(self.db.insert('Environment', pd.DataFrame({'timestamp': [8], 'value': [9], 'room': ['a'],
+                                                                  'reading': [10.0], 'raw': ['b']})), True)
+        self.assertIs(self.db.insert('Environment', [1.5, 2.5, 'a', 1, None]), False)
+        self.assertIs(self.db.insert('Environment', [1, 'abc', 'a', 1, None]), False)
+        self.assertIs(self.db.insert('Environment', [1, 2.5, 'a', 'abc', None]), False)
+        rows = self.db.con.execute("SELECT * FROM Environment").fetchall()
+        self.assertEqual(rows, [(1, 2.5, '3', 4, b'x'), (5, None, 'hall', 6.5, 7), (8, 9.0, 'a', 10.0, 'b')])
+
+    def create_reader_table(self):
+        self.db.create_table('Environment', {'timestamp': 'INTEGER', 'value': 'REAL'})
+        self.db.insert('Environment', pd.DataFrame({'timestamp': [1, 2, 3], 'value': [1.0, 2.0, 3.0]}))
+
+    def test_read_only_mode_reads_and_refuses_writes(self):
+        self.create_reader_table()
+        reader = SQHelper(test_db_name, mode='ro')
+        self.assertIs(reader.exists(), True)
+        self.assertEqual(reader.get_table_names(), ['Environment'])
+        self.assertEqual(len(reader.get_row_range('Environment', 'timestamp', 2, 3)), 2)
+        self.assertIs(reader.insert('Environment', [4, 4.0]), False)
+        self.assertIs(reader.remove_row_range('Environment', 'timestamp', 1, 3), False)
+        self.assertIs(reader.remove_table('Environment'), False)
+        self.assertEqual(reader.create_table('Other', {'timestamp': 'INTEGER'}), [])
+        with self.assertRaises(sq.OperationalError):
+            reader.con.execute("DELETE FROM Environment")
+        # The reader sees rows committed by the writer.
+        self.db.insert('Environment', [4, 4.0])
+        self.assertEqual(len(reader.table_to_df('Environment')), 4)
+        reader.con.close()
+
+    def test_immutable_mode_uses_mmap_and_partitioned_reads(self):
+        self.create_reader_table()
+        self.db.con.close()
+        reader = SQHelper(test_db_name, mode='immutable')
+        self.assertGreater(reader.con.execute("PRAGMA mmap_size").fetchone()[0], 0)
+        self.assertIs(reader.insert('Environment', [4, 4.0]), False)
+        self.assertEqual(reader.table_to_df('Environment', workers=2)['timestamp'].tolist(), [1, 2, 3])
+        reader.con.close()
+        self.db = SQHelper(test_db_name)
+
+    def test_read_only_mode_without_database(self):
+        reader = SQHelper('missing_' + test_db_name, mode='ro')
+        self.assertIs(reader.exists(), False)
+        self.assertIs(os.path.exists('missing_' + test_db_name), False)
+        self.assertIs(SQHelper(test_db_name, mode='append').exists(), False)
+
+    def test_table_stats_follow_inserts_and_deletes(self):
+        self.db.create_table('Existing', {'timestamp': 'INTEGER', 'value': 'REAL'})
+        self.db.insert('Existing', pd.DataFrame({'timestamp': [5, 6], 'value': [1.0, 2.0]}))
+        self.assertIs(self.db.get_table_stats(), None)
+        self.db.con.close()
+        self.db = SQHelper(test_db_name, table_stats=True)
+        self.db.create_table('Environment', {'timestamp': 'INTEGER', 'value': 'REAL'})
+        self.db.create_table('Names', "name TEXT")
+        self.assertEqual(self.db.get_table_names(), ['Existing', 'Environment', 'Names'])
+
+        self.db.insert('Environment', pd.DataFrame({'timestamp': [3, 1, 2, 4], 'value': [1.0, 2.0, 3.0, 4.0]}))
+        self.db.insert('Names', ['a'])
+        # Rows written by other connections are counted too.
+        other = SQHelper(test_db_name)
+        other.insert('Environment', [0, 1.0])
+        other.con.close()
+        stats = self.db.get_table_stats()
+        self.assertEqual(stats['Existing'], {'rows': 2, 'min_timestamp': 5, 'max_timestamp': 6, 'last_insert': None})
+        self.assertEqual((stats['Environment']['rows'], stats['Environment']['min_timestamp'],
+                          stats['Environment']['max_timestamp']), (5, 0, 4))
+        self.assertAlmostEqual(stats['Environment']['last_insert'], time.time(), delta=60)
+        self.assertEqual((stats['Names']['rows'], stats['Names']['min_timestamp']), (1, None))
+
+        self.db.remove_row_range('Environment', 'timestamp', 0, 1)
+        self.db.remove_row_range('Environment', 'timestamp', 3, 3)
+        stats = self.db.get_table_stats()['Environment']
+        self.assertEqual((stats['rows'], stats['min_timestamp'], stats['max_timestamp']), (2, 2, 4))
+        self.db.remove_table('Names')
+        self.assertEqual(sorted(self.db.get_table_stats()), ['Environment', 'Existing'])
+
+    def test_table_stats_read_only_and_recreated_table(self):
+        self.db.con.close()
+        self.db = SQHelper(test_db_name, table_stats=True)
+        self.db.create_table('Environment', {'timestamp': 'INTEGER', 'value': 'REAL'})
+        self.db.insert('Environment', pd.DataFrame({'timestamp': [1, 2, 3], 'value': [1.0, 2.0, 3.0]}))
+        self.db.con.execute("DELETE FROM Environment WHERE timestamp = 3")
+        self.db.con.commit()
+        reader = SQHelper(test_db_name, mode='ro', table_stats=True)
+        self.assertEqual(reader.get_table_stats()['Environment']['max_timestamp'], 2)
+        reader.con.close()
+
+        self.db.con.execute("DROP TABLE Environment")
+        self.db.create_table('Environment', {'timestamp': 'INTEGER', 'value': 'REAL'})
+        self.assertEqual(self.db.get_table_stats()['Environment']['rows'], 0)
+
+    def test_array_columns(self):
+        self.db.create_table('Waveform', {'timestamp': 'INTEGER', 'samples': ARRAY('float32', 4),
+                                          'spectrum': ARRAY('float64', None, 'zlib')})
+        self.assertIs(self.db.insert('Waveform', {'timestamp': 1, 'samples': np.arange(4), 'spectrum': [1.0]}), True)
+        self.assertIs(self.db.insert('Waveform', [np.ones(4), None, 2]), True)
+        self.assertIs(self.db.insert('Waveform', pd.DataFrame({'timestamp': [3], 'samples': [np.zeros(4)],
+                                                               'spectrum': [np.arange(3.0)]})), True)
+        self.assertIs(self.db.insert('Waveform', {'timestamp': 4, 'samples': np.arange(5), 'spectrum': None}), False)
+
+        df = self.db.table_to_df('Waveform')
+        np.testing.assert_array_equal(df['samples'][0], [0, 1, 2, 3])
+        self.assertEqual(df['samples'][0].dtype, np.float32)
+        self.assertIs(df['spectrum'][1], None)
+        np.testing.assert_array_equal(df['spectrum'][2], [0, 1, 2])
+        np.testing.assert_array_equal(self.db.get_last_time_entry('Waveform')['samples'], np.zeros(4))
+
+        array = self.db.get_row_range('Waveform', 'timestamp', 1, 3, result='numpy')
+        self.assertEqual(array['samples'].shape, (3, 4))
+        np.testing.assert_array_equal(array['samples'][:, 0], [0, 1, 0])
+        self.assertEqual(array['spectrum'].dtype, object)
+        self.assertEqual(self.db.get_row_range('Waveform', 'timestamp', 5, 6, result='numpy')['samples'].shape,
+                         (0, 4))
+        parts = self.db.table_to_df('Waveform', result='numpy', workers=2)
+        np.testing.assert_array_equal(parts['samples'], array['samples'])
+
 
 if __name__ == '__main__':
     unittest.main()